@@ -0,0 +1,75 @@
+'''Helpers for reading and writing A1 ranges such as "RawAuto!E2:X100", "Audio!A:A" or "Sheet!2:2".
+
+Rows and columns are 1-based, matching what the Sheets API shows to users.
+'''
+
+import re
+
+_ENDPOINT = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+def col_num_to_letter(n):
+    """Convert a column number to a letter (e.g., 1 -> A, 27 -> AA)."""
+    string = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
+
+def col_letter_to_num(letters):
+    """Convert a column letter to a number (e.g., A -> 1, AA -> 27)."""
+    n = 0
+    for char in letters.upper():
+        n = n * 26 + ord(char) - 64
+    return n
+
+def split_sheet(range_name):
+    """Split "Sheet!A1:B2" into ("Sheet", "A1:B2"). A bare sheet name returns (name, "")."""
+    if '!' in range_name:
+        sheet, cells = range_name.rsplit('!', 1)
+    else:
+        sheet, cells = range_name, ''
+    if len(sheet) >= 2 and sheet[0] == "'" and sheet[-1] == "'":
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, cells
+
+def parse_range(range_name):
+    """Parse an A1 range into (sheet, start_row, start_col, end_row, end_col).
+
+    Open ends (e.g. the rows of "A:A" or the end column of "A2:2") are None,
+    so a bare sheet name parses to (sheet, 1, 1, None, None).
+    """
+    sheet, cells = split_sheet(range_name)
+    if not cells:
+        return sheet, 1, 1, None, None
+
+    parts = cells.split(':')
+    start_letters, start_digits = _ENDPOINT.match(parts[0]).groups()
+    if len(parts) == 1:
+        end_letters, end_digits = start_letters, start_digits
+    else:
+        end_letters, end_digits = _ENDPOINT.match(parts[1]).groups()
+
+    start_row = int(start_digits) if start_digits else None
+    start_col = col_letter_to_num(start_letters) if start_letters else None
+    end_row = int(end_digits) if end_digits else None
+    end_col = col_letter_to_num(end_letters) if end_letters else None
+
+    # "A2:2" and "1:1" start at column A, "A:A" starts at row 1
+    if start_col is None and (end_col is not None or start_row is not None):
+        start_col = 1
+    if start_row is None:
+        start_row = 1
+    return sheet, start_row, start_col, end_row, end_col
+
+def quote_sheet(sheet):
+    """Quote a sheet title for use in a range when it needs it."""
+    if re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', sheet):
+        return sheet
+    return "'" + sheet.replace("'", "''") + "'"
+
+def format_range(sheet, start_row, start_col, end_row=None, end_col=None):
+    """Build "Sheet!C2" or "Sheet!C2:E10" from 1-based coordinates."""
+    cells = f"{col_num_to_letter(start_col)}{start_row}"
+    if end_row is not None and (end_row, end_col) != (start_row, start_col):
+        cells += f":{col_num_to_letter(end_col)}{end_row}"
+    return f"{quote_sheet(sheet)}!{cells}" if sheet else cells
@@ -0,0 +1,36 @@
+'''Formulas that fill a whole column or block from one cell.
+
+Each builder returns a single ARRAYFORMULA with the same results as the
+per-cell formulas the scripts write, to be placed in the top-left cell of the
+block. Sheets then keeps one formula and one dependency range instead of one
+per cell. Every other cell of the block must be empty, or the result cannot
+expand and the formula shows #REF!.
+'''
+
+from a1_notation import col_num_to_letter
+
+def block_range(sheet, first_row, last_row, first_col, last_col):
+    """Build "Sheet!E3:X100" (sheet may be None for a range on the same sheet)."""
+    cells = f"{col_num_to_letter(first_col)}{first_row}:{col_num_to_letter(last_col)}{last_row}"
+    return f"{sheet}!{cells}" if sheet else cells
+
+def substitute_block_formula(audio_sheet_name, first_row, last_row, first_col, last_col):
+    """One formula for =SUBSTITUTE(Audio!X{n}, "RE-", "", 1)*1 over a block, with 0 for blank cells."""
+    cells = block_range(audio_sheet_name, first_row, last_row, first_col, last_col)
+    return f'=ARRAYFORMULA(IF(LEN(TRIM({cells}))=0, 0, SUBSTITUTE({cells}, "RE-", "", 1)*1))'
+
+def every_nth_row_formula(sheet, column, first_row, count, step=8, divisor=60, digits=2):
+    """One formula for =ROUND(Sheet!D{first_row + step*i}/divisor, digits), i = 0 .. count-1, down a column."""
+    last_row = first_row + step * (count - 1)
+    cells = f"{sheet}!{column}{first_row}:{column}{last_row}"
+    rows = f"ROW({cells})"
+    return f'=ARRAYFORMULA(ROUND(FILTER({cells}, MOD({rows}-{first_row}, {step})=0)/{divisor}, {digits}))'
+
+def exceeded_formula(column, first_row, count, limit=100):
+    """One formula for =IF(C{n} > limit, "Exceeded", C{n}) over count rows."""
+    cells = f"{column}{first_row}:{column}{first_row + count - 1}"
+    return f'=ARRAYFORMULA(IF({cells} > {limit}, "Exceeded", {cells}))'
+
+def anchored_column(formula, count):
+    """Values for a one-column block: the formula on top and empty cells below for it to expand into."""
+    return [[formula]] + [[""] for _ in range(count - 1)]
@@ -0,0 +1,123 @@
+'''Optional asyncio backend for the Sheets REST API (needs httpx: pip install httpx).
+
+async with AsyncSheetsClient(creds, limiter=limiter) as client:
+    header, column_a = await asyncio.gather(
+        client.values_get(spreadsheet_id, "RawAuto!2:2"),
+        client.values_get(spreadsheet_id, "RawAuto!A:A"),
+    )
+
+All requests share one pooled keep-alive connection set, so independent calls
+overlap instead of waiting on each other. Responses are the same JSON the
+googleapiclient service returns, and failures raise the same HttpError.
+With metrics (a call_metrics.CallMetrics) every call is recorded there, as
+wrap_service does for the googleapiclient backend.
+'''
+
+import asyncio
+from urllib.parse import quote
+
+import httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+
+class AsyncSheetsClient:
+    def __init__(self, creds, limiter=None, max_connections=20, timeout=120.0, transport=None, metrics=None):
+        if httpx is None:
+            raise ImportError("The asyncio backend needs httpx; install it with 'pip install httpx'.")
+        self.creds = creds
+        self.limiter = limiter
+        self.metrics = metrics
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            transport=transport,
+        )
+        self.refresh_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _auth_headers(self):
+        async with self.refresh_lock:
+            if not self.creds.valid:
+                await asyncio.to_thread(self.creds.refresh, Request())
+        headers = {}
+        self.creds.apply(headers)
+        return headers
+
+    async def _send(self, operation, kwargs, method, url, quota, params=None, body=None):
+        """Make the request; operation and kwargs (named as in googleapiclient) are what metrics records."""
+        if self.metrics is None:
+            return await self._request(method, url, quota, params, body)
+        return await self.metrics.observe_async(operation, kwargs, quota,
+                                                lambda record: self._request(method, url, quota, params, body, record))
+
+    async def _request(self, method, url, quota, params=None, body=None, record=None):
+        attempt = 0
+        throttled = 0.0
+        try:
+            while True:
+                if self.limiter:
+                    throttled += await asyncio.to_thread(self.limiter.acquire, quota)
+                response = await self.http.request(method, url, params=params, json=body,
+                                                   headers=await self._auth_headers())
+                if response.status_code < 400:
+                    return response.json()
+
+                delay = self.limiter.retry_delay(response.status_code, quota, attempt) if self.limiter else None
+                if delay is None:
+                    raise HttpError(httplib2.Response({'status': response.status_code}), response.content, uri=url)
+                attempt += 1
+                throttled += delay
+                await asyncio.sleep(delay)
+        finally:
+            if record is not None:
+                record['retries'] = attempt
+                record['throttled_seconds'] = throttled
+
+    @staticmethod
+    def _url(spreadsheet_id, suffix=''):
+        return f'{SHEETS_API_URL}/{quote(spreadsheet_id, safe="")}{suffix}'
+
+    async def get(self, spreadsheet_id, fields=None):
+        params = {'fields': fields} if fields else None
+        return await self._send('spreadsheets.get', {'spreadsheetId': spreadsheet_id},
+                                'GET', self._url(spreadsheet_id), 'read', params=params)
+
+    async def batch_update(self, spreadsheet_id, body):
+        return await self._send('spreadsheets.batchUpdate', {'spreadsheetId': spreadsheet_id, 'body': body},
+                                'POST', self._url(spreadsheet_id, ':batchUpdate'), 'write', body=body)
+
+    async def values_get(self, spreadsheet_id, range_name, value_render_option='FORMATTED_VALUE'):
+        return await self._send('values.get', {'spreadsheetId': spreadsheet_id, 'range': range_name},
+                                'GET', self._url(spreadsheet_id, f'/values/{quote(range_name, safe="")}'), 'read',
+                                params={'valueRenderOption': value_render_option})
+
+    async def values_batch_get(self, spreadsheet_id, ranges, value_render_option='FORMATTED_VALUE'):
+        params = [('ranges', r) for r in ranges] + [('valueRenderOption', value_render_option)]
+        return await self._send('values.batchGet', {'spreadsheetId': spreadsheet_id, 'ranges': ranges},
+                                'GET', self._url(spreadsheet_id, '/values:batchGet'), 'read', params=params)
+
+    async def values_update(self, spreadsheet_id, range_name, values, value_input_option='USER_ENTERED'):
+        body = {'values': values}
+        return await self._send('values.update', {'spreadsheetId': spreadsheet_id, 'range': range_name, 'body': body},
+                                'PUT', self._url(spreadsheet_id, f'/values/{quote(range_name, safe="")}'), 'write',
+                                params={'valueInputOption': value_input_option}, body=body)
+
+    async def values_batch_update(self, spreadsheet_id, data, value_input_option='USER_ENTERED'):
+        body = {'valueInputOption': value_input_option, 'data': data}
+        return await self._send('values.batchUpdate', {'spreadsheetId': spreadsheet_id, 'body': body},
+                                'POST', self._url(spreadsheet_id, '/values:batchUpdate'), 'write', body=body)
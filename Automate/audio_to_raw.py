@@ -13,46 +13,52 @@
 --raw_sheet_name RawAuto
 '''
 
-import os
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import argparse
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
+from array_formulas import substitute_block_formula
+from call_metrics import CallMetrics, stage
+from delta_sync import RowFingerprintStore, changed_row_ranges, row_fingerprint
+from sheet_dimensions import used_columns
+from sheet_metadata import get_metadata
+from sheets_auth import DRIVE_METADATA_SCOPE, build_sheets_service, get_credentials
+from sheets_rate_limiter import (
+    DEFAULT_READ_REQUESTS_PER_MINUTE,
+    DEFAULT_WRITE_REQUESTS_PER_MINUTE,
+    SheetsRateLimiter,
+    wrap_service,
+)
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 # Constants
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+REDELIVERY_PREFIX = "RE-"
+REDELIVERY_NOTE = "Redelivery"
+# =HYPERLINK("url", label), the form the Audio cells take: group 1 is a quoted label, group 2 a bare one (a number)
+HYPERLINK_FORMULA = r'^\s*=\s*HYPERLINK\(\s*"(?:[^"]|"")*"\s*,\s*(?:"((?:[^"]|"")*)"|([^"]*?))\s*\)\s*$'
 
-def get_sheets_service(credentials_file, token_file):
-    creds = None
-    if os.path.exists(token_file):
-        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                credentials_file, SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-        with open(token_file, "w") as token:
-            token.write(creds.to_json())
-
-    try:
-        service = build("sheets", "v4", credentials=creds)
-        return service
-    except HttpError as err:
-        print(err)
-        return None
+def get_sheets_service(credentials_file, token_file, report_startup=False, scopes=SCOPES, metrics=None):
+    """Return (service, credentials)."""
+    start = time.perf_counter()
+    creds = get_credentials(credentials_file, token_file, scopes)
+    auth_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    service = build_sheets_service(creds)
+    build_seconds = time.perf_counter() - start
+    if report_startup:
+        print(f"Startup: imports {IMPORT_SECONDS:.3f}s, credentials {auth_seconds:.3f}s, "
+              f"service build {build_seconds:.3f}s")
+    if metrics:
+        metrics.add_timing('imports', IMPORT_SECONDS)
+        metrics.add_timing('credentials', auth_seconds)
+        metrics.add_timing('service_build', build_seconds)
+    return service, creds
 
 def sheet_exists(service, spreadsheet_id, sheet_name):
-    sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-    sheets = sheet_metadata.get('sheets', [])
-    for sheet in sheets:
-        if sheet['properties']['title'] == sheet_name:
-            return True
-    return False
+    return get_metadata(service, spreadsheet_id).has_sheet(sheet_name)
 
 def create_raw_sheet(service, spreadsheet_id, sheet_name):
     requests = [
@@ -71,6 +77,7 @@ def create_raw_sheet(service, spreadsheet_id, sheet_name):
         spreadsheetId=spreadsheet_id,
         body=body
     ).execute()
+    get_metadata(service, spreadsheet_id).invalidate()
     return response
 
 def col_num_to_letter(n):
@@ -82,16 +89,171 @@ def col_num_to_letter(n):
     return string
 
 def get_column_count(service, spreadsheet_id, sheet_name):
-    result = service.spreadsheets().values().get(
+    # The first row determines the number of columns
+    return used_columns(service, spreadsheet_id, sheet_name, 1)
+
+def transform_audio_rows(audio_rows, first_idx, num_columns, audio_sheet_name):
+    """Yield the Raw sheet rows for audio_rows, whose first row is row first_idx + 1 of the Audio sheet."""
+    for idx, row in enumerate(audio_rows, start=first_idx):
+        new_row = row[:4]  # Copy columns A, B, C, D
+
+        for col in range(4, num_columns):
+            if idx == 1:
+                # This is the header row, copy value as is, preserving hyperlinks
+                new_row.append(row[col] if col < len(row) else "")
+            elif idx == 0:
+                # Skip formula for row 2
+                new_row.append('')
+            else:
+                if col < len(row) and str(row[col]).strip() != "":
+                    col_letter = col_num_to_letter(col + 1)  # Convert column index to letter
+                    new_row.append(f"=SUBSTITUTE({audio_sheet_name}!{col_letter}{idx+1}, \"RE-\", \"\", 1)*1")
+                else:
+                    new_row.append(0)  # If cell is blank, append 0
+
+        yield new_row
+
+def hyperlink_labels(column):
+    """Return the text a column of cells shows: the label of =HYPERLINK("url", label) cells, the others as they are."""
+    import re
+
+    parts = column.str.extract(HYPERLINK_FORMULA, flags=re.IGNORECASE)
+    return parts[0].str.replace('""', '"', regex=False).fillna(parts[1]).fillna(column)
+
+def materialize_audio_rows(audio_rows, first_idx, num_columns, error_value=None):
+    """Return (rows, redelivered): the Raw sheet rows with the values the SUBSTITUTE formulas evaluate to.
+
+    Data cells are parsed a column at a time: a =HYPERLINK("url", label) cell is replaced by its
+    label, which is what SUBSTITUTE sees, then the first "RE-" is dropped and the rest read as a
+    number. Blank cells become 0, and cells that are still not numbers keep their text, or become
+    error_value (e.g. "#VALUE!", which is what the formula shows) when it is given. Rows 1 and 2
+    are handled as in transform_audio_rows. redelivered holds one list of booleans per data row,
+    True where the Audio cell had the "RE-" prefix, and an empty list for rows 1 and 2.
+    """
+    import numpy as np
+    import pandas as pd
+
+    data_start = min(max(2 - first_idx, 0), len(audio_rows))
+    rows = list(transform_audio_rows(audio_rows[:data_start], first_idx, num_columns, None))
+    redelivered = [[] for _ in rows]
+    data_rows = audio_rows[data_start:]
+    width = num_columns - 4
+    if not data_rows or width <= 0:
+        return rows + [row[:4] for row in data_rows], redelivered + [[] for _ in data_rows]
+
+    frame = pd.DataFrame([row[4:num_columns] for row in data_rows]).reindex(columns=range(width))
+    text = frame.fillna("").astype(str).apply(hyperlink_labels)
+    blank = (text.apply(lambda column: column.str.strip()) == "").to_numpy()
+    marked = text.apply(lambda column: column.str.contains(REDELIVERY_PREFIX, regex=False)).to_numpy()
+    numbers = text.apply(
+        lambda column: pd.to_numeric(column.str.replace(REDELIVERY_PREFIX, "", n=1, regex=False).str.strip(), errors="coerce")
+    ).to_numpy(dtype=float)
+
+    numeric = np.isfinite(numbers) & ~blank
+    values = np.array(numbers.tolist(), dtype=object)
+    # Whole numbers are written as ints, like the API returns them
+    whole = numeric & (np.abs(numbers) < 2 ** 53) & (numbers == np.floor(numbers))
+    values[whole] = np.array(numbers[whole].astype(np.int64).tolist(), dtype=object)
+    not_numeric = ~numeric & ~blank
+    values[not_numeric] = frame.to_numpy(dtype=object)[not_numeric] if error_value is None else error_value
+    values[blank] = 0
+
+    for row, data in zip(data_rows, values.tolist()):
+        rows.append(row[:4] + data)
+    redelivered += (marked & ~blank).tolist()
+    return rows, redelivered
+
+def write_redelivery_notes(service, spreadsheet_id, raw_sheet_name, first_idx, redelivered):
+    """Note the Raw data cells that came from "RE-" cells, clearing notes on the other cells written."""
+    if not any(redelivered):
+        return
+    sheet_id = get_metadata(service, spreadsheet_id).sheet_id(raw_sheet_name)
+    rows = [{'values': [{'note': REDELIVERY_NOTE} if flag else {} for flag in flags]} for flags in redelivered]
+    service.spreadsheets().batchUpdate(
         spreadsheetId=spreadsheet_id,
-        range=f'{sheet_name}!1:1'  # Get the first row to determine the number of columns
+        body={'requests': [{
+            'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': first_idx, 'columnIndex': 4},
+                'rows': rows,
+                'fields': 'note'
+            }
+        }]}
     ).execute()
-    values = result.get('values', [])
-    if values:
-        return len(values[0])
-    return 0
 
-def copy_columns(service, spreadsheet_id, audio_sheet_name, raw_sheet_name):
+def array_audio_rows(audio_rows, first_idx, num_columns, audio_sheet_name):
+    """Return the Raw sheet rows with one SUBSTITUTE ARRAYFORMULA for the whole data block instead of one per cell."""
+    data_start = min(max(2 - first_idx, 0), len(audio_rows))
+    rows = list(transform_audio_rows(audio_rows[:data_start], first_idx, num_columns, audio_sheet_name))
+    width = max(num_columns - 4, 0)
+    for row in audio_rows[data_start:]:
+        # Columns A-D are padded so the block always starts in column E; the rest is left for the formula
+        rows.append((row[:4] + [''] * 4)[:4] + [''] * width)
+    if width and len(rows) > data_start:
+        rows[data_start][4] = substitute_block_formula(
+            audio_sheet_name, first_idx + data_start + 1, first_idx + len(rows), 5, num_columns
+        )
+    return rows
+
+def raw_rows(audio_rows, first_idx, num_columns, audio_sheet_name, raw_mode="formula", workers=1):
+    """Return (Raw sheet rows, redelivery flags or None) for raw_mode.
+
+    "formula" writes a SUBSTITUTE formula per cell, "array" one ARRAYFORMULA per block and "values" the numbers.
+    With workers other than 1 the "formula" rows are built on that many processes (0: one per core).
+    """
+    if raw_mode == "values":
+        return materialize_audio_rows(audio_rows, first_idx, num_columns)
+    if raw_mode == "array":
+        return array_audio_rows(audio_rows, first_idx, num_columns, audio_sheet_name), None
+    if workers != 1:
+        from sharded_transform import transform_audio_rows_sharded
+        return transform_audio_rows_sharded(audio_rows, first_idx, num_columns, audio_sheet_name, workers), None
+    return list(transform_audio_rows(audio_rows, first_idx, num_columns, audio_sheet_name)), None
+
+def copy_columns_streaming(service, spreadsheet_id, audio_sheet_name, raw_sheet_name, window_rows,
+                           raw_mode="formula", mark_redeliveries=False):
+    """Copy the Audio sheet window_rows rows at a time so memory stays flat and writes start early."""
+    num_columns = get_column_count(service, spreadsheet_id, audio_sheet_name)
+    end_column_letter = col_num_to_letter(num_columns)
+    row_count, _ = get_metadata(service, spreadsheet_id).grid_size(audio_sheet_name)
+
+    written_rows = 0
+    gap_start = None  # First row of blank rows not yet written (written only if data follows)
+    for start in range(1, row_count + 1, window_rows):
+        end = min(start + window_rows - 1, row_count)
+        result = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f'{audio_sheet_name}!A{start}:{end_column_letter}{end}',
+            valueRenderOption='FORMULA'
+        ).execute()
+        window = result.get('values', [])
+
+        if window:
+            # Blank rows between windows are copied the same way a single full read would copy them
+            first_row = start if gap_start is None else gap_start
+            window = [[] for _ in range(start - first_row)] + window
+            window_values, redelivered = raw_rows(window, first_row - 1, num_columns, audio_sheet_name, raw_mode)
+            service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range=f'{raw_sheet_name}!A{first_row}',
+                valueInputOption='USER_ENTERED',
+                body={'values': window_values}
+            ).execute()
+            if mark_redeliveries and redelivered is not None:
+                write_redelivery_notes(service, spreadsheet_id, raw_sheet_name, first_row - 1, redelivered)
+            written_rows = first_row - 1 + len(window)
+            gap_start = None
+
+        if written_rows < end and gap_start is None:
+            gap_start = written_rows + 1
+
+    # The writes grow the grid to fit, so the cached grid size of the Raw sheet is stale
+    get_metadata(service, spreadsheet_id).invalidate()
+    if not written_rows:
+        print("No data found in the Audio sheet.")
+    return written_rows
+
+def read_audio_values(service, spreadsheet_id, audio_sheet_name):
+    """Return the Audio sheet as (rows with formulas, number of columns)."""
     num_columns = get_column_count(service, spreadsheet_id, audio_sheet_name)
     end_column_letter = col_num_to_letter(num_columns)
 
@@ -101,43 +263,74 @@ def copy_columns(service, spreadsheet_id, audio_sheet_name, raw_sheet_name):
         range=f'{audio_sheet_name}!A1:{end_column_letter}',  # Adjust the range as needed
         valueRenderOption='FORMULA'
     ).execute()
-    audio_values = result.get('values', [])
+    return result.get('values', []), num_columns
+
+def write_raw_values(service, spreadsheet_id, raw_sheet_name, raw_values, state_store=None):
+    if state_store is not None:
+        response = write_changed_rows(service, spreadsheet_id, raw_sheet_name, raw_values, state_store)
+    else:
+        # Update the Raw sheet with the new data
+        body = {
+            'values': raw_values
+        }
+        response = service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range=f'{raw_sheet_name}!A1',
+            valueInputOption='USER_ENTERED',
+            body=body
+        ).execute()
+    # The write grows the grid to fit, so the cached grid size of the Raw sheet is stale
+    get_metadata(service, spreadsheet_id).invalidate()
+    return response
+
+def copy_columns(service, spreadsheet_id, audio_sheet_name, raw_sheet_name, state_store=None,
+                 raw_mode="formula", mark_redeliveries=False, workers=1):
+    audio_values, num_columns = read_audio_values(service, spreadsheet_id, audio_sheet_name)
 
     if not audio_values:
         print("No data found in the Audio sheet.")
         return
 
     # Prepare data for the Raw sheet
-    raw_values = []
-    for idx, row in enumerate(audio_values):
-        new_row = row[:4]  # Copy columns A, B, C, D
+    raw_values, redelivered = raw_rows(audio_values, 0, num_columns, audio_sheet_name, raw_mode, workers)
+    response = write_raw_values(service, spreadsheet_id, raw_sheet_name, raw_values, state_store)
+    if mark_redeliveries and redelivered is not None:
+        write_redelivery_notes(service, spreadsheet_id, raw_sheet_name, 0, redelivered)
+    return response
 
-        for col in range(4, num_columns):
-            if idx == 1:
-                # This is the header row, copy value as is, preserving hyperlinks
-                new_row.append(row[col] if col < len(row) else "")
-            elif idx == 0:
-                # Skip formula for row 2
-                new_row.append('')
-            else:
-                if col < len(row) and row[col].strip() != "":
-                    col_letter = col_num_to_letter(col + 1)  # Convert column index to letter
-                    new_row.append(f"=SUBSTITUTE({audio_sheet_name}!{col_letter}{idx+1}, \"RE-\", \"\", 1)*1")
-                else:
-                    new_row.append(0)  # If cell is blank, append 0
+def write_changed_rows(service, spreadsheet_id, raw_sheet_name, raw_values, state_store):
+    old_fingerprints = state_store.load(spreadsheet_id, raw_sheet_name)
+    new_fingerprints = [row_fingerprint(row) for row in raw_values]
 
-        raw_values.append(new_row)
+    # Write only new or changed rows, one ValueRange per contiguous run
+    data = []
+    for start, end in changed_row_ranges(old_fingerprints, new_fingerprints):
+        data.append({
+            'range': f'{raw_sheet_name}!A{start + 1}',
+            'values': raw_values[start:end]
+        })
 
-    # Update the Raw sheet with the new data
-    body = {
-        'values': raw_values
-    }
-    response = service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=f'{raw_sheet_name}!A1',
-        valueInputOption='USER_ENTERED',
-        body=body
-    ).execute()
+    response = None
+    if data:
+        response = service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                'valueInputOption': 'USER_ENTERED',
+                'data': data
+            }
+        ).execute()
+
+    # Clear rows left over from a longer previous run
+    if old_fingerprints and len(old_fingerprints) > len(new_fingerprints):
+        service.spreadsheets().values().clear(
+            spreadsheetId=spreadsheet_id,
+            range=f'{raw_sheet_name}!{len(new_fingerprints) + 1}:{len(old_fingerprints)}',
+            body={}
+        ).execute()
+
+    state_store.save(spreadsheet_id, raw_sheet_name, new_fingerprints)
+    changed_rows = sum(len(value_range['values']) for value_range in data)
+    print(f"{changed_rows} of {len(raw_values)} rows written in {len(data)} ranges.")
     return response
 
 def main():
@@ -152,23 +345,80 @@ def main():
                         help='Name of the Audio sheet.')
     parser.add_argument('--raw_sheet_name', type=str, default='RawAuto',
                         help='Name of the Raw sheet.')
+    parser.add_argument('--read_requests_per_minute', type=int, default=DEFAULT_READ_REQUESTS_PER_MINUTE,
+                        help='Sheets read quota per minute.')
+    parser.add_argument('--write_requests_per_minute', type=int, default=DEFAULT_WRITE_REQUESTS_PER_MINUTE,
+                        help='Sheets write quota per minute.')
+    parser.add_argument('--max_retries', type=int, default=5,
+                        help='Retries for 429/5xx responses before giving up.')
+    parser.add_argument('--report_startup', action='store_true',
+                        help='Print import, credential and service build times.')
+    parser.add_argument('--raw_mode', choices=['formula', 'array', 'values'], default='formula',
+                        help='Write SUBSTITUTE formulas per cell (formula), one ARRAYFORMULA per block (array) '
+                             'or the numbers parsed locally (values).')
+    parser.add_argument('--mark_redeliveries', action='store_true',
+                        help='With --raw_mode values, add a "Redelivery" note to cells that had the "RE-" prefix.')
+    parser.add_argument('--metrics_json', type=str, default=None,
+                        help='Write a JSON report of every API call to this file.')
+    parser.add_argument('--metrics_prom', type=str, default=None,
+                        help='Write the call metrics in Prometheus text format to this file.')
+    parser.add_argument('--snapshot_cache', type=str, default=None,
+                        help='Directory of on-disk snapshots of fetched ranges, reused while the spreadsheet is unchanged (needs pyarrow and the drive.metadata.readonly scope).')
+    parser.add_argument('--shard_workers', type=int, default=1,
+                        help='Processes that build the formula rows of large sheets (0: one per core). '
+                             'Time it with benchmark.py --shard-workers first: it can be slower than 1.')
+    sync_mode = parser.add_mutually_exclusive_group()
+    sync_mode.add_argument('--incremental_state', type=str, default=None,
+                           help='JSON file of row fingerprints; when set only new or changed rows are written.')
+    sync_mode.add_argument('--window_rows', type=int, default=None,
+                           help='Stream the Audio sheet in windows of this many rows (e.g. 5000).')
 
     args = parser.parse_args()
+    if args.mark_redeliveries and args.raw_mode != 'values':
+        parser.error('--mark_redeliveries needs --raw_mode values')
+    if args.shard_workers != 1 and args.raw_mode != 'formula':
+        parser.error('--shard_workers needs --raw_mode formula')
+    if args.shard_workers != 1 and args.window_rows:
+        parser.error('--shard_workers cannot be used with --window_rows')
 
-    service = get_sheets_service(args.credentials, args.token)
+    scopes = SCOPES + [DRIVE_METADATA_SCOPE] if args.snapshot_cache else SCOPES
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prom else None
+    service, creds = get_sheets_service(args.credentials, args.token, args.report_startup, scopes, metrics)
     if service:
+        limiter = SheetsRateLimiter(args.read_requests_per_minute, args.write_requests_per_minute, args.max_retries)
+        service = wrap_service(service, limiter, metrics)
+        cache = None
+        if args.snapshot_cache:
+            from snapshot_cache import SnapshotCache, drive_version_state, wrap_snapshot_cache
+            cache = SnapshotCache(args.snapshot_cache, drive_version_state(creds))
+            service = wrap_snapshot_cache(service, cache)
+        state_store = RowFingerprintStore(args.incremental_state) if args.incremental_state else None
         try:
-            if not sheet_exists(service, args.spreadsheet_id, args.raw_sheet_name):
-                # Create Raw sheet if it does not exist
-                create_raw_sheet(service, args.spreadsheet_id, args.raw_sheet_name)
-                print("Sheet created.")
+            with stage('copy_columns'):
+                if not sheet_exists(service, args.spreadsheet_id, args.raw_sheet_name):
+                    # Create Raw sheet if it does not exist
+                    create_raw_sheet(service, args.spreadsheet_id, args.raw_sheet_name)
+                    if state_store:
+                        state_store.discard(args.spreadsheet_id, args.raw_sheet_name)
+                    print("Sheet created.")
             
-            # Copy columns and apply formula
-            copy_columns(service, args.spreadsheet_id, args.audio_sheet_name, args.raw_sheet_name)
+                # Copy columns and apply formula
+                if args.window_rows:
+                    copy_columns_streaming(service, args.spreadsheet_id, args.audio_sheet_name, args.raw_sheet_name, args.window_rows,
+                                           args.raw_mode, args.mark_redeliveries)
+                else:
+                    copy_columns(service, args.spreadsheet_id, args.audio_sheet_name, args.raw_sheet_name, state_store,
+                                 args.raw_mode, args.mark_redeliveries, args.shard_workers)
             
-            print("Columns copied with formula applied.")
+                print("Columns copied as values." if args.raw_mode == 'values' else "Columns copied with formula applied.")
         except HttpError as err:
             print(err)
+        print(limiter.report())
+        if cache:
+            print(cache.report())
+        if metrics:
+            print(metrics.report())
+            metrics.export(args.metrics_json, args.metrics_prom)
 
 if __name__ == '__main__':
     main()
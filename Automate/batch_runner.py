@@ -0,0 +1,140 @@
+'''python batch_runner.py
+--credentials-file client_secret.json
+--token-file token.json
+--manifest batches.txt
+--workers 8
+
+Runs audio_to_raw and raw_to_batchAudioSummary for many spreadsheets at once.
+The manifest lists one spreadsheet ID per line (blank lines and # comments are
+ignored); IDs can also be passed with --spreadsheet-ids. OAuth runs once and
+all workers share the same credentials and quota-aware rate limiter.
+'''
+
+import argparse
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from call_metrics import CallMetrics
+from cli_options import metrics_options, mode_options, quota_options
+from district_index import DistrictIndex
+from pipeline import run_pipeline
+from run_journal import RunJournal
+from sheets_auth import SCOPES, build_sheets_service, get_credentials
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run both pipeline stages for many spreadsheets concurrently.",
+                                     parents=[mode_options(), metrics_options(), quota_options()])
+    parser.add_argument('--credentials-file', type=str, required=True, help='Path to the credentials JSON file.')
+    parser.add_argument('--token-file', type=str, required=True, help='Path to the token JSON file.')
+    parser.add_argument('--spreadsheet-ids', type=str, nargs='*', default=[], help='Spreadsheet IDs to process.')
+    parser.add_argument('--manifest', type=str, default=None, help='File with one spreadsheet ID per line.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of spreadsheets processed at the same time.')
+    parser.add_argument('--audio-sheet-name', type=str, default='Audio', help='Name of the Audio sheet.')
+    parser.add_argument('--raw-sheet-name', type=str, default='RawAuto', help='Name of the raw sheet.')
+    parser.add_argument('--target-sheet-name', type=str, default='BatchAudioSummaryAuto', help='Name of the summary sheet.')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='Directory of run journals; an interrupted run started again resumes after its last finished step.')
+    return parser.parse_args()
+
+def read_manifest(path):
+    spreadsheet_ids = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                spreadsheet_ids.append(line)
+    return spreadsheet_ids
+
+def process_spreadsheet(service, spreadsheet_id, audio_sheet_name, raw_sheet_name, target_sheet_name,
+                        summary_mode="formula", rebuild_mode="recreate", raw_mode="formula", formula_mode="cell",
+                        journal=None, district_index=None):
+    """Run both stages for one spreadsheet and return the seconds spent in each."""
+    return run_pipeline(service, spreadsheet_id, audio_sheet_name, raw_sheet_name, target_sheet_name,
+                        summary_mode, rebuild_mode, raw_mode=raw_mode, formula_mode=formula_mode, journal=journal,
+                        district_index=district_index)
+
+def run_batches(spreadsheet_ids, service_factory, workers, **stage_options):
+    """Process spreadsheet_ids on a bounded thread pool.
+
+    service_factory is called once per worker thread, because googleapiclient
+    services are not safe to share between threads.
+    """
+    local = threading.local()
+
+    def worker_service():
+        if not hasattr(local, 'service'):
+            local.service = service_factory()
+        return local.service
+
+    def run_one(spreadsheet_id):
+        start = time.perf_counter()
+        try:
+            timings = process_spreadsheet(worker_service(), spreadsheet_id, **stage_options)
+            status = 'ok'
+        except Exception as err:
+            traceback.print_exc()
+            timings = {}
+            status = f'error: {err}'.splitlines()[0][:120]
+        return {
+            'spreadsheet_id': spreadsheet_id,
+            'status': status,
+            'seconds': time.perf_counter() - start,
+            'timings': timings,
+        }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_one, spreadsheet_ids))
+
+def print_results(results, wall_seconds):
+    width = max([len('spreadsheet')] + [len(r['spreadsheet_id']) for r in results])
+    header = f"{'spreadsheet':<{width}} {'total':>8} {'copy':>8} {'summary':>8} {'extra':>8}  status"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        t = r['timings']
+        stages = [t.get(name) for name in ('copy_columns', 'create_or_update_sheet', 'additional_operations')]
+        cells = ' '.join(f'{s:>8.2f}' if s is not None else f'{"-":>8}' for s in stages)
+        print(f"{r['spreadsheet_id']:<{width}} {r['seconds']:>8.2f} {cells}  {r['status']}")
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    print(f"{len(results)} spreadsheets, {failed} failed, {wall_seconds:.2f}s wall time")
+
+def main():
+    args = parse_arguments()
+    spreadsheet_ids = list(args.spreadsheet_ids)
+    if args.manifest:
+        spreadsheet_ids += read_manifest(args.manifest)
+    if not spreadsheet_ids:
+        sys.exit('No spreadsheet IDs given; use --spreadsheet-ids or --manifest.')
+
+    creds = get_credentials(args.credentials_file, args.token_file, SCOPES)
+    limiter = SheetsRateLimiter(args.read_requests_per_minute, args.write_requests_per_minute, args.max_retries)
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prom else None
+
+    def service_factory():
+        return wrap_service(build_sheets_service(creds), limiter, metrics)
+
+    start = time.perf_counter()
+    results = run_batches(spreadsheet_ids, service_factory, args.workers,
+                          audio_sheet_name=args.audio_sheet_name,
+                          raw_sheet_name=args.raw_sheet_name,
+                          target_sheet_name=args.target_sheet_name,
+                          raw_mode=args.raw_mode,
+                          formula_mode=args.formula_mode,
+                          summary_mode=args.summary_mode,
+                          rebuild_mode=args.rebuild_mode,
+                          journal=RunJournal(args.journal) if args.journal else None,
+                          district_index=DistrictIndex(args.district_index) if args.district_index else None)
+    print_results(results, time.perf_counter() - start)
+    print(limiter.report())
+    if metrics:
+        print(metrics.report())
+        metrics.export(args.metrics_json, args.metrics_prom)
+    if any(r['status'] != 'ok' for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
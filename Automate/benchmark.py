@@ -0,0 +1,195 @@
+'''python benchmark.py --rows 1000,10000,100000 --columns 20
+
+Runs copy_columns, create_or_update_sheet and additional_operations against
+synthetic sheets held by FakeSheetsService and reports wall time, API calls,
+payload bytes and peak memory per stage. No Google account is needed.
+With --shard-workers N it also times the formula-mode RawAuto rows built
+serially against sharded_transform on N processes, results pickled back
+included, which decides whether the pool is worth wiring into audio_to_raw.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from audio_to_raw import (
+    REDELIVERY_PREFIX,
+    col_num_to_letter,
+    copy_columns,
+    create_raw_sheet,
+    sheet_exists,
+    transform_audio_rows,
+)
+from fake_sheets_service import FakeSheetsService
+from raw_to_batchAudioSummary import STATUS_DATA, additional_operations, create_or_update_sheet
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+SPREADSHEET_ID = 'benchmark'
+AUDIO_SHEET_NAME = 'Audio'
+RAW_SHEET_NAME = 'RawAuto'
+TARGET_SHEET_NAME = 'BatchAudioSummaryAuto'
+# The 8 statuses of each district, in the order the Audio sheet lists them
+AUDIO_STATUSES = [status for status in STATUS_DATA if status != 'Delivered for manual QC']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against an in-memory Sheets service.")
+    parser.add_argument('--rows', type=str, default='1000,10000,100000',
+                        help='Comma separated Audio sheet sizes to run (e.g. 1000,10000,100000,1000000).')
+    parser.add_argument('--columns', type=int, default=20, help='Number of Audio columns, including A-D.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Injected latency per API call in seconds.')
+    parser.add_argument('--read-quota', type=int, default=None, help='Injected read quota per minute.')
+    parser.add_argument('--write-quota', type=int, default=None, help='Injected write quota per minute.')
+    parser.add_argument('--summary-mode', choices=['formula', 'values'], default='formula',
+                        help='Summary mode passed to create_or_update_sheet.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc peak memory tracking.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data.')
+    parser.add_argument('--shard-workers', type=int, default=None,
+                        help='Also time the formula rows built serially and on this many processes (0: one per core).')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results to this JSON file.')
+    return parser.parse_args()
+
+def make_audio_sheet(num_rows, num_columns, seed=0):
+    """Build an Audio grid laid out like the real one, with num_rows data rows, 8 rows per district.
+
+    Row 1 holds the batch totals and row 2 the headers, with a HYPERLINK per batch. The
+    statuses cycle in AUDIO_STATUSES order, Minutes is a SUM formula, and every filled
+    batch cell is =HYPERLINK("url", minutes) or =HYPERLINK("url", "RE-minutes").
+    """
+    rng = random.Random(seed)
+    last_column = col_num_to_letter(max(num_columns, 5))
+    totals = [0.0] * (num_columns - 4)
+    rows = [
+        [''] * 4 + totals,
+        ['State', 'Districts', 'Status', 'Minutes']
+        + [f'=HYPERLINK("https://example.com/batch/{c}", "Batch {c - 3}")' for c in range(4, num_columns)],
+    ]
+    for i in range(num_rows):
+        district = i // 8
+        status = AUDIO_STATUSES[i % 8]
+        if i % 8 == 0:
+            status = f'=HYPERLINK("https://example.com/district/{district}", "{status}")'
+        row = [f'State {district // 10}', f'District {district}', status, f'=SUM(E{i + 3}:{last_column}{i + 3})']
+        for c in range(4, num_columns):
+            roll = rng.random()
+            minutes = round(rng.uniform(0, 120), 3)
+            url = f'https://example.com/file/{i}/{c}'
+            if roll < 0.1:
+                row.append('')
+                continue
+            if roll < 0.2:
+                row.append(f'=HYPERLINK("{url}", "{REDELIVERY_PREFIX}{minutes}")')
+            else:
+                row.append(f'=HYPERLINK("{url}", {minutes})')
+            totals[c - 4] += minutes
+        rows.append(row)
+    rows[0][4:] = [round(total, 3) for total in totals]
+    return rows
+
+def run_stage(name, fake, func, track_memory):
+    calls = fake.total_calls
+    request_bytes = fake.request_bytes
+    response_bytes = fake.response_bytes
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    if track_memory:
+        tracemalloc.stop()
+    return {
+        'stage': name,
+        'seconds': elapsed,
+        'api_calls': fake.total_calls - calls,
+        'request_bytes': fake.request_bytes - request_bytes,
+        'response_bytes': fake.response_bytes - response_bytes,
+        'peak_memory_bytes': peak,
+    }
+
+def run_benchmark(num_rows, num_columns, latency=0.0, read_quota=None, write_quota=None,
+                  summary_mode='formula', track_memory=True, seed=0):
+    fake = FakeSheetsService(latency=latency, read_quota_per_minute=read_quota, write_quota_per_minute=write_quota)
+    fake.add_spreadsheet(SPREADSHEET_ID, {AUDIO_SHEET_NAME: make_audio_sheet(num_rows, num_columns, seed)})
+    service = fake
+    if read_quota or write_quota:
+        service = wrap_service(fake, SheetsRateLimiter(read_quota or 10 ** 6, write_quota or 10 ** 6))
+
+    def copy_stage():
+        if not sheet_exists(service, SPREADSHEET_ID, RAW_SHEET_NAME):
+            create_raw_sheet(service, SPREADSHEET_ID, RAW_SHEET_NAME)
+        copy_columns(service, SPREADSHEET_ID, AUDIO_SHEET_NAME, RAW_SHEET_NAME)
+
+    results = [
+        run_stage('copy_columns', fake, copy_stage, track_memory),
+        run_stage('create_or_update_sheet', fake, lambda: create_or_update_sheet(
+            service, SPREADSHEET_ID, RAW_SHEET_NAME, TARGET_SHEET_NAME, summary_mode), track_memory),
+        run_stage('additional_operations', fake, lambda: additional_operations(service, SPREADSHEET_ID), track_memory),
+    ]
+    for result in results:
+        result['rows'] = num_rows
+    return results
+
+def run_shard_benchmark(num_rows, num_columns, workers, seed=0):
+    """Time transform_audio_rows against transform_audio_rows_sharded on the same synthetic sheet."""
+    from sharded_transform import transform_audio_rows_sharded
+
+    audio_rows = make_audio_sheet(num_rows, num_columns, seed)
+    start = time.perf_counter()
+    serial = list(transform_audio_rows(audio_rows, 0, num_columns, AUDIO_SHEET_NAME))
+    serial_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    sharded = transform_audio_rows_sharded(audio_rows, 0, num_columns, AUDIO_SHEET_NAME, workers)
+    sharded_seconds = time.perf_counter() - start
+    return {
+        'rows': num_rows,
+        'workers': workers,
+        'serial_seconds': serial_seconds,
+        'sharded_seconds': sharded_seconds,
+        'identical': sharded == serial,
+    }
+
+def format_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f'{n:.0f}{unit}' if unit == 'B' else f'{n:.1f}{unit}'
+        n /= 1024
+
+def print_table(results):
+    header = f"{'rows':>9} {'stage':<24} {'seconds':>9} {'calls':>6} {'sent':>9} {'received':>9} {'peak mem':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['rows']:>9} {r['stage']:<24} {r['seconds']:>9.3f} {r['api_calls']:>6} "
+              f"{format_bytes(r['request_bytes']):>9} {format_bytes(r['response_bytes']):>9} "
+              f"{format_bytes(r['peak_memory_bytes']):>9}")
+
+def main():
+    args = parse_arguments()
+    results = []
+    for num_rows in [int(n) for n in args.rows.split(',') if n]:
+        results.extend(run_benchmark(num_rows, args.columns, args.latency, args.read_quota, args.write_quota,
+                                     args.summary_mode, not args.no_memory, args.seed))
+    print_table(results)
+
+    shard_results = []
+    if args.shard_workers is not None:
+        print()
+        for num_rows in [int(n) for n in args.rows.split(',') if n]:
+            r = run_shard_benchmark(num_rows, args.columns, args.shard_workers, args.seed)
+            shard_results.append(r)
+            print(f"{r['rows']:>9} formula rows: serial {r['serial_seconds']:.3f}s, "
+                  f"{r['workers']} workers {r['sharded_seconds']:.3f}s "
+                  f"({r['serial_seconds'] / r['sharded_seconds']:.2f}x){'' if r['identical'] else ', OUTPUT DIFFERS'}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'stages': results, 'sharding': shard_results} if shard_results else results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+'''Per-call metrics for every .execute() made through wrap_service.
+
+metrics = CallMetrics()
+service = wrap_service(service, limiter, metrics)
+with stage("copy_columns"):
+    copy_columns(service, ...)
+metrics.write_json("run.json")
+metrics.write_prometheus("run.prom")
+
+Each call is recorded with its stage, operation (e.g. "values.get"), ranges,
+cells read or written, request and response bytes, latency, retries, seconds
+spent throttled, quota class and status (the HTTP status of an HttpError,
+the exception class name of any other failure, or "ok"). The asyncio
+backend records its calls through observe_async. Start-up phases (imports, OAuth, service
+build) can be added with add_timing. The Prometheus file uses the text
+exposition format, so it can be dropped into a node_exporter textfile
+directory.
+'''
+
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from googleapiclient.errors import HttpError
+
+_current = threading.local()
+
+@contextmanager
+def stage(name):
+    """Attribute the calls made by this thread inside the block to stage name."""
+    previous = getattr(_current, 'stage', None)
+    _current.stage = name
+    try:
+        yield
+    finally:
+        _current.stage = previous
+
+def current_stage():
+    return getattr(_current, 'stage', None) or 'other'
+
+def _ranges(operation, kwargs):
+    body = kwargs.get('body') or {}
+    if 'range' in kwargs:
+        return [kwargs['range']]
+    if 'ranges' in kwargs:
+        ranges = kwargs['ranges']
+        return [ranges] if isinstance(ranges, str) else list(ranges)
+    if operation == 'values.batchUpdate':
+        return [value_range['range'] for value_range in body.get('data', [])]
+    if operation == 'spreadsheets.batchUpdate':
+        return [kind for request in body.get('requests', []) for kind in request]
+    return []
+
+def _cells(value_ranges):
+    return sum(len(row) for value_range in value_ranges for row in value_range.get('values', []))
+
+def _cells_touched(operation, kwargs, response):
+    body = kwargs.get('body') or {}
+    if operation == 'values.get':
+        return _cells([response])
+    if operation == 'values.batchGet':
+        return _cells(response.get('valueRanges', []))
+    if operation == 'values.update':
+        return _cells([body])
+    if operation == 'values.batchUpdate':
+        return _cells(body.get('data', []))
+    return 0
+
+def _status(err):
+    return str(err.resp.status) if isinstance(err, HttpError) else type(err).__name__
+
+class CallMetrics:
+    def __init__(self):
+        self.calls = []
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add_timing(self, name, seconds):
+        """Record a phase outside the API calls, e.g. "credentials" or "service_build"."""
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def observe(self, operation, kwargs, quota, run):
+        """Call run(record) (which executes the request and fills in retries) and record the call."""
+        record = self._new_record(operation, kwargs, quota)
+        start = time.perf_counter()
+        try:
+            response = run(record)
+            self._add_response(record, operation, kwargs, response)
+            return response
+        except Exception as err:
+            record['status'] = _status(err)
+            raise
+        finally:
+            self._add_record(record, start)
+
+    async def observe_async(self, operation, kwargs, quota, run):
+        """observe for a coroutine function run(record)."""
+        record = self._new_record(operation, kwargs, quota)
+        start = time.perf_counter()
+        try:
+            response = await run(record)
+            self._add_response(record, operation, kwargs, response)
+            return response
+        except Exception as err:
+            record['status'] = _status(err)
+            raise
+        finally:
+            self._add_record(record, start)
+
+    def _new_record(self, operation, kwargs, quota):
+        return {
+            'stage': current_stage(),
+            'operation': operation,
+            'quota': quota,
+            'spreadsheet_id': kwargs.get('spreadsheetId'),
+            'ranges': _ranges(operation, kwargs),
+            'cells': 0,
+            'request_bytes': len(json.dumps(kwargs['body'])) if kwargs.get('body') is not None else 0,
+            'response_bytes': 0,
+            'retries': 0,
+            'throttled_seconds': 0.0,
+            'status': 'ok',
+        }
+
+    def _add_response(self, record, operation, kwargs, response):
+        record['response_bytes'] = len(json.dumps(response))
+        record['cells'] = _cells_touched(operation, kwargs, response)
+
+    def _add_record(self, record, start):
+        record['latency_seconds'] = time.perf_counter() - start
+        with self.lock:
+            self.calls.append(record)
+
+    def stage_summary(self):
+        """Totals per stage: calls, latency, throttled seconds, bytes, cells and retries."""
+        summary = defaultdict(lambda: {'calls': 0, 'latency_seconds': 0.0, 'throttled_seconds': 0.0,
+                                       'request_bytes': 0, 'response_bytes': 0, 'cells': 0, 'retries': 0})
+        with self.lock:
+            calls = list(self.calls)
+        for record in calls:
+            totals = summary[record['stage']]
+            totals['calls'] += 1
+            for key in ('latency_seconds', 'throttled_seconds', 'request_bytes', 'response_bytes', 'cells', 'retries'):
+                totals[key] += record[key]
+        return dict(summary)
+
+    def report(self):
+        lines = [f"{'stage':<24} {'calls':>6} {'seconds':>8} {'throttled':>9} {'sent':>10} {'received':>10} {'cells':>9} {'retries':>7}"]
+        for name, t in self.stage_summary().items():
+            lines.append(f"{name:<24} {t['calls']:>6} {t['latency_seconds']:>8.2f} {t['throttled_seconds']:>9.2f} "
+                         f"{t['request_bytes']:>10} {t['response_bytes']:>10} {t['cells']:>9} {t['retries']:>7}")
+        return '\n'.join(lines)
+
+    def to_json(self):
+        with self.lock:
+            calls = list(self.calls)
+            timings = dict(self.timings)
+        return {'timings': timings, 'stages': self.stage_summary(), 'calls': calls}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def prometheus_text(self):
+        with self.lock:
+            calls = list(self.calls)
+            timings = dict(self.timings)
+
+        series = defaultdict(float)
+        for record in calls:
+            labels = (('stage', record['stage']), ('operation', record['operation']), ('quota', record['quota']))
+            series[('sheets_api_calls_total', labels + (('status', record['status']),))] += 1
+            series[('sheets_api_latency_seconds_sum', labels)] += record['latency_seconds']
+            series[('sheets_api_latency_seconds_count', labels)] += 1
+            series[('sheets_api_throttled_seconds_total', labels)] += record['throttled_seconds']
+            series[('sheets_api_request_bytes_total', labels)] += record['request_bytes']
+            series[('sheets_api_response_bytes_total', labels)] += record['response_bytes']
+            series[('sheets_api_cells_total', labels)] += record['cells']
+            series[('sheets_api_retries_total', labels)] += record['retries']
+        for phase, seconds in timings.items():
+            series[('sheets_run_phase_seconds', (('phase', phase),))] += seconds
+
+        help_text = {
+            'sheets_api_calls_total': ('counter', 'Sheets API calls made.'),
+            'sheets_api_latency_seconds': ('summary', 'Wall time per call, including throttling and retries.'),
+            'sheets_api_throttled_seconds_total': ('counter', 'Seconds spent waiting for quota or backing off.'),
+            'sheets_api_request_bytes_total': ('counter', 'JSON request body bytes sent.'),
+            'sheets_api_response_bytes_total': ('counter', 'JSON response bytes received.'),
+            'sheets_api_cells_total': ('counter', 'Cells read or written.'),
+            'sheets_api_retries_total': ('counter', 'Retried 429/5xx responses.'),
+            'sheets_run_phase_seconds': ('gauge', 'Seconds spent in start-up phases outside the API calls.'),
+        }
+        lines = []
+        for family, (kind, text) in help_text.items():
+            samples = sorted((name, labels) for name, labels in series if name.startswith(family))
+            if not samples:
+                continue
+            lines.append(f'# HELP {family} {text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels in samples:
+                label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                lines.append(f'{name}{{{label_text}}} {series[(name, labels)]:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as f:
+            f.write(self.prometheus_text())
+
+    def export(self, json_path=None, prometheus_path=None):
+        """Write whichever of the two reports was asked for."""
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,50 @@
+'''Command-line options shared by the pipeline scripts.
+
+parser = argparse.ArgumentParser(parents=[mode_options(), metrics_options(), quota_options()])
+
+Each function returns a parent parser (add_help=False) holding one group of
+options, so their names, choices and help text are defined in one place.
+A script that needs other defaults calls parser.set_defaults on its own
+parser; one that does not take an option leaves it out with the keyword
+arguments of mode_options.
+'''
+
+import argparse
+
+from sheets_rate_limiter import DEFAULT_READ_REQUESTS_PER_MINUTE, DEFAULT_WRITE_REQUESTS_PER_MINUTE
+
+def mode_options(raw_mode=True, rebuild_mode=True, district_index=True):
+    """Return a parent parser with the options choosing how RawAuto and the summary sheet are written."""
+    parser = argparse.ArgumentParser(add_help=False)
+    if raw_mode:
+        parser.add_argument('--raw-mode', choices=['formula', 'array', 'values'], default='formula',
+                            help='Write SUBSTITUTE formulas per cell (formula), one ARRAYFORMULA per block (array) '
+                                 'or the numbers parsed locally (values) to the raw sheet.')
+    parser.add_argument('--formula-mode', choices=['cell', 'array', 'values'], default='cell',
+                        help='Write one formula per row (cell) or one ARRAYFORMULA per column (array) below summary row 13, '
+                             'or the district and state hours computed locally (values).')
+    if district_index:
+        parser.add_argument('--district-index', type=str, default=None,
+                            help='JSON file of district -> state, shared across runs and spreadsheets (with --formula-mode values).')
+    parser.add_argument('--summary-mode', choices=['formula', 'values'], default='formula',
+                        help='Write SUMPRODUCT formulas (formula) or totals computed locally (values).')
+    if rebuild_mode:
+        parser.add_argument('--rebuild-mode', choices=['recreate', 'in-place', 'atomic'], default='recreate',
+                            help='Delete and re-add the target sheet (recreate), write only the changed cells (in-place) '
+                                 'or delete, re-add and fill it, rows 12 on included, in a single batchUpdate (atomic).')
+    return parser
+
+def metrics_options():
+    """Return a parent parser with the --metrics-json and --metrics-prom report files."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--metrics-json', type=str, default=None, help='Write a JSON report of every API call to this file.')
+    parser.add_argument('--metrics-prom', type=str, default=None, help='Write the call metrics in Prometheus text format to this file.')
+    return parser
+
+def quota_options():
+    """Return a parent parser with the Sheets quota and retry options of the rate limiter."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--read-requests-per-minute', type=int, default=DEFAULT_READ_REQUESTS_PER_MINUTE, help='Sheets read quota per minute.')
+    parser.add_argument('--write-requests-per-minute', type=int, default=DEFAULT_WRITE_REQUESTS_PER_MINUTE, help='Sheets write quota per minute.')
+    parser.add_argument('--max-retries', type=int, default=5, help='Retries for 429/5xx responses before giving up.')
+    return parser
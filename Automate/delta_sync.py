@@ -0,0 +1,74 @@
+'''Row fingerprints for incremental RawAuto updates.
+
+copy_columns keeps one short hash per written row in a JSON state file,
+keyed by spreadsheet and sheet. On the next run only rows whose hash changed
+(or that are new) are written, grouped into contiguous ranges.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+def row_fingerprint(row):
+    """Stable hash of a row's cell values."""
+    encoded = json.dumps(row, separators=(',', ':'), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+def changed_row_ranges(old_fingerprints, new_fingerprints):
+    """Return (start, end) index pairs (end exclusive) of rows that are new or differ."""
+    old_fingerprints = old_fingerprints or []
+    ranges = []
+    start = None
+    for i, fingerprint in enumerate(new_fingerprints):
+        changed = i >= len(old_fingerprints) or old_fingerprints[i] != fingerprint
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            ranges.append((start, i))
+            start = None
+    if start is not None:
+        ranges.append((start, len(new_fingerprints)))
+    return ranges
+
+class RowFingerprintStore:
+    """JSON file mapping "spreadsheet_id/sheet_name" to the fingerprints of the rows last written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _write(self, state):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _key(spreadsheet_id, sheet_name):
+        return f'{spreadsheet_id}/{sheet_name}'
+
+    def load(self, spreadsheet_id, sheet_name):
+        with self.lock:
+            return self._read().get(self._key(spreadsheet_id, sheet_name))
+
+    def save(self, spreadsheet_id, sheet_name, fingerprints):
+        with self.lock:
+            state = self._read()
+            state[self._key(spreadsheet_id, sheet_name)] = fingerprints
+            self._write(state)
+
+    def discard(self, spreadsheet_id, sheet_name):
+        """Forget a sheet, e.g. after it was recreated, so the next run rewrites it in full."""
+        with self.lock:
+            state = self._read()
+            if state.pop(self._key(spreadsheet_id, sheet_name), None) is not None:
+                self._write(state)
@@ -0,0 +1,111 @@
+'''District -> state index and the per-district hours of the summary sheet.
+
+index = DistrictIndex("districts.json")
+districts, states = district_hours(raw_rows, CHUNK_STATUSES, index)
+
+The index is a JSON file shared by every run and spreadsheet. Each run adds
+the districts it sees (a district keeps the state it was first seen with) and
+looks up the state of rows whose State cell is blank. district_hours does what
+the ROUND(rawAuto!D{8k+n}/60, 2) formulas of additional_operations do, but
+finds a district's rows by its name and status instead of by position, so the
+8-rows-per-district layout is no longer assumed. It also rolls the hours up
+per state.
+'''
+
+import json
+import os
+import tempfile
+import threading
+
+class DistrictIndex:
+    """JSON file mapping district names to their state."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _write(self, state):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def state(self, district):
+        with self.lock:
+            return self.states.get(district)
+
+    def update(self, pairs):
+        """Add (district, state) pairs for districts not yet indexed; the file is rewritten only when something was added."""
+        with self.lock:
+            # Pick up what other processes added since this one loaded the file
+            states = self._read()
+            added = {district: state for district, state in pairs if district and state and district not in states}
+            if added:
+                states.update(added)
+                self._write(states)
+            self.states = states
+        return len(added)
+
+def district_hours(rows, statuses, index=None):
+    """Return (per-district, per-state) data frames of hours for the given statuses.
+
+    rows are RawAuto rows from row 3 on: State, District, Status, Minutes, then
+    the batch columns. The Status may be a HYPERLINK formula (its label is used)
+    and Minutes a formula such as =SUM(E3:FH3), in which case the row's batch
+    columns are summed, which is what the sheet shows. Districts keep the order
+    in which they first appear; both frames have State, District (per-district
+    only) and one column of hours per status, rounded to 2 decimals.
+    """
+    import pandas as pd
+
+    # The Status cells are =HYPERLINK("url", "label") in the Audio sheet; parsed the way audio_to_raw does
+    from audio_to_raw import hyperlink_labels
+
+    columns = ['State', 'District'] + list(statuses)
+    frame = pd.DataFrame([list(row) for row in rows])
+    if frame.empty or frame.shape[1] < 2:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=['State'] + list(statuses))
+    frame = frame.reindex(columns=range(max(frame.shape[1], 4)))
+
+    text = frame.iloc[:, :4].fillna('').astype(str).apply(lambda column: column.str.strip())
+    frame = frame[text[1] != '']
+    text = text[text[1] != '']
+    state, district = text[0], text[1]
+
+    label = hyperlink_labels(text[2])
+    wanted = {status.lower(): status for status in statuses}
+    status = label.str.lower().map(wanted)
+
+    minutes = pd.to_numeric(frame[3], errors='coerce')
+    formulas = text[3].str.startswith('=')
+    if formulas.any():
+        batch_totals = frame.iloc[:, 4:].apply(pd.to_numeric, errors='coerce').sum(axis=1)
+        minutes = minutes.where(~formulas, batch_totals)
+
+    order = pd.unique(district)
+    first_state = state.where(state != '').groupby(district, sort=False).first().reindex(order)
+    if index is not None:
+        index.update(first_state.dropna().items())
+        first_state = first_state.fillna(pd.Series([index.state(d) for d in order], index=order, dtype=object))
+    first_state = first_state.fillna('')
+
+    hours = (pd.DataFrame({'District': district, 'Status': status, 'Minutes': minutes.fillna(0)})
+             .dropna(subset=['Status'])
+             .pivot_table(index='District', columns='Status', values='Minutes', aggfunc='sum', sort=False)
+             .reindex(index=order, columns=list(statuses))
+             .fillna(0.0)
+             .rename_axis(columns=None) / 60)
+
+    per_district = hours.round(2).reset_index(names='District')
+    per_district.insert(0, 'State', first_state.to_numpy())
+    per_state = hours.groupby(first_state.to_numpy(), sort=False).sum().round(2)
+    per_state = per_state.reset_index(names='State')
+    return per_district[columns], per_state
@@ -0,0 +1,479 @@
+'''In-memory stand-in for the service object returned by get_sheets_service.
+
+service = FakeSheetsService(latency=0.05, write_quota_per_minute=60)
+service.add_spreadsheet("batch-1", {"Audio": [["", ""], ["State", "District"]]})
+copy_columns(service, "batch-1", "Audio", "RawAuto")
+
+Supports the calls the scripts make: spreadsheets().get/batchUpdate (addSheet,
+deleteSheet, appendDimension, updateCells for values and notes)
+and spreadsheets().values().get/batchGet/update/batchUpdate/clear.
+A spreadsheets().batchUpdate is all or nothing, as on the real service.
+Formulas are stored as text and are never evaluated. USER_ENTERED dates
+(MM-DD-YYYY, MM/DD/YYYY, YYYY-MM-DD) are stored as date serial numbers shown
+as M/D/YYYY, and read back as serials unless dateTimeRenderOption is
+FORMATTED_STRING.
+'''
+
+import copy
+import datetime
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from a1_notation import format_range, parse_range
+
+DEFAULT_ROW_COUNT = 1000
+DEFAULT_COLUMN_COUNT = 26
+
+_DATE_FORMATS = [
+    (re.compile(r'^(\d{1,2})[-/](\d{1,2})[-/](\d{4})$'), (3, 1, 2)),
+    (re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$'), (1, 2, 3)),
+]
+_EPOCH = datetime.date(1899, 12, 30)
+
+class _DateValue(int):
+    """A date cell: its serial number, with the text the sheet displays."""
+
+    def __new__(cls, date):
+        value = super().__new__(cls, (date - _EPOCH).days)
+        value.text = f'{date.month}/{date.day}/{date.year}'
+        return value
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _http_error(status, message):
+    return HttpError(httplib2.Response({'status': status}), json.dumps({'error': {'message': message}}).encode())
+
+def _is_empty(value):
+    return value is None or value == ''
+
+def _parse_date(value):
+    for pattern, (year, month, day) in _DATE_FORMATS:
+        match = pattern.match(value)
+        if match:
+            try:
+                return _DateValue(datetime.date(int(match.group(year)), int(match.group(month)), int(match.group(day))))
+            except ValueError:
+                return None
+    return None
+
+def _user_entered(value):
+    # USER_ENTERED parses numeric and date text the way the Sheets UI would
+    if isinstance(value, str) and value and value[0] not in "='":
+        date = _parse_date(value)
+        if date is not None:
+            return date
+        try:
+            number = float(value.replace(',', ''))
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() and 'e' not in value.lower() else number
+    if isinstance(value, str) and value.startswith("'"):
+        return value[1:]
+    return value
+
+def _cell_value(extended_value):
+    # ExtendedValue of updateCells; formulas are stored as text like everywhere else
+    if not extended_value:
+        return None
+    for key in ('formulaValue', 'stringValue', 'numberValue', 'boolValue'):
+        if key in extended_value:
+            return extended_value[key]
+    raise _http_error(400, f'Unsupported cell value: {", ".join(extended_value)}')
+
+def _formatted(value):
+    if isinstance(value, _DateValue):
+        return value.text
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class _FakeRequest:
+    def __init__(self, service, method, quota, body, handler):
+        self.service = service
+        self.method = method
+        self.quota = quota
+        self.body = body
+        self.handler = handler
+
+    def execute(self):
+        return self.service._execute(self)
+
+class _ValuesResource:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, valueRenderOption='FORMATTED_VALUE', majorDimension='ROWS',
+            dateTimeRenderOption='SERIAL_NUMBER', **kwargs):
+        return _FakeRequest(self.service, 'values.get', 'read', None,
+                            lambda: self.service._get_values(spreadsheetId, range, valueRenderOption, majorDimension,
+                                                             dateTimeRenderOption))
+
+    def batchGet(self, spreadsheetId, ranges, valueRenderOption='FORMATTED_VALUE', majorDimension='ROWS',
+                 dateTimeRenderOption='SERIAL_NUMBER', **kwargs):
+        if isinstance(ranges, str):
+            ranges = [ranges]
+        return _FakeRequest(self.service, 'values.batchGet', 'read', None, lambda: {
+            'spreadsheetId': spreadsheetId,
+            'valueRanges': [self.service._get_values(spreadsheetId, r, valueRenderOption, majorDimension,
+                                                     dateTimeRenderOption) for r in ranges]
+        })
+
+    def update(self, spreadsheetId, range, body, valueInputOption='RAW', **kwargs):
+        return _FakeRequest(self.service, 'values.update', 'write', body,
+                            lambda: self.service._update_values(spreadsheetId, range, body, valueInputOption))
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def handler():
+            responses = [self.service._update_values(spreadsheetId, value_range['range'], value_range,
+                                                     body.get('valueInputOption', 'RAW'))
+                         for value_range in body.get('data', [])]
+            return {
+                'spreadsheetId': spreadsheetId,
+                'totalUpdatedCells': sum(r['updatedCells'] for r in responses),
+                'responses': responses
+            }
+        return _FakeRequest(self.service, 'values.batchUpdate', 'write', body, handler)
+
+    def clear(self, spreadsheetId, range, body=None, **kwargs):
+        return _FakeRequest(self.service, 'values.clear', 'write', body,
+                            lambda: self.service._clear_values(spreadsheetId, range))
+
+class _SpreadsheetsResource:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        return _FakeRequest(self.service, 'spreadsheets.get', 'read', None,
+                            lambda: self.service._get_metadata(spreadsheetId, fields))
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return _FakeRequest(self.service, 'spreadsheets.batchUpdate', 'write', body,
+                            lambda: self.service._batch_update(spreadsheetId, body))
+
+    def values(self):
+        return _ValuesResource(self.service)
+
+class FakeSheetsService:
+    """Holds spreadsheets in memory and counts calls, payload bytes and injected delays.
+
+    latency is seconds per call (a number or a callable taking the method name).
+    read/write_quota_per_minute make the fake answer 429 once more calls than
+    that have been made in the trailing 60 seconds, like the real per-user quota.
+    """
+
+    def __init__(self, latency=0.0, read_quota_per_minute=None, write_quota_per_minute=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.latency = latency
+        self.quotas = {'read': read_quota_per_minute, 'write': write_quota_per_minute}
+        self.clock = clock
+        self.sleep = sleep
+        self.spreadsheets_by_id = {}
+        self.lock = threading.RLock()
+        self.history = {'read': deque(), 'write': deque()}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = Counter()
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.rejected = 0
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def spreadsheets(self):
+        return _SpreadsheetsResource(self)
+
+    # Test setup helpers
+
+    def add_spreadsheet(self, spreadsheet_id, sheets=None, title=None):
+        """Create a spreadsheet whose sheets are given as {title: rows}."""
+        with self.lock:
+            self.spreadsheets_by_id[spreadsheet_id] = {
+                'title': title or spreadsheet_id,
+                'sheets': [],
+                'next_sheet_id': 0,
+            }
+            for sheet_title, rows in (sheets or {}).items():
+                sheet = self._add_sheet(spreadsheet_id, {'title': sheet_title})
+                self._write(sheet, 1, 1, rows, 'RAW')
+
+    def sheet_values(self, spreadsheet_id, title):
+        """Return a copy of the stored grid of a sheet."""
+        with self.lock:
+            return copy.deepcopy(self._find_sheet(spreadsheet_id, title)['rows'])
+
+    def sheet_notes(self, spreadsheet_id, title):
+        """Return the cell notes of a sheet as {(row, column): note}, 1-based."""
+        with self.lock:
+            return dict(self._find_sheet(spreadsheet_id, title)['notes'])
+
+    # Request plumbing
+
+    def _execute(self, request):
+        latency = self.latency(request.method) if callable(self.latency) else self.latency
+        if latency:
+            self.sleep(latency)
+        with self.lock:
+            self._check_quota(request.quota)
+            self.calls[request.method] += 1
+            if request.body is not None:
+                self.request_bytes += len(json.dumps(request.body))
+            response = request.handler()
+            self.response_bytes += len(json.dumps(response))
+            return response
+
+    def _check_quota(self, quota):
+        limit = self.quotas[quota]
+        if limit is None:
+            return
+        now = self.clock()
+        history = self.history[quota]
+        while history and now - history[0] >= 60:
+            history.popleft()
+        if len(history) >= limit:
+            self.rejected += 1
+            raise _http_error(429, f'Quota exceeded for quota metric {quota} requests per minute per user.')
+        history.append(now)
+
+    def _spreadsheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets_by_id:
+            raise _http_error(404, 'Requested entity was not found.')
+        return self.spreadsheets_by_id[spreadsheet_id]
+
+    def _find_sheet(self, spreadsheet_id, title=None, sheet_id=None):
+        for sheet in self._spreadsheet(spreadsheet_id)['sheets']:
+            properties = sheet['properties']
+            if sheet_id is not None and properties['sheetId'] == sheet_id:
+                return sheet
+            # Sheet names in A1 ranges are matched case-insensitively
+            if title is not None and properties['title'].lower() == title.lower():
+                return sheet
+        raise _http_error(400, f'Unable to parse range: {title if title is not None else sheet_id}')
+
+    def _add_sheet(self, spreadsheet_id, properties):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        title = properties.get('title') or f"Sheet{len(spreadsheet['sheets']) + 1}"
+        if any(s['properties']['title'].lower() == title.lower() for s in spreadsheet['sheets']):
+            raise _http_error(400, f'A sheet with the name "{title}" already exists.')
+        sheet_id = properties.get('sheetId', spreadsheet['next_sheet_id'])
+        if any(s['properties']['sheetId'] == sheet_id for s in spreadsheet['sheets']):
+            raise _http_error(400, f'A sheet with the id {sheet_id} already exists.')
+        spreadsheet['next_sheet_id'] = max(spreadsheet['next_sheet_id'], sheet_id) + 1
+        grid = properties.get('gridProperties', {})
+        sheet = {
+            'properties': {
+                'sheetId': sheet_id,
+                'title': title,
+                'index': len(spreadsheet['sheets']),
+                'sheetType': 'GRID',
+                'gridProperties': {
+                    'rowCount': grid.get('rowCount', DEFAULT_ROW_COUNT),
+                    'columnCount': grid.get('columnCount', DEFAULT_COLUMN_COUNT),
+                },
+            },
+            'rows': [],
+            'notes': {},
+        }
+        spreadsheet['sheets'].append(sheet)
+        return sheet
+
+    # Spreadsheet-level operations
+
+    def _get_metadata(self, spreadsheet_id, fields):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        sheets = [{'properties': copy.deepcopy(s['properties'])} for s in spreadsheet['sheets']]
+        # A "sheets.properties"-style field mask leaves out everything but the sheet list
+        if fields and fields.startswith('sheets'):
+            return {'sheets': sheets}
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'properties': {'title': spreadsheet['title'], 'locale': 'en_US', 'timeZone': 'Etc/GMT'},
+            'sheets': sheets,
+            'spreadsheetUrl': f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit',
+        }
+
+    def _batch_update(self, spreadsheet_id, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        # The requests are applied together or not at all
+        snapshot = copy.deepcopy(spreadsheet)
+        try:
+            return self._apply_requests(spreadsheet_id, spreadsheet, body.get('requests', []))
+        except HttpError:
+            spreadsheet.clear()
+            spreadsheet.update(snapshot)
+            raise
+
+    def _apply_requests(self, spreadsheet_id, spreadsheet, requests):
+        replies = []
+        for request in requests:
+            if 'addSheet' in request:
+                sheet = self._add_sheet(spreadsheet_id, request['addSheet'].get('properties', {}))
+                replies.append({'addSheet': {'properties': copy.deepcopy(sheet['properties'])}})
+            elif 'deleteSheet' in request:
+                sheet = self._find_sheet(spreadsheet_id, sheet_id=request['deleteSheet']['sheetId'])
+                spreadsheet['sheets'].remove(sheet)
+                for index, remaining in enumerate(spreadsheet['sheets']):
+                    remaining['properties']['index'] = index
+                replies.append({})
+            elif 'appendDimension' in request:
+                append = request['appendDimension']
+                grid = self._find_sheet(spreadsheet_id, sheet_id=append['sheetId'])['properties']['gridProperties']
+                key = 'rowCount' if append['dimension'] == 'ROWS' else 'columnCount'
+                grid[key] += append['length']
+                replies.append({})
+            elif 'updateCells' in request:
+                self._update_cells(spreadsheet_id, request['updateCells'])
+                replies.append({})
+            else:
+                raise _http_error(400, f'Unsupported request: {", ".join(request)}')
+        return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+
+    def _update_cells(self, spreadsheet_id, update):
+        fields = {field.strip() for field in update.get('fields', '').split(',')}
+        if not fields <= {'note', 'userEnteredValue'}:
+            raise _http_error(400, 'Unsupported updateCells request: only the note and userEnteredValue fields.')
+        location = update.get('start') or update.get('range')
+        if location is None:
+            raise _http_error(400, 'updateCells needs a start or a range.')
+        sheet = self._find_sheet(spreadsheet_id, sheet_id=location['sheetId'])
+        grid = sheet['properties']['gridProperties']
+        rows = [row.get('values', []) for row in update.get('rows', [])]
+        if 'start' in update:
+            start_row, start_col = location.get('rowIndex', 0), location.get('columnIndex', 0)
+            end_row = start_row + len(rows)
+            end_col = start_col + max((len(row) for row in rows), default=0)
+        else:
+            start_row, start_col = location.get('startRowIndex', 0), location.get('startColumnIndex', 0)
+            end_row = location.get('endRowIndex', grid['rowCount'])
+            end_col = location.get('endColumnIndex', grid['columnCount'])
+        if end_row > grid['rowCount'] or end_col > grid['columnCount']:
+            raise _http_error(400, f"Range ({sheet['properties']['title']}!R{end_row}C{end_col}) exceeds grid limits.")
+
+        if 'start' in update:
+            for r, row in enumerate(rows):
+                for c, cell in enumerate(row):
+                    self._set_cell(sheet, start_row + r, start_col + c, cell, fields)
+            return
+        # Cells of a range that rows leaves out are cleared for the fields in the mask
+        for r in range(start_row, end_row):
+            row = rows[r - start_row] if r - start_row < len(rows) else []
+            for c in range(start_col, end_col):
+                self._set_cell(sheet, r, c, row[c - start_col] if c - start_col < len(row) else {}, fields)
+
+    def _set_cell(self, sheet, row_index, col_index, cell, fields):
+        key = (row_index + 1, col_index + 1)
+        if 'note' in fields:
+            if cell.get('note'):
+                sheet['notes'][key] = cell['note']
+            else:
+                sheet['notes'].pop(key, None)
+        if 'userEnteredValue' in fields:
+            value = _cell_value(cell.get('userEnteredValue'))
+            rows = sheet['rows']
+            if value is None and (row_index >= len(rows) or col_index >= len(rows[row_index])):
+                return
+            while len(rows) <= row_index:
+                rows.append([])
+            row = rows[row_index]
+            if len(row) <= col_index:
+                row.extend([None] * (col_index + 1 - len(row)))
+            row[col_index] = value
+
+    # Values operations
+
+    def _get_values(self, spreadsheet_id, range_name, render_option, major_dimension, date_time_render_option='SERIAL_NUMBER'):
+        title, start_row, start_col, end_row, end_col = parse_range(range_name)
+        sheet = self._find_sheet(spreadsheet_id, title)
+        grid = sheet['properties']['gridProperties']
+        end_row = min(end_row or grid['rowCount'], grid['rowCount'])
+        end_col = min(end_col or grid['columnCount'], grid['columnCount'])
+
+        values = []
+        for row in sheet['rows'][start_row - 1:end_row]:
+            cells = row[start_col - 1:end_col]
+            while cells and _is_empty(cells[-1]):
+                cells.pop()
+            if render_option == 'FORMATTED_VALUE':
+                cells = ['' if _is_empty(v) else _formatted(v) for v in cells]
+            elif date_time_render_option == 'FORMATTED_STRING':
+                cells = ['' if v is None else v.text if isinstance(v, _DateValue) else v for v in cells]
+            else:
+                cells = ['' if v is None else int(v) if isinstance(v, _DateValue) else v for v in cells]
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+
+        if major_dimension == 'COLUMNS':
+            width = max((len(r) for r in values), default=0)
+            values = [[r[c] if c < len(r) else '' for r in values] for c in range(width)]
+            for column in values:
+                while column and column[-1] == '':
+                    column.pop()
+
+        response = {
+            'range': format_range(sheet['properties']['title'], start_row, start_col, end_row, end_col),
+            'majorDimension': major_dimension,
+        }
+        if values:
+            response['values'] = values
+        return response
+
+    def _write(self, sheet, start_row, start_col, values, value_input_option):
+        rows = sheet['rows']
+        width = 0
+        for r, row_values in enumerate(values):
+            row_index = start_row - 1 + r
+            while len(rows) <= row_index:
+                rows.append([])
+            row = rows[row_index]
+            for c, value in enumerate(row_values):
+                # Null cells in a ValueRange leave the existing value alone
+                if value is None:
+                    continue
+                col_index = start_col - 1 + c
+                if len(row) <= col_index:
+                    row.extend([None] * (col_index + 1 - len(row)))
+                row[col_index] = _user_entered(value) if value_input_option == 'USER_ENTERED' else value
+            width = max(width, len(row_values))
+
+        # values.update grows the grid to fit the written block
+        grid = sheet['properties']['gridProperties']
+        grid['rowCount'] = max(grid['rowCount'], start_row - 1 + len(values))
+        grid['columnCount'] = max(grid['columnCount'], start_col - 1 + width)
+        return len(values), width
+
+    def _update_values(self, spreadsheet_id, range_name, body, value_input_option):
+        title, start_row, start_col, _, _ = parse_range(range_name)
+        sheet = self._find_sheet(spreadsheet_id, title)
+        values = body.get('values', [])
+        if body.get('majorDimension') == 'COLUMNS':
+            height = max((len(c) for c in values), default=0)
+            values = [[c[r] if r < len(c) else None for c in values] for r in range(height)]
+        num_rows, num_cols = self._write(sheet, start_row, start_col, values, value_input_option)
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'updatedRange': format_range(sheet['properties']['title'], start_row, start_col,
+                                         start_row + max(num_rows, 1) - 1, start_col + max(num_cols, 1) - 1),
+            'updatedRows': num_rows,
+            'updatedColumns': num_cols,
+            'updatedCells': sum(len(r) for r in values),
+        }
+
+    def _clear_values(self, spreadsheet_id, range_name):
+        title, start_row, start_col, end_row, end_col = parse_range(range_name)
+        sheet = self._find_sheet(spreadsheet_id, title)
+        for row in sheet['rows'][start_row - 1:end_row]:
+            for c in range(start_col - 1, min(end_col or len(row), len(row))):
+                row[c] = None
+        return {'spreadsheetId': spreadsheet_id, 'clearedRange': range_name}
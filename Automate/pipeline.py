@@ -0,0 +1,222 @@
+'''python pipeline.py
+--credentials-file client_secret.json
+--token-file token.json
+--spreadsheet-id <spreadsheet id>
+
+Runs audio_to_raw and raw_to_batchAudioSummary as one process. The Audio sheet
+is read once; the RawAuto grid built from it is written to the sheet and then
+handed straight to the summary stages, so nothing is read back from RawAuto.
+'''
+
+import argparse
+import time
+
+from audio_to_raw import (
+    create_raw_sheet,
+    materialize_audio_rows,
+    read_audio_values,
+    sheet_exists,
+    raw_rows,
+    write_raw_values,
+    write_redelivery_notes,
+)
+from call_metrics import CallMetrics, stage
+from cli_options import metrics_options, mode_options, quota_options
+from delta_sync import RowFingerprintStore
+from district_index import DistrictIndex
+from raw_to_batchAudioSummary import (
+    additional_operations,
+    additional_operations_updates,
+    create_or_update_sheet,
+    folds_additional_operations,
+)
+from run_journal import RunJournal
+from sheets_auth import DRIVE_METADATA_SCOPE, SCOPES, build_sheets_service, get_credentials
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Copy the Audio sheet to RawAuto and build the summary in one pass.",
+                                     parents=[mode_options(), metrics_options(), quota_options()])
+    parser.add_argument('--credentials-file', type=str, required=True, help='Path to the credentials JSON file.')
+    parser.add_argument('--token-file', type=str, required=True, help='Path to the token JSON file.')
+    parser.add_argument('--spreadsheet-id', type=str, required=True, help='ID of the Google Spreadsheet.')
+    parser.add_argument('--audio-sheet-name', type=str, default='Audio', help='Name of the Audio sheet.')
+    parser.add_argument('--raw-sheet-name', type=str, default='RawAuto', help='Name of the raw sheet.')
+    parser.add_argument('--target-sheet-name', type=str, default='BatchAudioSummaryAuto', help='Name of the summary sheet.')
+    parser.add_argument('--mark-redeliveries', action='store_true',
+                        help='With --raw-mode values, add a "Redelivery" note to cells that had the "RE-" prefix.')
+    parser.add_argument('--incremental-state', type=str, default=None,
+                        help='JSON file of row fingerprints; when set only new or changed RawAuto rows are written.')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='Directory of run journals; an interrupted run started again resumes after its last finished step.')
+    parser.add_argument('--snapshot-cache', type=str, default=None,
+                        help='Directory of on-disk snapshots of fetched ranges, reused while the spreadsheet is unchanged (needs pyarrow and the drive.metadata.readonly scope).')
+    args = parser.parse_args()
+    if args.mark_redeliveries and args.raw_mode != 'values':
+        parser.error('--mark-redeliveries needs --raw-mode values')
+    return args
+
+def _trimmed(row):
+    """Drop trailing empty cells, as the API does in values responses."""
+    end = len(row)
+    while end and row[end - 1] in ('', None):
+        end -= 1
+    return row[:end]
+
+def _trimmed_rows(rows):
+    """Trim every row and drop trailing empty rows, as the API does in values responses."""
+    rows = [_trimmed(row) for row in rows]
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+def summary_inputs_from_raw_grid(raw_grid):
+    """Build the read_summary_inputs result from the RawAuto rows (with values, not formulas) without any API call."""
+    # get_sheet_dimensions: rows up to the last filled cell in column A, columns of row 2
+    raw_num_rows = 0
+    for i, row in enumerate(raw_grid):
+        if row and row[0] not in ('', None):
+            raw_num_rows = i + 1
+    header = _trimmed(raw_grid[1]) if len(raw_grid) > 1 else []
+    num_columns_raw = len(header)
+
+    # Same block as the E2:<last column><raw_num_rows> read
+    raw_data = _trimmed_rows(row[4:num_columns_raw] for row in raw_grid[1:raw_num_rows])
+
+    return {
+        "raw_num_rows": raw_num_rows,
+        "raw_num_cols": num_columns_raw,
+        "num_columns_raw": num_columns_raw,
+        "raw_data": raw_data,
+        "api_calls": 0
+    }
+
+def raw_auto_rows_from_raw_grid(raw_grid):
+    """Return what additional_operations would read from rawAuto!A3:B."""
+    return _trimmed_rows(row[:2] for row in raw_grid[2:])
+
+def run_pipeline(service, spreadsheet_id, audio_sheet_name, raw_sheet_name, target_sheet_name,
+                 summary_mode="formula", rebuild_mode="recreate", state_store=None,
+                 raw_mode="formula", mark_redeliveries=False, formula_mode="cell", journal=None,
+                 district_index=None):
+    """Run all three stages for one spreadsheet and return the seconds spent in each.
+
+    With a RunJournal, a run that was interrupted resumes after its last finished step.
+    """
+    done = set()
+    if journal:
+        options = {
+            "audio_sheet_name": audio_sheet_name, "raw_sheet_name": raw_sheet_name,
+            "target_sheet_name": target_sheet_name, "summary_mode": summary_mode, "rebuild_mode": rebuild_mode,
+            "raw_mode": raw_mode, "mark_redeliveries": mark_redeliveries, "formula_mode": formula_mode,
+        }
+        done = journal.start(spreadsheet_id, options)
+        if done:
+            print(f"Resuming {spreadsheet_id}; already done: {', '.join(sorted(done))}.")
+
+    def finished(step):
+        if journal:
+            journal.mark_done(spreadsheet_id, step)
+
+    timings = {}
+    start = time.perf_counter()
+    with stage('copy_columns'):
+        source = journal.load_source(spreadsheet_id) if journal else None
+        if source is not None:
+            audio_values, num_columns = source
+        else:
+            audio_values, num_columns = read_audio_values(service, spreadsheet_id, audio_sheet_name)
+            if journal:
+                journal.save_source(spreadsheet_id, audio_values, num_columns)
+        if not audio_values:
+            print("No data found in the Audio sheet.")
+            if journal:
+                journal.finish(spreadsheet_id)
+            return timings
+
+        if raw_mode == "values":
+            raw_values, redelivered = materialize_audio_rows(audio_values, 0, num_columns)
+            raw_grid = raw_values
+        else:
+            raw_values, _ = raw_rows(audio_values, 0, num_columns, audio_sheet_name, raw_mode)
+            # The same rows with the formulas evaluated, i.e. what RawAuto now displays
+            raw_grid, redelivered = materialize_audio_rows(audio_values, 0, num_columns, error_value="#VALUE!")
+        if "raw_values" not in done:
+            if not sheet_exists(service, spreadsheet_id, raw_sheet_name):
+                create_raw_sheet(service, spreadsheet_id, raw_sheet_name)
+                if state_store:
+                    state_store.discard(spreadsheet_id, raw_sheet_name)
+            write_raw_values(service, spreadsheet_id, raw_sheet_name, raw_values, state_store)
+            finished("raw_values")
+        if mark_redeliveries and "redelivery_notes" not in done:
+            write_redelivery_notes(service, spreadsheet_id, raw_sheet_name, 0, redelivered)
+            finished("redelivery_notes")
+    timings['copy_columns'] = time.perf_counter() - start
+
+    # The locally computed district hours need every column, not just A:B
+    raw_auto_rows = raw_grid[2:] if formula_mode == "values" else raw_auto_rows_from_raw_grid(raw_grid)
+    fold = folds_additional_operations(rebuild_mode, target_sheet_name)
+
+    if "create_or_update_sheet" not in done:
+        start = time.perf_counter()
+        with stage('create_or_update_sheet'):
+            section_updates = None
+            if fold:
+                # The atomic rebuild writes the district section in the same batchUpdate
+                section_updates, _ = additional_operations_updates(service, spreadsheet_id, raw_auto_rows, formula_mode,
+                                                                   district_index)
+            create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet_name, summary_mode, rebuild_mode,
+                                   inputs=summary_inputs_from_raw_grid(raw_grid), section_updates=section_updates)
+        finished("create_or_update_sheet")
+        if fold:
+            finished("additional_operations")
+            done.add("additional_operations")
+        timings['create_or_update_sheet'] = time.perf_counter() - start
+
+    if "additional_operations" not in done:
+        start = time.perf_counter()
+        with stage('additional_operations'):
+            additional_operations(service, spreadsheet_id, raw_auto_rows, formula_mode, district_index)
+        finished("additional_operations")
+        timings['additional_operations'] = time.perf_counter() - start
+
+    if journal:
+        journal.finish(spreadsheet_id)
+    return timings
+
+def main():
+    args = parse_arguments()
+    scopes = SCOPES + [DRIVE_METADATA_SCOPE] if args.snapshot_cache else SCOPES
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prom else None
+    start = time.perf_counter()
+    creds = get_credentials(args.credentials_file, args.token_file, scopes)
+    if metrics:
+        metrics.add_timing('credentials', time.perf_counter() - start)
+    limiter = SheetsRateLimiter(args.read_requests_per_minute, args.write_requests_per_minute, args.max_retries)
+    start = time.perf_counter()
+    service = wrap_service(build_sheets_service(creds), limiter, metrics)
+    if metrics:
+        metrics.add_timing('service_build', time.perf_counter() - start)
+    cache = None
+    if args.snapshot_cache:
+        from snapshot_cache import SnapshotCache, drive_version_state, wrap_snapshot_cache
+        cache = SnapshotCache(args.snapshot_cache, drive_version_state(creds))
+        service = wrap_snapshot_cache(service, cache)
+    state_store = RowFingerprintStore(args.incremental_state) if args.incremental_state else None
+    journal = RunJournal(args.journal) if args.journal else None
+    district_index = DistrictIndex(args.district_index) if args.district_index else None
+
+    timings = run_pipeline(service, args.spreadsheet_id, args.audio_sheet_name, args.raw_sheet_name,
+                           args.target_sheet_name, args.summary_mode, args.rebuild_mode, state_store,
+                           args.raw_mode, args.mark_redeliveries, args.formula_mode, journal, district_index)
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f}s")
+    print(limiter.report())
+    if cache:
+        print(cache.report())
+    if metrics:
+        print(metrics.report())
+        metrics.export(args.metrics_json, args.metrics_prom)
+
+if __name__ == '__main__':
+    main()
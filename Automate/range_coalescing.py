@@ -0,0 +1,113 @@
+'''Merge the ValueRanges of a values batchUpdate into as few rectangles as possible.
+
+data = [{"range": "Summary!C2", "values": [[1]]}, {"range": "Summary!D2", "values": [[2]]}, ...]
+data = coalesce_value_ranges(data)   # [{"range": "Summary!C2:D2", "values": [[1, 2]]}, ...]
+
+Every range is expanded into the cells it writes (a later write to the same
+cell wins, as in the batchUpdate itself), then the cells of each sheet are
+cut into row runs of adjacent columns and runs spanning the same columns in
+consecutive rows are stacked into one block. Only cells that were written
+end up in a block, so nothing else in the sheet is touched. None values,
+which the API skips, stay skipped. If any range cannot be parsed (a named
+range, say) the data is sent as it is.
+'''
+
+import json
+from collections import defaultdict
+
+from a1_notation import format_range, parse_range
+
+def _cells_by_sheet(data):
+    sheets = {}
+    for value_range in data:
+        sheet, start_row, start_col, _, _ = parse_range(value_range["range"])
+        rows = value_range.get("values", [])
+        if value_range.get("majorDimension") == "COLUMNS":
+            height = max((len(column) for column in rows), default=0)
+            rows = [[column[r] if r < len(column) else None for column in rows] for r in range(height)]
+        cells = sheets.setdefault(sheet, {})
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                if value is not None:
+                    cells[(start_row + r, start_col + c)] = value
+    return sheets
+
+def _runs(columns):
+    """Split sorted column numbers into (first, last) runs of adjacent columns."""
+    runs = []
+    for col in columns:
+        if runs and runs[-1][1] == col - 1:
+            runs[-1][1] = col
+        else:
+            runs.append([col, col])
+    return [tuple(run) for run in runs]
+
+def _rectangles(cells):
+    """Return (first_row, first_col, last_row, last_col) blocks covering exactly the given cells."""
+    columns_by_row = defaultdict(list)
+    for row, col in cells:
+        columns_by_row[row].append(col)
+
+    blocks = []
+    open_blocks = {}  # (first_col, last_col) -> (first_row, last_row)
+    for row in sorted(columns_by_row):
+        extended = {}
+        for run in _runs(sorted(columns_by_row[row])):
+            first_row, last_row = open_blocks.pop(run, (row, row - 1))
+            if last_row != row - 1:
+                blocks.append((first_row, run[0], last_row, run[1]))
+                first_row = row
+            extended[run] = (first_row, row)
+        blocks.extend((first_row, first_col, last_row, last_col)
+                      for (first_col, last_col), (first_row, last_row) in open_blocks.items())
+        open_blocks = extended
+    blocks.extend((first_row, first_col, last_row, last_col)
+                  for (first_col, last_col), (first_row, last_row) in open_blocks.items())
+    return blocks
+
+def _split_rows(values, sheet, first_row, first_col, last_col, max_bytes):
+    """Cut a block into bands of rows whose JSON stays under max_bytes (one band when it is None)."""
+    bands = []
+    band = []
+    band_bytes = 0
+    for row in values:
+        size = len(json.dumps(row)) + 2
+        if max_bytes is not None and band and band_bytes + size > max_bytes:
+            bands.append(band)
+            band = []
+            band_bytes = 0
+        band.append(row)
+        band_bytes += size
+    if band:
+        bands.append(band)
+
+    pieces = []
+    for band in bands:
+        pieces.append({
+            "range": format_range(sheet, first_row, first_col, first_row + len(band) - 1, last_col),
+            "values": band,
+            "majorDimension": "ROWS"
+        })
+        first_row += len(band)
+    return pieces
+
+def coalesce_value_ranges(data, max_bytes=None):
+    """Return ValueRanges writing the same cells as data in fewer, rectangular ranges.
+
+    With max_bytes, blocks larger than that are split into bands of rows so
+    that each still fits in one request. data is returned as it is when a
+    range cannot be parsed.
+    """
+    try:
+        sheets = _cells_by_sheet(data)
+    except (AttributeError, ValueError):
+        return list(data)
+
+    merged = []
+    for sheet, cells in sheets.items():
+        if not cells:
+            continue
+        for first_row, first_col, last_row, last_col in sorted(_rectangles(cells)):
+            values = [[cells[(r, c)] for c in range(first_col, last_col + 1)] for r in range(first_row, last_row + 1)]
+            merged.extend(_split_rows(values, sheet, first_row, first_col, last_col, max_bytes))
+    return merged
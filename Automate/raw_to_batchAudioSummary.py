@@ -14,15 +14,25 @@
 --target-sheet-name BatchAudioSummaryAuto
 '''
 
-import os
 import time
+_IMPORT_STARTED = time.perf_counter()
+
+import json
+import re
 import argparse
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import pandas as pd
+from a1_notation import parse_range
+from array_formulas import anchored_column, every_nth_row_formula, exceeded_formula
+from call_metrics import CallMetrics, stage
+from cli_options import metrics_options, mode_options, quota_options
+from district_index import DistrictIndex, district_hours
+from range_coalescing import coalesce_value_ranges
+from sheet_dimensions import probe_dimensions, probe_dimensions_async
+from sheet_metadata import METADATA_FIELDS, SpreadsheetMetadata, get_metadata
+from sheets_auth import DRIVE_METADATA_SCOPE, build_sheets_service, get_credentials
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+# pandas and numpy are imported inside compute_status_totals, the only place that needs them
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 
 # Parameters
@@ -40,36 +50,32 @@ STATUS_DATA = [
     'Accepted post final single Audio Manual QC (chunk level)'
 ]
 
+# Stay under the recommended 2 MB request body for values batchUpdate
+MAX_PAYLOAD_BYTES = 2 * 1024 * 1024
+
 def parse_arguments():
-    parser = argparse.ArgumentParser(description="Google Sheets automation script.")
+    parser = argparse.ArgumentParser(description="Google Sheets automation script.",
+                                     parents=[mode_options(raw_mode=False), metrics_options(), quota_options()])
     parser.add_argument('--spreadsheet-id', type=str, required=True, help='The ID of the Google Spreadsheet.')
     parser.add_argument('--credentials-file', type=str, required=True, help='Path to the credentials JSON file.')
     parser.add_argument('--token-file', type=str, required=True, help='Path to the token JSON file.')
     parser.add_argument('--raw-sheet-name', type=str, required=True, help='Name of the raw sheet in the spreadsheet.')
     parser.add_argument('--target-sheet-name', type=str, required=True, help='Name of the target sheet in the spreadsheet.')
-    parser.add_argument('--rate-limit-delay', type=float, default=0.5, help='Rate limit delay between API calls in seconds.')
+    parser.add_argument('--rate-limit-delay', type=float, default=None, help='Deprecated and ignored; throttling is quota-aware now.')
+    parser.add_argument('--backend', choices=['googleapiclient', 'async'], default='googleapiclient',
+                        help='Issue the independent reads one at a time (googleapiclient) or concurrently (async, needs httpx).')
+    parser.add_argument('--read-plan', choices=['batched', 'separate'], default='batched',
+                        help='With the googleapiclient backend, fetch headers, dimensions and data in one batchGet (batched) '
+                             'or probe the dimensions first and read each range on its own (separate).')
+    parser.add_argument('--snapshot-cache', type=str, default=None,
+                        help='Directory of on-disk snapshots of fetched ranges, reused while the spreadsheet is unchanged (needs pyarrow and the drive.metadata.readonly scope).')
+    parser.add_argument('--report-startup', action='store_true', help='Print import, credential and service build times.')
     return parser.parse_args()
 
 # Function to authenticate and create a Google Sheets API service instance
 def get_sheets_service(credentials_file, token_file, scopes):
-    creds = None
-    if os.path.exists(token_file):
-        creds = Credentials.from_authorized_user_file(token_file, scopes)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
-            creds = flow.run_local_server(port=0)
-        with open(token_file, "w") as token:
-            token.write(creds.to_json())
-
-    try:
-        service = build("sheets", "v4", credentials=creds)
-        return service
-    except HttpError as err:
-        print(err)
-        return None
+    creds = get_credentials(credentials_file, token_file, scopes)
+    return build_sheets_service(creds)
 
 def col_num_to_letter(n):
     """Convert a column number to a letter (e.g., 1 -> A, 27 -> AA)."""
@@ -79,40 +85,249 @@ def col_num_to_letter(n):
         string = chr(65 + remainder) + string
     return string
 
-# Function to get the number of rows and columns in a sheet
+# Function to get the number of rows (filled cells in column A) and columns (row 2) in a sheet
 def get_sheet_dimensions(service, spreadsheet_id, sheet_name):
-    result = service.spreadsheets().values().get(
+    dimensions, _ = probe_dimensions(service, spreadsheet_id, sheet_name)
+    return dimensions.used_rows, dimensions.used_columns
+
+# Send a list of ValueRange dicts with values().batchUpdate, splitting the list
+# only when a single request would exceed the payload limit. Returns the number of calls.
+# Adjacent cells are merged into rectangular ranges first (see range_coalescing),
+# so callers can keep listing one ValueRange per cell.
+def batch_update_values(service, spreadsheet_id, data, value_input_option="USER_ENTERED", max_payload_bytes=MAX_PAYLOAD_BYTES):
+    data = coalesce_value_ranges(data, max_payload_bytes)
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for value_range in data:
+        size = len(json.dumps(value_range))
+        if chunk and chunk_bytes + size > max_payload_bytes:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(value_range)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+
+    for chunk in chunks:
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                "valueInputOption": value_input_option,
+                "data": chunk
+            }
+        ).execute()
+    if chunks:
+        # The writes grow the grid to fit, so the cached grid sizes are stale
+        get_metadata(service, spreadsheet_id).invalidate()
+    return len(chunks)
+
+# Compute the stride-8 status totals that the SUMPRODUCT formulas produce.
+# raw_data[0] is the header row (raw row 2); the data frame starts at raw row 3.
+def compute_status_totals(raw_data, num_columns):
+    """Return a (9, num_columns) array of status totals in hours, one row per STATUS_DATA entry."""
+    import numpy as np
+    import pandas as pd
+
+    totals = np.zeros((len(STATUS_DATA), num_columns))
+    if num_columns <= 0 or len(raw_data) < 2:
+        return totals
+
+    frame = pd.DataFrame(raw_data[1:]).reindex(columns=range(num_columns))
+    minutes = frame.apply(pd.to_numeric, errors="coerce").fillna(0).to_numpy(dtype=float)
+
+    # Target rows 2-8 sum raw rows 3-9 (stepping by 8), row 10 sums raw rows 10, 18, ...
+    for i in range(2, 11):
+        if i == 9:
+            continue
+        start_row = i if i == 10 else i + 1
+        totals[i - 2] = minutes[start_row - 3::8].sum(axis=0) / 60
+    totals[7] = totals[5] - totals[6]
+    return totals
+
+# Read everything create_or_update_sheet needs from the raw sheet
+def read_summary_inputs(service, spreadsheet_id, raw_sheet_name, summary_mode="formula"):
+    # Row 2 gives both the column count and the number of raw columns
+    dimensions, api_calls = probe_dimensions(service, spreadsheet_id, raw_sheet_name)
+    raw_num_rows = dimensions.used_rows
+    raw_num_cols = num_columns_raw = dimensions.used_columns
+
+    # Read raw data headers and first 1000 rows of each relevant column in one go
+    raw_data_range = f"{raw_sheet_name}!E2:{col_num_to_letter(num_columns_raw)}{raw_num_rows}"
+    raw_data_result = service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
-        range=f"{sheet_name}!A2:2"
+        range=raw_data_range,
+        valueRenderOption="UNFORMATTED_VALUE" if summary_mode == "values" else "FORMATTED_VALUE"
     ).execute()
-    values = result.get("values", [])
-    num_cols = len(values[0]) if values else 0
+    raw_data = raw_data_result.get("values", [])
 
-    result = service.spreadsheets().values().get(
+    return {
+        "raw_num_rows": raw_num_rows,
+        "raw_num_cols": raw_num_cols,
+        "num_columns_raw": num_columns_raw,
+        "raw_data": raw_data,
+        "api_calls": api_calls + 1
+    }
+
+# Reads made by read_summary_inputs and additional_operations on their own
+SEPARATE_READ_CALLS = 3
+
+def read_summary_inputs_batched(service, spreadsheet_id, raw_sheet_name, summary_mode="formula"):
+    """Fetch everything both stages read in a single values batchGet.
+
+    Returns (inputs, raw_auto_data): the read_summary_inputs result and the
+    rows additional_operations reads from rawAuto!A3:B. Columns A:B give the
+    row count and the district list, C2:D2 and E2 onwards the headers and the
+    data, so the dimension probe, the data read and the rawAuto read become
+    one call (plus the metadata get, which create_or_update_sheet needs anyway).
+    """
+    from pipeline import raw_auto_rows_from_raw_grid, summary_inputs_from_raw_grid
+
+    metadata = get_metadata(service, spreadsheet_id)
+    api_calls = metadata.ensure_loaded()
+    _, allocated_columns = metadata.grid_size(raw_sheet_name)
+    ranges = [f"{raw_sheet_name}!A:B", f"{raw_sheet_name}!C2:D2"]
+    if allocated_columns > 4:
+        ranges.append(f"{raw_sheet_name}!E2:{col_num_to_letter(allocated_columns)}")
+    response = service.spreadsheets().values().batchGet(
         spreadsheetId=spreadsheet_id,
-        range=f"{sheet_name}!A:A"
+        ranges=ranges,
+        valueRenderOption="UNFORMATTED_VALUE" if summary_mode == "values" else "FORMATTED_VALUE"
     ).execute()
-    values = result.get("values", [])
-    num_rows = len(values) if values else 0
+    api_calls += 1
+    value_ranges = [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+    columns_ab, header_cd = value_ranges[0], value_ranges[1]
+    block = value_ranges[2] if len(value_ranges) > 2 else []
+
+    # Put the pieces back together as RawAuto rows; C:D is only needed in row 2
+    raw_grid = []
+    for i in range(max(len(columns_ab), len(block) + 1)):
+        row = list(columns_ab[i]) if i < len(columns_ab) else []
+        if i >= 1:
+            row += [""] * (2 - len(row))
+            if i == 1 and header_cd:
+                row += header_cd[0]
+            row += [""] * (4 - len(row))
+            if i - 1 < len(block):
+                row += block[i - 1]
+        raw_grid.append(row)
+
+    inputs = summary_inputs_from_raw_grid(raw_grid)
+    inputs["api_calls"] = api_calls
+    print(f"Summary reads: {len(ranges)} ranges in 1 batchGet (separately: {SEPARATE_READ_CALLS}+ calls).")
+    return inputs, raw_auto_rows_from_raw_grid(raw_grid)
+
+# The reads of read_summary_inputs (plus the metadata and the additional_operations
+# read) through the asyncio backend: the metadata gives the grid size for the
+# bounded dimension probe, then the data and rawAuto reads are issued concurrently
+async def read_summary_inputs_async(client, spreadsheet_id, raw_sheet_name, summary_mode="formula"):
+    import asyncio
+
+    spreadsheet = await client.get(spreadsheet_id, fields=METADATA_FIELDS)
+    metadata = SpreadsheetMetadata(None, spreadsheet_id)
+    metadata.prime(spreadsheet.get("sheets", []))
+    allocated_rows, allocated_columns = metadata.grid_size(raw_sheet_name)
+    dimensions, probe_calls = await probe_dimensions_async(client, spreadsheet_id, raw_sheet_name,
+                                                           allocated_rows, allocated_columns)
+    raw_num_rows = dimensions.used_rows
+    raw_num_cols = num_columns_raw = dimensions.used_columns
+
+    raw_data_range = f"{raw_sheet_name}!E2:{col_num_to_letter(num_columns_raw)}{raw_num_rows}"
+    raw_data_result, raw_auto_result = await asyncio.gather(
+        client.values_get(spreadsheet_id, raw_data_range,
+                          "UNFORMATTED_VALUE" if summary_mode == "values" else "FORMATTED_VALUE"),
+        client.values_get(spreadsheet_id, f"{raw_sheet_name}!A3:B{max(raw_num_rows, 3)}"),
+    )
+
+    inputs = {
+        "raw_num_rows": raw_num_rows,
+        "raw_num_cols": raw_num_cols,
+        "num_columns_raw": num_columns_raw,
+        "raw_data": raw_data_result.get("values", []),
+        "api_calls": 1 + probe_calls + 2
+    }
+    return inputs, spreadsheet.get("sheets", []), raw_auto_result.get("values", [])
+
+# With rebuild_mode="atomic", section_updates (the additional_operations_updates ValueRanges)
+# are written in the same batchUpdate, so readers never see the sheet half built
+def create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet_name, summary_mode="formula", rebuild_mode="recreate", inputs=None,
+                           section_updates=None):
+    values = [['Status']] + [[status] for status in STATUS_DATA]
+
+    if inputs is None:
+        inputs = read_summary_inputs(service, spreadsheet_id, raw_sheet_name, summary_mode)
+    raw_num_rows = inputs["raw_num_rows"]
+    raw_num_cols = inputs["raw_num_cols"]
+    num_columns_raw = inputs["num_columns_raw"]
+    raw_data = inputs["raw_data"]
+    api_calls = inputs["api_calls"]
 
-    return num_rows, num_cols
+    # Check if the sheet already exists
+    metadata = get_metadata(service, spreadsheet_id)
+    api_calls += metadata.ensure_loaded()
+    sheet_id = metadata.sheet_id(target_sheet_name)
 
-def create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet_name, rate_limit_delay):
-    df = pd.DataFrame({'Status': STATUS_DATA})
-    values = [df.columns.tolist()] + df.values.tolist()
+    if summary_mode == "values":
+        totals = compute_status_totals(raw_data, num_columns_raw - 4)
 
-    raw_num_rows, raw_num_cols = get_sheet_dimensions(service, spreadsheet_id, raw_sheet_name)
+    updates = []
+    for col_offset in range(num_columns_raw - 4):
+        formula_column = col_num_to_letter(5 + col_offset)
+        col_to_update = col_num_to_letter(3 + col_offset)
 
-    # Check if the sheet already exists
-    sheet_exists = False
-    spreadsheet = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-    for sheet in spreadsheet['sheets']:
-        if sheet['properties']['title'] == target_sheet_name:
-            sheet_id = sheet['properties']['sheetId']
-            sheet_exists = True
-            break
-
-    if sheet_exists:
+        # Extract header and data for the current column
+        raw_header = raw_data[0][col_offset] if raw_data and len(raw_data) > 0 and len(raw_data[0]) > col_offset else ""
+        updates.append({
+            "range": f"{target_sheet_name}!{col_to_update}1",
+            "values": [[raw_header]]
+        })
+
+        for i in range(2, 11):
+            if summary_mode == "values":
+                formula = float(totals[i - 2, col_offset])
+            elif i == 9:
+                formula = f'={col_to_update}7-{col_to_update}8'
+            elif i == 10:
+                formula = f'=SUMPRODUCT((MOD(ROW({raw_sheet_name}!{formula_column}{i}:{formula_column}{raw_num_rows})-ROW({raw_sheet_name}!{formula_column}{i}),8)=0)*{raw_sheet_name}!{formula_column}{i}:{formula_column}{raw_num_rows})/60'
+            else:
+                formula = f'=SUMPRODUCT((MOD(ROW({raw_sheet_name}!{formula_column}{i+1}:{formula_column}{raw_num_rows})-ROW({raw_sheet_name}!{formula_column}{i+1}),8)=0)*{raw_sheet_name}!{formula_column}{i+1}:{formula_column}{raw_num_rows})/60'
+            
+            updates.append({
+                "range": f"{target_sheet_name}!{col_to_update}{i}",
+                "values": [[formula]],
+                "majorDimension": "ROWS"
+            })
+
+    updates.append({
+        "range": f"{target_sheet_name}!B1",
+        "values": [["# of Hours"]],
+        "majorDimension": "ROWS"
+    })
+
+    for i in range(2, 11):
+        if summary_mode == "values":
+            formula = float(totals[i - 2].sum())
+        else:
+            formula = f'=SUM({target_sheet_name}!C{i}:{col_num_to_letter(ord("E") + col_offset)}{i})'
+        updates.append({
+            "range": f"{target_sheet_name}!B{i}",
+            "values": [[formula]],
+            "majorDimension": "ROWS"
+        })
+
+    if rebuild_mode == "in-place" and sheet_id is not None:
+        api_calls += update_sheet_in_place(service, spreadsheet_id, target_sheet_name, values, updates)
+        print(f"create_or_update_sheet: {api_calls} API calls")
+        return
+
+    if rebuild_mode == "atomic":
+        api_calls += rebuild_sheet_atomically(service, spreadsheet_id, target_sheet_name, sheet_id, values,
+                                              updates + (section_updates or []), raw_num_rows, raw_num_cols)
+        print(f"create_or_update_sheet: {api_calls} API calls")
+        return
+
+    if sheet_id is not None:
         # Delete the existing sheet
         delete_sheet_request = {
             "requests": [
@@ -124,6 +339,8 @@ def create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet
             ]
         }
         service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=delete_sheet_request).execute()
+        metadata.invalidate()
+        api_calls += 1
 
     # Create a new sheet
     add_sheet_request = {
@@ -142,6 +359,7 @@ def create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet
         ]
     }
     service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=add_sheet_request).execute()
+    metadata.invalidate()
 
     body = {
         "values": values
@@ -152,78 +370,213 @@ def create_or_update_sheet(service, spreadsheet_id, raw_sheet_name, target_sheet
         valueInputOption="RAW",
         body=body
     ).execute()
-    time.sleep(rate_limit_delay)
-
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range=f"{raw_sheet_name}!2:2"
-    ).execute()
-    raw_headers = result.get("values", [])
-    num_columns_raw = len(raw_headers[0]) if raw_headers else 0
+    api_calls += 2
+
+    api_calls += batch_update_values(service, spreadsheet_id, updates)
+    print(f"create_or_update_sheet: {api_calls} API calls")
+
+# Expand ValueRange dicts into a {(row, col): value} map of 1-based cells
+def value_ranges_to_cells(value_ranges):
+    cells = {}
+    for value_range in value_ranges:
+        _, start_row, start_col, _, _ = parse_range(value_range["range"])
+        rows = value_range["values"]
+        if value_range.get("majorDimension") == "COLUMNS":
+            rows = [list(r) for r in zip(*rows)]
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                cells[(start_row + r, start_col + c)] = value
+    return cells
+
+# CellData for a value the other modes write with USER_ENTERED. Text that is
+# not a formula is sent as a string rather than parsed, without the leading '
+# that keeps it text under USER_ENTERED.
+def _cell_data(value):
+    if value is None or value == "":
+        return {}
+    if isinstance(value, str) and value.startswith("'"):
+        return {"userEnteredValue": {"stringValue": value[1:]}}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    if isinstance(value, str) and value.startswith("="):
+        return {"userEnteredValue": {"formulaValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+def rebuild_sheet_atomically(service, spreadsheet_id, target_sheet_name, sheet_id, status_values, updates, row_count, column_count):
+    """Delete, re-add and fill the target sheet in one batchUpdate, which applies fully or not at all. Returns the API calls made."""
+    metadata = get_metadata(service, spreadsheet_id)
+    cells = value_ranges_to_cells([{"range": f"{target_sheet_name}!A1", "values": status_values}] + updates)
+    last_row = max(row for row, _ in cells)
+    last_col = max(col for _, col in cells)
+    rows = [{"values": [_cell_data(cells.get((r, c))) for c in range(1, last_col + 1)]}
+            for r in range(1, last_row + 1)]
+
+    # Pick the new sheet's ID ourselves so updateCells can refer to it in the same request
+    new_sheet_id = max(metadata.sheet_ids(), default=0) + 1
+    requests = []
+    if sheet_id is not None:
+        requests.append({"deleteSheet": {"sheetId": sheet_id}})
+    requests.append({
+        "addSheet": {
+            "properties": {
+                "sheetId": new_sheet_id,
+                "title": target_sheet_name,
+                "gridProperties": {
+                    "rowCount": max(row_count, last_row),
+                    "columnCount": max(column_count, last_col)
+                }
+            }
+        }
+    })
+    requests.append({
+        "updateCells": {
+            "start": {"sheetId": new_sheet_id, "rowIndex": 0, "columnIndex": 0},
+            "rows": rows,
+            "fields": "userEnteredValue"
+        }
+    })
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}).execute()
+    metadata.invalidate()
+    return 1
+
+# Dates as USER_ENTERED parses them (en_US: month first), as (year, month, day) groups
+_DATE_PATTERNS = [
+    (re.compile(r"^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})$"), (3, 1, 2)),
+    (re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$"), (1, 2, 3)),
+]
 
-    # Read raw data headers and first 1000 rows of each relevant column in one go
-    raw_data_range = f"{raw_sheet_name}!E2:{col_num_to_letter(4 + num_columns_raw - 5)}{raw_num_rows}"
-    raw_data_result = service.spreadsheets().values().get(
+# Normalize a cell so a value read back with valueRenderOption=FORMULA and
+# dateTimeRenderOption=FORMATTED_STRING compares equal to the value we would
+# write with USER_ENTERED; a date header written as "03-05-2023" reads back
+# in the sheet's date format, e.g. "3/5/2023"
+def _comparable(value):
+    if value is None or value == "":
+        return ""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 9)
+    if isinstance(value, str) and not value.startswith("="):
+        for pattern, groups in _DATE_PATTERNS:
+            match = pattern.match(value)
+            if match:
+                return ("date",) + tuple(int(match.group(group)) for group in groups)
+        try:
+            return round(float(value.replace(",", "")), 9)
+        except ValueError:
+            return value
+    return value
+
+def update_sheet_in_place(service, spreadsheet_id, target_sheet_name, status_values, updates):
+    """Write only the cells of rows 1-10 that differ from what the sheet holds. Returns the API calls made."""
+    desired = value_ranges_to_cells([{"range": f"{target_sheet_name}!A1", "values": status_values}] + updates)
+    last_row = max(row for row, _ in desired)
+
+    current_rows = service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
-        range=raw_data_range
-    ).execute()
-    raw_data = raw_data_result.get("values", [])
-
-    updates = []
-    for col_offset in range(num_columns_raw - 4):
-        formula_column = col_num_to_letter(5 + col_offset)
-        col_to_update = col_num_to_letter(3 + col_offset)
+        range=f"{target_sheet_name}!1:{last_row}",
+        valueRenderOption="FORMULA",
+        dateTimeRenderOption="FORMATTED_STRING"
+    ).execute().get("values", [])
+    api_calls = 1
+    current = {}
+    for r, row in enumerate(current_rows):
+        for c, value in enumerate(row):
+            if value != "":
+                current[(r + 1, c + 1)] = value
+
+    changes = []
+    for cell in sorted(set(desired) | set(current)):
+        value = desired.get(cell, "")
+        if _comparable(value) != _comparable(current.get(cell)):
+            changes.append({
+                "range": f"{target_sheet_name}!{col_num_to_letter(cell[1])}{cell[0]}",
+                "values": [[value]]
+            })
 
-        # Extract header and data for the current column
-        raw_header = raw_data[0][col_offset] if raw_data and len(raw_data) > 0 and len(raw_data[0]) > col_offset else ""
+    if changes:
+        # Make room when the raw sheet gained columns since the summary was built
+        metadata = get_metadata(service, spreadsheet_id)
+        _, column_count = metadata.grid_size(target_sheet_name)
+        needed_columns = max(col for _, col in desired)
+        if needed_columns > column_count:
+            service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={
+                "requests": [{
+                    "appendDimension": {
+                        "sheetId": metadata.sheet_id(target_sheet_name),
+                        "dimension": "COLUMNS",
+                        "length": needed_columns - column_count
+                    }
+                }]
+            }).execute()
+            metadata.invalidate()
+            api_calls += 1
+        api_calls += batch_update_values(service, spreadsheet_id, changes)
+
+    print(f"{len(changes)} cells changed in {target_sheet_name}.")
+    return api_calls
+
+# USER_ENTERED stores text behind a leading ' as it is, so State and District
+# names that look like numbers or dates ("0012", "2023-01-05") are not converted
+def _as_text(value):
+    return "'" + value if isinstance(value, str) and value else value
+
+def _as_text_rows(rows):
+    return [[_as_text(value) for value in row] for row in rows]
+
+# With formula_mode="values" the district and state hours are computed locally, see district_index
+def district_hours_updates(service, spreadsheet_id, statuses, updates, raw_auto_rows=None, district_index=None):
+    """Add districts, their hours, the "Exceeded" flags and the totals as values, plus hours per state in K:N, to updates. Returns the API calls made."""
+    api_calls = 0
+    if raw_auto_rows is None:
+        # Unformatted, the Status hyperlinks read as their labels and Minutes as numbers
+        raw_auto_rows = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range="rawAuto!A3:D",
+            valueRenderOption="UNFORMATTED_VALUE"
+        ).execute().get('values', [])
+        api_calls += 1
+
+    districts, states = district_hours(raw_auto_rows, statuses, district_index)
+    hours = districts[statuses].to_numpy(dtype=float)
+    exceeded = [["Exceeded" if value > 100 else value for value in row] for row in hours.tolist()]
+    last_row = 13 + len(districts)
+    if len(districts):
         updates.append({
-            "range": f"{target_sheet_name}!{col_to_update}1",
-            "values": [[raw_header]]
+            "range": f"BatchAudioSummaryAuto!A14:E{last_row}",
+            "values": [[_as_text(row[0]), _as_text(row[1])] + row[2:]
+                       for row in districts[["State", "District"] + statuses].astype(object).to_numpy().tolist()]
+        })
+        updates.append({
+            "range": f"BatchAudioSummaryAuto!G14:I{last_row}",
+            "values": exceeded
         })
-
-        for i in range(2, 11):
-            if i == 9:
-                formula = f'={col_to_update}7-{col_to_update}8'
-            elif i == 10:
-                formula = f'=SUMPRODUCT((MOD(ROW({raw_sheet_name}!{formula_column}{i}:{formula_column}{raw_num_rows})-ROW({raw_sheet_name}!{formula_column}{i}),8)=0)*{raw_sheet_name}!{formula_column}{i}:{formula_column}{raw_num_rows})/60'
-            else:
-                formula = f'=SUMPRODUCT((MOD(ROW({raw_sheet_name}!{formula_column}{i+1}:{formula_column}{raw_num_rows})-ROW({raw_sheet_name}!{formula_column}{i+1}),8)=0)*{raw_sheet_name}!{formula_column}{i+1}:{formula_column}{raw_num_rows})/60'
-            
-            updates.append({
-                "range": f"{target_sheet_name}!{col_to_update}{i}",
-                "values": [[formula]],
-                "majorDimension": "ROWS"
-            })
-
     updates.append({
-        "range": f"{target_sheet_name}!B1",
-        "values": [["# of Hours"]],
-        "majorDimension": "ROWS"
+        "range": "BatchAudioSummaryAuto!C13:E13",
+        "values": [[round(float(total), 2) for total in hours.sum(axis=0)]]
     })
-
-    for i in range(2, 11):
-        formula = f'=SUM({target_sheet_name}!C{i}:{col_num_to_letter(ord("E") + col_offset)}{i})'
+    updates.append({
+        "range": "BatchAudioSummaryAuto!K12:N12",
+        "values": _as_text_rows([["State"] + statuses])
+    })
+    if len(states):
         updates.append({
-            "range": f"{target_sheet_name}!B{i}",
-            "values": [[formula]],
-            "majorDimension": "ROWS"
+            "range": f"BatchAudioSummaryAuto!K14:N{13 + len(states)}",
+            "values": [[_as_text(row[0])] + row[1:] for row in states[["State"] + statuses].astype(object).to_numpy().tolist()]
         })
+    return api_calls
 
-    data_body = {
-        "valueInputOption": "USER_ENTERED",
-        "data": updates
-    }
-    service.spreadsheets().values().batchUpdate(
-        spreadsheetId=spreadsheet_id,
-        body=data_body
-    ).execute()
-    time.sleep(rate_limit_delay)
-
-def additional_operations(service, spreadsheet_id):
+# With formula_mode="array" columns C-E and G-I get one ARRAYFORMULA each instead of a formula per row
+def additional_operations_updates(service, spreadsheet_id, raw_auto_data=None, formula_mode="cell", district_index=None):
+    """Return (the ValueRanges additional_operations writes with USER_ENTERED, API calls made)."""
     BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW = 14
     BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW = 14
     BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW = 14
 
+    updates = []
+
     # Add headers to the 12th row of BatchAudioSummaryAuto sheet
     headers = [
         ["Accepted post Initial check (chunk level)", 
@@ -231,18 +584,23 @@ def additional_operations(service, spreadsheet_id):
          "Accepted post final single Audio Manual QC (chunk level)"]
     ]
     
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!C12:E12",
-        valueInputOption='RAW',
-        body={'values': headers}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!C12:E12",
+        "values": _as_text_rows(headers)
+    })
+
+    api_calls = 0
+    if formula_mode == "values":
+        api_calls += district_hours_updates(service, spreadsheet_id, headers[0], updates, raw_auto_data, district_index)
+        return updates, api_calls
 
     # Get the data from the rawAuto sheet
-    raw_auto_data = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range="rawAuto!A3:B"
-    ).execute().get('values', [])
+    if raw_auto_data is None:
+        raw_auto_data = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range="rawAuto!A3:B"
+        ).execute().get('values', [])
+        api_calls += 1
 
     # Extract unique districts and their states
     district_state_map = {}
@@ -259,120 +617,196 @@ def additional_operations(service, spreadsheet_id):
         data_to_write.append([state, district])
 
     # Write the data to the BatchAudioSummaryAuto sheet
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!A14:B",
-        valueInputOption='RAW',
-        body={'values': data_to_write}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!A14:B",
+        "values": _as_text_rows(data_to_write)
+    })
 
     # Prepare and write formulas to the BatchAudioSummaryAuto sheet for column C
     formulas_c_to_write = []
     row_index_c = 8
-    for i in range(len(raw_auto_data)):
-        formula = f"=ROUND(rawAuto!D{row_index_c}/60,2)"
-        formulas_c_to_write.append([formula])
-        row_index_c += 8
+    if formula_mode == "array" and raw_auto_data:
+        formula = every_nth_row_formula("rawAuto", "D", row_index_c, len(raw_auto_data))
+        formulas_c_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=ROUND(rawAuto!D{row_index_c}/60,2)"
+            formulas_c_to_write.append([formula])
+            row_index_c += 8
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!C14:C",
-        valueInputOption='USER_ENTERED',
-        body={'values': formulas_c_to_write}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!C14:C",
+        "values": formulas_c_to_write
+    })
 
     # Prepare and write formulas to the BatchAudioSummaryAuto sheet for column D
     formulas_d_to_write = []
     row_index_d = 9
-    for i in range(len(raw_auto_data)):
-        formula = f"=ROUND(rawAuto!D{row_index_d}/60,2)"
-        formulas_d_to_write.append([formula])
-        row_index_d += 8
+    if formula_mode == "array" and raw_auto_data:
+        formula = every_nth_row_formula("rawAuto", "D", row_index_d, len(raw_auto_data))
+        formulas_d_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=ROUND(rawAuto!D{row_index_d}/60,2)"
+            formulas_d_to_write.append([formula])
+            row_index_d += 8
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!D14:D",
-        valueInputOption='USER_ENTERED',
-        body={'values': formulas_d_to_write}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!D14:D",
+        "values": formulas_d_to_write
+    })
 
     # Prepare and write formulas to the BatchAudioSummaryAuto sheet for column E
     formulas_e_to_write = []
     row_index_e = 10
-    for i in range(len(raw_auto_data)):
-        formula = f"=ROUND(rawAuto!D{row_index_e}/60,2)"
-        formulas_e_to_write.append([formula])
-        row_index_e += 8
+    if formula_mode == "array" and raw_auto_data:
+        formula = every_nth_row_formula("rawAuto", "D", row_index_e, len(raw_auto_data))
+        formulas_e_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=ROUND(rawAuto!D{row_index_e}/60,2)"
+            formulas_e_to_write.append([formula])
+            row_index_e += 8
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!E14:E",
-        valueInputOption='USER_ENTERED',
-        body={'values': formulas_e_to_write}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!E14:E",
+        "values": formulas_e_to_write
+    })
 
     # Prepare and write IF formulas to column G
     if_formulas_to_write = []
-    for i in range(len(raw_auto_data)):
-        formula = f"=IF(C{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW + i} > 100, \"Exceeded\", C{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW + i})"
-        if_formulas_to_write.append([formula])
+    if formula_mode == "array" and raw_auto_data:
+        formula = exceeded_formula("C", BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW, len(raw_auto_data))
+        if_formulas_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=IF(C{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW + i} > 100, \"Exceeded\", C{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW + i})"
+            if_formulas_to_write.append([formula])
 
     if_range = f"BatchAudioSummaryAuto!G{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW}:G{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_C_START_ROW + len(raw_auto_data) - 1}"
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=if_range,
-        valueInputOption='USER_ENTERED',
-        body={'values': if_formulas_to_write}
-    ).execute()
+    updates.append({
+        "range": if_range,
+        "values": if_formulas_to_write
+    })
 
     # Prepare and write IF formulas to column H based on column D values
     if_formulas_h_to_write = []
-    for i in range(len(raw_auto_data)):
-        formula = f"=IF(D{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW + i} > 100, \"Exceeded\", D{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW + i})"
-        if_formulas_h_to_write.append([formula])
+    if formula_mode == "array" and raw_auto_data:
+        formula = exceeded_formula("D", BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW, len(raw_auto_data))
+        if_formulas_h_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=IF(D{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW + i} > 100, \"Exceeded\", D{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW + i})"
+            if_formulas_h_to_write.append([formula])
 
     if_range_h = f"BatchAudioSummaryAuto!H{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW}:H{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_D_START_ROW + len(raw_auto_data) - 1}"
 
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=if_range_h,
-        valueInputOption='USER_ENTERED',
-        body={'values': if_formulas_h_to_write}
-    ).execute()
+    updates.append({
+        "range": if_range_h,
+        "values": if_formulas_h_to_write
+    })
     
     # Prepare and write IF formulas to column I based on column E values
     if_formulas_i_to_write = []
-    for i in range(len(raw_auto_data)):
-        formula = f"=IF(E{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW + i} > 100, \"Exceeded\", E{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW + i})"
-        if_formulas_i_to_write.append([formula])
+    if formula_mode == "array" and raw_auto_data:
+        formula = exceeded_formula("E", BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW, len(raw_auto_data))
+        if_formulas_i_to_write = anchored_column(formula, len(raw_auto_data))
+    else:
+        for i in range(len(raw_auto_data)):
+            formula = f"=IF(E{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW + i} > 100, \"Exceeded\", E{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW + i})"
+            if_formulas_i_to_write.append([formula])
 
     if_range_i = f"BatchAudioSummaryAuto!I{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW}:I{BATCH_AUDIO_SUMMARY_AUTO_FORMULAS_E_START_ROW + len(raw_auto_data) - 1}"
     
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=if_range_i,
-        valueInputOption='USER_ENTERED',
-        body={'values': if_formulas_i_to_write}
-    ).execute()
+    updates.append({
+        "range": if_range_i,
+        "values": if_formulas_i_to_write
+    })
     
     # Add sum formulas to row 13
     sum_formulas = [
         ["=SUM(C14:C)", "=SUM(D14:D)", "=SUM(E14:E)"]
     ]
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range="BatchAudioSummaryAuto!C13:E13",
-        valueInputOption='USER_ENTERED',
-        body={'values': sum_formulas}
-    ).execute()
+    updates.append({
+        "range": "BatchAudioSummaryAuto!C13:E13",
+        "values": sum_formulas
+    })
+
+    return updates, api_calls
+
+def additional_operations(service, spreadsheet_id, raw_auto_data=None, formula_mode="cell", district_index=None):
+    updates, api_calls = additional_operations_updates(service, spreadsheet_id, raw_auto_data, formula_mode, district_index)
+    # Send every write of this stage in one values batchUpdate
+    api_calls += batch_update_values(service, spreadsheet_id, updates)
+    print(f"additional_operations: {api_calls} API calls")
+
+# additional_operations always writes to BatchAudioSummaryAuto, so its cells can only
+# join the atomic rebuild when that is the sheet being rebuilt
+def folds_additional_operations(rebuild_mode, target_sheet_name):
+    return rebuild_mode == "atomic" and target_sheet_name.lower() == "batchaudiosummaryauto"
 
 def main():
     args = parse_arguments()
-    service = get_sheets_service(args.credentials_file, args.token_file, SCOPES)
+    start = time.perf_counter()
+    scopes = SCOPES + [DRIVE_METADATA_SCOPE] if args.snapshot_cache else SCOPES
+    creds = get_credentials(args.credentials_file, args.token_file, scopes)
+    auth_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    service = build_sheets_service(creds)
+    build_seconds = time.perf_counter() - start
+    if args.report_startup:
+        print(f"Startup: imports {IMPORT_SECONDS:.3f}s, credentials {auth_seconds:.3f}s, "
+              f"service build {build_seconds:.3f}s")
+    metrics = None
+    if args.metrics_json or args.metrics_prom:
+        metrics = CallMetrics()
+        metrics.add_timing('imports', IMPORT_SECONDS)
+        metrics.add_timing('credentials', auth_seconds)
+        metrics.add_timing('service_build', build_seconds)
     if service:
-        create_or_update_sheet(service, args.spreadsheet_id, args.raw_sheet_name, args.target_sheet_name, args.rate_limit_delay)
-        additional_operations(service, args.spreadsheet_id)
+        limiter = SheetsRateLimiter(args.read_requests_per_minute, args.write_requests_per_minute, args.max_retries)
+        service = wrap_service(service, limiter, metrics)
+        cache = None
+        if args.snapshot_cache:
+            from snapshot_cache import SnapshotCache, drive_version_state, wrap_snapshot_cache
+            cache = SnapshotCache(args.snapshot_cache, drive_version_state(creds))
+            service = wrap_snapshot_cache(service, cache)
+        inputs = raw_auto_data = None
+        if args.backend == "async":
+            # asyncio is imported only here: it is a large share of the import time and most runs do not need it
+            import asyncio
+            with stage("create_or_update_sheet"):
+                inputs, sheets, raw_auto_data = asyncio.run(prefetch_async(creds, limiter, args, metrics))
+            get_metadata(service, args.spreadsheet_id).prime(sheets)
+        district_index = DistrictIndex(args.district_index) if args.district_index else None
+        fold = folds_additional_operations(args.rebuild_mode, args.target_sheet_name)
+        with stage("create_or_update_sheet"):
+            if args.backend == "googleapiclient" and args.read_plan == "batched":
+                inputs, raw_auto_data = read_summary_inputs_batched(service, args.spreadsheet_id, args.raw_sheet_name, args.summary_mode)
+            if args.formula_mode == "values":
+                # The district hours need Status and Minutes, not just rawAuto!A3:B
+                raw_auto_data = None
+            section_updates = None
+            if fold:
+                section_updates, _ = additional_operations_updates(service, args.spreadsheet_id, raw_auto_data,
+                                                                   args.formula_mode, district_index)
+            create_or_update_sheet(service, args.spreadsheet_id, args.raw_sheet_name, args.target_sheet_name, args.summary_mode, args.rebuild_mode, inputs,
+                                   section_updates)
+        if not fold:
+            with stage("additional_operations"):
+                additional_operations(service, args.spreadsheet_id, raw_auto_data, args.formula_mode, district_index)
+        print(limiter.report())
+        if cache:
+            print(cache.report())
+        if metrics:
+            print(metrics.report())
+            metrics.export(args.metrics_json, args.metrics_prom)
+
+async def prefetch_async(creds, limiter, args, metrics=None):
+    from async_sheets import AsyncSheetsClient
+    async with AsyncSheetsClient(creds, limiter=limiter, metrics=metrics) as client:
+        return await read_summary_inputs_async(client, args.spreadsheet_id, args.raw_sheet_name, args.summary_mode)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,83 @@
+'''On-disk journal for resuming an interrupted pipeline run.
+
+journal = RunJournal("journal")
+run_pipeline(service, spreadsheet_id, ..., journal=journal)
+
+For each spreadsheet the journal keeps two files under <directory>/<spreadsheet id>/:
+source.json, the Audio values read at the start of the run, and steps.json,
+the options the run was started with and the steps finished so far (the raw
+sheet write, the redelivery notes and the two summary stages). Both are
+replaced atomically, so a crash leaves the last durable step on disk. Run
+again with the same options, the pipeline takes the Audio values from the
+journal instead of the sheet and skips the finished steps; with different
+options it starts over. The journal of a spreadsheet is removed when its run
+completes.
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import quote
+
+class RunJournal:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def _directory(self, spreadsheet_id):
+        return os.path.join(self.directory, quote(spreadsheet_id, safe=''))
+
+    def _path(self, spreadsheet_id, name):
+        return os.path.join(self._directory(spreadsheet_id), name)
+
+    def _read(self, spreadsheet_id, name):
+        path = self._path(spreadsheet_id, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, spreadsheet_id, name, state):
+        path = self._path(spreadsheet_id, name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def start(self, spreadsheet_id, options):
+        """Open the journal of a run and return the steps already finished (none if options changed)."""
+        with self.lock:
+            steps = self._read(spreadsheet_id, 'steps.json')
+            if steps is not None and steps['options'] == options:
+                return set(steps['done'])
+            shutil.rmtree(self._directory(spreadsheet_id), ignore_errors=True)
+            self._write(spreadsheet_id, 'steps.json', {'options': options, 'done': []})
+            return set()
+
+    def load_source(self, spreadsheet_id):
+        """Return the saved (Audio values, number of columns), or None."""
+        with self.lock:
+            source = self._read(spreadsheet_id, 'source.json')
+        return (source['values'], source['num_columns']) if source is not None else None
+
+    def save_source(self, spreadsheet_id, values, num_columns):
+        with self.lock:
+            self._write(spreadsheet_id, 'source.json', {'values': values, 'num_columns': num_columns})
+
+    def mark_done(self, spreadsheet_id, step):
+        with self.lock:
+            steps = self._read(spreadsheet_id, 'steps.json')
+            if step not in steps['done']:
+                steps['done'].append(step)
+            self._write(spreadsheet_id, 'steps.json', steps)
+
+    def finish(self, spreadsheet_id):
+        """Forget a run that completed."""
+        with self.lock:
+            shutil.rmtree(self._directory(spreadsheet_id), ignore_errors=True)
@@ -0,0 +1,64 @@
+'''Formula-mode RawAuto rows built on several processes.
+
+rows = transform_audio_rows_sharded(audio_rows, 0, num_columns, "Audio", workers=8)
+
+The Audio grid is cut into blocks of rows, each block goes through
+transform_audio_rows in a worker process, and the blocks are joined back in
+order, so the result is exactly what the serial transform returns. Where the
+"fork" start method exists (Linux) the grid is left in a module global before
+the pool starts and the workers read it from the memory they inherit, so only
+the (start, end) of each block is sent to them; elsewhere, and whenever the
+calling process has other threads running (e.g. inside run_batches), where
+forking can deadlock the children, the workers are spawned and each gets a
+pickled copy once.
+
+audio_to_raw --shard_workers N uses it. The rows built by the workers are
+pickled back to the parent, which can cost more than the transform itself,
+so the default stays 1; measure with benchmark.py --shard-workers N first.
+'''
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from audio_to_raw import transform_audio_rows
+
+DEFAULT_BLOCK_ROWS = 10000
+
+# (audio_rows, first_idx, num_columns, audio_sheet_name) of the transform being run
+_shared = None
+
+def _set_shared(shared):
+    global _shared
+    _shared = shared
+
+def _transform_block(bounds):
+    start, end = bounds
+    audio_rows, first_idx, num_columns, audio_sheet_name = _shared
+    return list(transform_audio_rows(audio_rows[start:end], first_idx + start, num_columns, audio_sheet_name))
+
+def transform_audio_rows_sharded(audio_rows, first_idx, num_columns, audio_sheet_name, workers=None,
+                                 block_rows=DEFAULT_BLOCK_ROWS):
+    """Return list(transform_audio_rows(...)), computed by workers processes (default: one per core)."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(audio_rows) <= block_rows:
+        return list(transform_audio_rows(audio_rows, first_idx, num_columns, audio_sheet_name))
+
+    shared = (audio_rows, first_idx, num_columns, audio_sheet_name)
+    bounds = [(start, min(start + block_rows, len(audio_rows))) for start in range(0, len(audio_rows), block_rows)]
+    if 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1:
+        _set_shared(shared)
+        pool_options = {'mp_context': multiprocessing.get_context('fork')}
+    else:
+        pool_options = {'mp_context': multiprocessing.get_context('spawn'),
+                        'initializer': _set_shared, 'initargs': (shared,)}
+
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(bounds)), **pool_options) as pool:
+            for block in pool.map(_transform_block, bounds):
+                rows.extend(block)
+    finally:
+        _set_shared(None)
+    return rows
@@ -0,0 +1,99 @@
+'''Sheet sizes without downloading whole columns.
+
+The allocated size (rowCount x columnCount) comes from the cached sheet
+properties (see sheet_metadata). The used size is what the scripts mean by
+"number of rows/columns": the last filled cell in a key column (A) and the
+length of a header row. Rows are found with a tail probe: a window of the
+key column is read from the bottom of the grid, doubling upwards while it
+is empty, so a sheet with 100k rows costs a window of cells instead of the
+whole column. The first window and the header row share one batchGet.
+probe_dimensions_async makes the same reads through the asyncio backend.
+'''
+
+from collections import namedtuple
+
+from a1_notation import col_num_to_letter
+from sheet_metadata import get_metadata
+
+DEFAULT_PROBE_ROWS = 1000
+
+SheetDimensions = namedtuple('SheetDimensions', 'allocated_rows allocated_columns used_rows used_columns')
+
+def _first_window(allocated_rows, probe_rows):
+    return max(1, allocated_rows - probe_rows + 1), allocated_rows
+
+def _next_window(start, end):
+    """The window above start..end, twice as tall."""
+    size = 2 * (end - start + 1)
+    end = start - 1
+    return max(1, end - size + 1), end
+
+def used_columns(service, spreadsheet_id, sheet_name, row):
+    """Number of cells up to the last filled one in row."""
+    _, allocated_columns = get_metadata(service, spreadsheet_id).grid_size(sheet_name)
+    end = f"{col_num_to_letter(allocated_columns)}{row}" if allocated_columns else f"{row}"
+    values = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range=f"{sheet_name}!A{row}:{end}"
+    ).execute().get('values', [])
+    return len(values[0]) if values else 0
+
+def probe_dimensions(service, spreadsheet_id, sheet_name, header_row=2, key_column='A', probe_rows=DEFAULT_PROBE_ROWS):
+    """Return (SheetDimensions, API calls made).
+
+    used_rows is the last row with a value in key_column (what len() of a
+    "{sheet}!A:A" read gives) and used_columns the length of header_row.
+    """
+    metadata = get_metadata(service, spreadsheet_id)
+    api_calls = metadata.ensure_loaded()
+    allocated_rows, allocated_columns = metadata.grid_size(sheet_name)
+    if not allocated_rows:
+        return SheetDimensions(0, 0, 0, 0), api_calls
+
+    start, end = _first_window(allocated_rows, probe_rows)
+    response = service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[f"{sheet_name}!{header_row}:{header_row}", f"{sheet_name}!{key_column}{start}:{key_column}{end}"]
+    ).execute()
+    api_calls += 1
+    header_range, tail_range = response.get('valueRanges', [{}, {}])
+    header = header_range.get('values', [])
+    tail = tail_range.get('values', [])
+
+    # Move the window up, doubling it, until it reaches a filled cell or the top of the sheet
+    while not tail and start > 1:
+        start, end = _next_window(start, end)
+        tail = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"{sheet_name}!{key_column}{start}:{key_column}{end}"
+        ).execute().get('values', [])
+        api_calls += 1
+
+    used_rows = start - 1 + len(tail) if tail else 0
+    return SheetDimensions(allocated_rows, allocated_columns, used_rows, len(header[0]) if header else 0), api_calls
+
+async def probe_dimensions_async(client, spreadsheet_id, sheet_name, allocated_rows, allocated_columns,
+                                 header_row=2, key_column='A', probe_rows=DEFAULT_PROBE_ROWS):
+    """probe_dimensions for an AsyncSheetsClient, given the allocated size from metadata fetched elsewhere.
+
+    Returns (SheetDimensions, API calls made).
+    """
+    if not allocated_rows:
+        return SheetDimensions(0, 0, 0, 0), 0
+
+    start, end = _first_window(allocated_rows, probe_rows)
+    response = await client.values_batch_get(
+        spreadsheet_id, [f"{sheet_name}!{header_row}:{header_row}", f"{sheet_name}!{key_column}{start}:{key_column}{end}"]
+    )
+    api_calls = 1
+    header_range, tail_range = response.get('valueRanges', [{}, {}])
+    header = header_range.get('values', [])
+    tail = tail_range.get('values', [])
+
+    while not tail and start > 1:
+        start, end = _next_window(start, end)
+        tail = (await client.values_get(spreadsheet_id, f"{sheet_name}!{key_column}{start}:{key_column}{end}")).get('values', [])
+        api_calls += 1
+
+    used_rows = start - 1 + len(tail) if tail else 0
+    return SheetDimensions(allocated_rows, allocated_columns, used_rows, len(header[0]) if header else 0), api_calls
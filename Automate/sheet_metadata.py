@@ -0,0 +1,81 @@
+'''Per-run cache of spreadsheet sheet properties (titles, sheetIds and grid sizes).
+
+spreadsheets().get is called once per spreadsheet with a "sheets.properties"
+field mask, so it does not download formatting, named ranges and so on.
+Callers that add or delete sheets invalidate the cache afterwards, and so do
+values writes, since values().update and batchUpdate grow a sheet's grid to
+fit what they write.
+'''
+
+import threading
+import weakref
+
+METADATA_FIELDS = 'sheets.properties'
+
+class SpreadsheetMetadata:
+    def __init__(self, service, spreadsheet_id):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheets = None
+        self.lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """Fetch the sheet properties if they are not cached. Returns the number of API calls made."""
+        return self._load()[1]
+
+    def _load(self):
+        with self.lock:
+            if self.sheets is not None:
+                return self.sheets, 0
+            response = self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id,
+                fields=METADATA_FIELDS
+            ).execute()
+            self.sheets = [sheet['properties'] for sheet in response.get('sheets', [])]
+            return self.sheets, 1
+
+    def prime(self, sheets):
+        """Seed the cache from a "sheets" list fetched elsewhere (e.g. by the asyncio backend)."""
+        with self.lock:
+            self.sheets = [sheet['properties'] for sheet in sheets]
+
+    def invalidate(self):
+        with self.lock:
+            self.sheets = None
+
+    def properties(self, title):
+        """Return the properties of the sheet called title, or None if there is no such sheet."""
+        for properties in self._load()[0]:
+            # Sheet titles in ranges are matched case-insensitively by the API
+            if properties['title'].lower() == title.lower():
+                return properties
+        return None
+
+    def has_sheet(self, title):
+        return self.properties(title) is not None
+
+    def sheet_id(self, title):
+        properties = self.properties(title)
+        return properties['sheetId'] if properties else None
+
+    def sheet_ids(self):
+        return {properties['sheetId'] for properties in self._load()[0]}
+
+    def grid_size(self, title):
+        """Return the allocated (rowCount, columnCount) of a sheet, or (0, 0) if it does not exist."""
+        properties = self.properties(title)
+        if not properties:
+            return 0, 0
+        grid = properties.get('gridProperties', {})
+        return grid.get('rowCount', 0), grid.get('columnCount', 0)
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+def get_metadata(service, spreadsheet_id):
+    """Return the shared SpreadsheetMetadata for this service and spreadsheet."""
+    with _caches_lock:
+        per_service = _caches.setdefault(service, {})
+        if spreadsheet_id not in per_service:
+            per_service[spreadsheet_id] = SpreadsheetMetadata(service, spreadsheet_id)
+        return per_service[spreadsheet_id]
@@ -0,0 +1,76 @@
+'''OAuth and service construction shared by the scripts and the batch runner.
+
+The google-auth and googleapiclient imports are deferred to the functions that
+need them; together they cost more startup time than the short runs take.
+The Sheets discovery document comes from the copy bundled with
+googleapiclient, or from an on-disk cache (filled once from the network when
+the installed googleapiclient has no bundled copy), so building the service
+never waits on a discovery fetch.
+'''
+
+import json
+import os
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Needed only to read a spreadsheet's Drive version for the snapshot cache
+DRIVE_METADATA_SCOPE = 'https://www.googleapis.com/auth/drive.metadata.readonly'
+
+DISCOVERY_URL = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+DISCOVERY_CACHE_PATH = os.environ.get(
+    'SHEETS_DISCOVERY_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'automate_google_sheet', 'sheets.v4.json')
+)
+
+def get_credentials(credentials_file, token_file, scopes=SCOPES):
+    """Load the cached token, refreshing it or running the browser flow when needed."""
+    from google.oauth2.credentials import Credentials
+
+    creds = None
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, scopes)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
+            creds.refresh(Request())
+        else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
+            creds = flow.run_local_server(port=0)
+        with open(token_file, "w") as token:
+            token.write(creds.to_json())
+    return creds
+
+def load_discovery_document(cache_path=DISCOVERY_CACHE_PATH):
+    """Return the Sheets v4 discovery document as a JSON string without a network round trip when possible."""
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        document = get_static_doc('sheets', 'v4')
+        if document:
+            return document
+    except ImportError:
+        pass
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return f.read()
+
+    import httplib2
+    response, content = httplib2.Http().request(DISCOVERY_URL)
+    if response.status != 200:
+        raise RuntimeError(f'Could not fetch the Sheets discovery document: HTTP {response.status}')
+    document = content.decode('utf-8')
+    json.loads(document)  # Never cache a truncated or HTML error body
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, 'w') as f:
+        f.write(document)
+    return document
+
+def build_sheets_service(creds):
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.errors import HttpError
+
+    try:
+        return build_from_document(load_discovery_document(), credentials=creds)
+    except HttpError as err:
+        print(err)
+        return None
@@ -0,0 +1,169 @@
+'''Quota-aware rate limiting shared by audio_to_raw.py and raw_to_batchAudioSummary.py.
+
+service = wrap_service(get_sheets_service(...), SheetsRateLimiter())
+
+Every .execute() made through the wrapped service first takes a token from the
+read or write bucket and retries 429/5xx responses with exponential backoff.
+'''
+
+import random
+import threading
+import time
+from googleapiclient.errors import HttpError
+
+# Sheets API per-user quotas (requests per minute), tracked separately for reads and writes
+DEFAULT_READ_REQUESTS_PER_MINUTE = 60
+DEFAULT_WRITE_REQUESTS_PER_MINUTE = 60
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+READ_METHODS = {'get', 'batchGet', 'batchGetByDataFilter', 'getByDataFilter'}
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at per_minute / 60 tokens per second."""
+
+    def __init__(self, per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """Empty the bucket after the server reported the quota as exhausted."""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = self.clock()
+
+class SheetsRateLimiter:
+    def __init__(self, read_per_minute=DEFAULT_READ_REQUESTS_PER_MINUTE,
+                 write_per_minute=DEFAULT_WRITE_REQUESTS_PER_MINUTE,
+                 max_retries=5, base_delay=1.0, max_delay=64.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.buckets = {
+            'read': TokenBucket(read_per_minute, clock, sleep),
+            'write': TokenBucket(write_per_minute, clock, sleep),
+        }
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.calls = {'read': 0, 'write': 0}
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def _add_throttled(self, seconds):
+        with self.lock:
+            self.throttled_seconds += seconds
+
+    def acquire(self, quota):
+        """Wait for a token of the given quota class and count the call. Returns the seconds waited."""
+        waited = self.buckets[quota].acquire()
+        self._add_throttled(waited)
+        with self.lock:
+            self.calls[quota] += 1
+        return waited
+
+    def retry_delay(self, status, quota, attempt):
+        """Return the backoff before retry number attempt + 1, or None if status is not worth retrying."""
+        if status not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        if status == 429:
+            self.buckets[quota].drain()
+        # Full jitter: sleep a random amount up to the exponential cap
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self.lock:
+            self.retries += 1
+            self.throttled_seconds += delay
+        return delay
+
+    def execute(self, request, quota, record=None):
+        """Run request.execute() under the given quota class ('read' or 'write').
+
+        If record is a dict, the number of retries and the seconds spent throttled are stored in it.
+        """
+        attempt = 0
+        throttled = 0.0
+        try:
+            while True:
+                throttled += self.acquire(quota)
+                try:
+                    return request.execute()
+                except HttpError as err:
+                    delay = self.retry_delay(err.resp.status, quota, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    throttled += delay
+                    self.sleep(delay)
+        finally:
+            if record is not None:
+                record['retries'] = attempt
+                record['throttled_seconds'] = throttled
+
+    def report(self):
+        return (f"API calls: {self.calls['read']} reads, {self.calls['write']} writes, "
+                f"{self.retries} retries, {self.throttled_seconds:.2f}s throttled")
+
+class _RequestProxy:
+    def __init__(self, request, limiter, quota, operation, kwargs, metrics):
+        self._request = request
+        self._limiter = limiter
+        self._quota = quota
+        self._operation = operation
+        self._kwargs = kwargs
+        self._metrics = metrics
+
+    def execute(self):
+        if self._metrics is None:
+            return self._limiter.execute(self._request, self._quota)
+        return self._metrics.observe(self._operation, self._kwargs, self._quota,
+                                     lambda record: self._limiter.execute(self._request, self._quota, record))
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+class _ResourceProxy:
+    def __init__(self, resource, limiter, metrics=None, name=''):
+        self._resource = resource
+        self._limiter = limiter
+        self._metrics = metrics
+        self._name = name
+
+    def __getattr__(self, name):
+        method = getattr(self._resource, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                quota = 'read' if name in READ_METHODS else 'write'
+                operation = f'{self._name}.{name}' if self._name else name
+                return _RequestProxy(result, self._limiter, quota, operation, kwargs, self._metrics)
+            return _ResourceProxy(result, self._limiter, self._metrics, name)
+        return call
+
+def wrap_service(service, limiter, metrics=None):
+    """Return a stand-in for service whose requests all execute through limiter.
+
+    If metrics (a call_metrics.CallMetrics) is given, every call is also recorded there.
+    """
+    return _ResourceProxy(service, limiter, metrics)
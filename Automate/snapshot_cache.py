@@ -0,0 +1,235 @@
+'''On-disk snapshots of fetched sheet values (needs pyarrow: pip install pyarrow).
+
+cache = SnapshotCache("snapshots", drive_version_state(creds))
+service = wrap_snapshot_cache(wrap_service(service, limiter), cache)
+
+values().get and values().batchGet responses are stored as Arrow IPC files,
+one typed column per sheet column, under
+<directory>/<spreadsheet id>/<sheet>/<hash of range and render options>.arrow,
+and memory-mapped when loaded. A snapshot is used only while the spreadsheet's
+modification state (by default its Drive file version, which needs the
+drive.metadata.readonly scope) still matches the one saved with it. The state
+is fetched once per spreadsheet per run; after a write through the wrapped
+service the spreadsheet is no longer served from the cache for that run.
+The run's own writes move the Drive version too, and they cannot be told
+apart from someone else's edit, so a run that writes to a spreadsheet leaves
+its snapshots stale: the next run fetches them again. Reads repeated with no
+write in between, and offline analysis (load with state=None), come from disk.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import quote
+
+from a1_notation import split_sheet
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+# Members of the dense union used for columns that mix value types
+_KINDS = (str, int, float, bool)
+
+def drive_version_state(creds):
+    """Return a state function giving the Drive version of a spreadsheet, or None when it cannot be read."""
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
+    drive = build('drive', 'v3', credentials=creds, static_discovery=True)
+    lock = threading.Lock()
+
+    def state(spreadsheet_id):
+        try:
+            with lock:
+                response = drive.files().get(fileId=spreadsheet_id, fields='version', supportsAllDrives=True).execute()
+        except HttpError as err:
+            print(f"Snapshot cache not used for {spreadsheet_id}: {err}")
+            return None
+        return str(response['version'])
+    return state
+
+def _column_array(cells):
+    kinds = {type(value) for value in cells if value is not None}
+    if len(kinds) <= 1:
+        kind = kinds.pop() if kinds else str
+        if kind in _KINDS:
+            return pa.array(cells, type=_arrow_type(kind))
+
+    type_ids, offsets = [], []
+    children = [[] for _ in _KINDS]
+    for value in cells:
+        kind = _KINDS.index(type(value)) if value is not None else 0
+        type_ids.append(kind)
+        offsets.append(len(children[kind]))
+        children[kind].append(value)
+    return pa.UnionArray.from_dense(
+        pa.array(type_ids, type=pa.int8()),
+        pa.array(offsets, type=pa.int32()),
+        [pa.array(values, type=_arrow_type(kind)) for values, kind in zip(children, _KINDS)],
+        [kind.__name__ for kind in _KINDS],
+    )
+
+def _arrow_type(kind):
+    return {str: pa.large_string(), int: pa.int64(), float: pa.float64(), bool: pa.bool_()}[kind]
+
+def values_to_table(values):
+    """Store a values list (rows of unequal length) as a table with one column per position."""
+    width = max((len(row) for row in values), default=0)
+    columns = [_column_array([row[c] if c < len(row) else None for row in values]) for c in range(width)]
+    return pa.table(columns, names=[str(c) for c in range(width)])
+
+def table_to_values(table, num_rows):
+    """Inverse of values_to_table: the missing cells at the end of each row are dropped again."""
+    columns = [column.to_pylist() for column in table.columns]
+    values = []
+    for r in range(num_rows):
+        row = [column[r] for column in columns]
+        while row and row[-1] is None:
+            row.pop()
+        values.append(row)
+    return values
+
+class SnapshotCache:
+    def __init__(self, directory, state=None):
+        if pa is None:
+            raise ImportError("The snapshot cache needs pyarrow; install it with 'pip install pyarrow'.")
+        self.directory = directory
+        self.state_function = state
+        self.states = {}
+        self.written = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def state(self, spreadsheet_id):
+        """Current modification state of the spreadsheet, or None when snapshots must not be used."""
+        with self.lock:
+            if spreadsheet_id in self.written or self.state_function is None:
+                return None
+            if spreadsheet_id not in self.states:
+                self.states[spreadsheet_id] = self.state_function(spreadsheet_id)
+            return self.states[spreadsheet_id]
+
+    def mark_written(self, spreadsheet_id):
+        with self.lock:
+            self.written.add(spreadsheet_id)
+            self.states.pop(spreadsheet_id, None)
+
+    def path(self, spreadsheet_id, range_name, value_render_option='FORMATTED_VALUE', major_dimension='ROWS'):
+        sheet, _ = split_sheet(range_name)
+        key = json.dumps([range_name, value_render_option, major_dimension]).encode()
+        return os.path.join(self.directory, quote(spreadsheet_id, safe=''), quote(sheet, safe=''),
+                            hashlib.blake2b(key, digest_size=16).hexdigest() + '.arrow')
+
+    def load(self, spreadsheet_id, range_name, value_render_option='FORMATTED_VALUE', major_dimension='ROWS', state=None):
+        """Return the stored response for the range, or None if there is none or it was saved at another state.
+
+        With state=None the snapshot is returned whatever state it was saved at (for offline analysis).
+        """
+        path = self.path(spreadsheet_id, range_name, value_render_option, major_dimension)
+        if not os.path.exists(path):
+            return None
+        with pa.memory_map(path) as source:
+            table = ipc.open_file(source).read_all()
+        meta = json.loads(table.schema.metadata[b'snapshot'])
+        if state is not None and meta['state'] != state:
+            return None
+        response = meta['response']
+        if meta['rows']:
+            response['values'] = table_to_values(table, meta['rows'])
+        return response
+
+    def store(self, spreadsheet_id, range_name, value_render_option, major_dimension, state, response):
+        path = self.path(spreadsheet_id, range_name, value_render_option, major_dimension)
+        values = response.get('values', [])
+        table = values_to_table(values)
+        meta = {
+            'state': state,
+            'rows': len(values),
+            'response': {key: value for key, value in response.items() if key != 'values'},
+        }
+        table = table.replace_schema_metadata({'snapshot': json.dumps(meta)})
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            with ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def execute(self, request, method, kwargs):
+        spreadsheet_id = kwargs.get('spreadsheetId')
+        if method == 'values.get':
+            return self._execute_get(request, spreadsheet_id, [kwargs['range']], kwargs)['valueRanges'][0]
+        if method == 'values.batchGet':
+            ranges = kwargs['ranges']
+            return self._execute_get(request, spreadsheet_id, [ranges] if isinstance(ranges, str) else ranges, kwargs)
+        if not method.endswith('.get') and spreadsheet_id:
+            self.mark_written(spreadsheet_id)
+        return request.execute()
+
+    def _execute_get(self, request, spreadsheet_id, ranges, kwargs):
+        render = kwargs.get('valueRenderOption', 'FORMATTED_VALUE')
+        major = kwargs.get('majorDimension', 'ROWS')
+        single = 'range' in kwargs
+
+        state = self.state(spreadsheet_id)
+        if state is not None:
+            cached = [self.load(spreadsheet_id, r, render, major, state) for r in ranges]
+            if all(response is not None for response in cached):
+                with self.lock:
+                    self.hits += len(ranges)
+                return {'spreadsheetId': spreadsheet_id, 'valueRanges': cached}
+
+        response = request.execute()
+        value_ranges = [response] if single else response.get('valueRanges', [])
+        if state is not None:
+            with self.lock:
+                self.misses += len(ranges)
+            for range_name, value_range in zip(ranges, value_ranges):
+                self.store(spreadsheet_id, range_name, render, major, state, value_range)
+        return {'spreadsheetId': spreadsheet_id, 'valueRanges': value_ranges} if single else response
+
+    def report(self):
+        return f"Snapshot cache: {self.hits} ranges from disk, {self.misses} fetched"
+
+class _CachedRequest:
+    def __init__(self, request, cache, method, kwargs):
+        self._request = request
+        self._cache = cache
+        self._method = method
+        self._kwargs = kwargs
+
+    def execute(self):
+        return self._cache.execute(self._request, self._method, self._kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+class _CacheResourceProxy:
+    def __init__(self, resource, cache, path):
+        self._resource = resource
+        self._cache = cache
+        self._path = path
+
+    def __getattr__(self, name):
+        method = getattr(self._resource, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _CachedRequest(result, self._cache, f'{self._path}.{name}'.lstrip('.'), kwargs)
+            return _CacheResourceProxy(result, self._cache, name)
+        return call
+
+def wrap_snapshot_cache(service, cache):
+    """Return a stand-in for service whose values reads are served from cache when still valid."""
+    return _CacheResourceProxy(service, cache, '')
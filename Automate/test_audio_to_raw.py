@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_to_raw import materialize_audio_rows, transform_audio_rows
+from benchmark import make_audio_sheet
+from sharded_transform import transform_audio_rows_sharded
+
+URL = "https://docs.google.com/spreadsheets/d/1B773sQV9sL31j6-vOUOHwvuIRWMU-WcK"
+
+def hyperlink(label):
+    return f'=HYPERLINK("{URL}", {label})'
+
+def test_materialize_reads_hyperlink_labels():
+    audio_rows = [
+        [None, None, None, None, 0.0, 1297.9],
+        ['State', 'Districts', 'Status', 'Minutes', hyperlink('"03-05-2023"'), hyperlink('"03-07-2023"')],
+        ['Bihar', 'Saran', hyperlink('"Raw Delivered"'), '=SUM(E3:FH3)', None, hyperlink('1772.391934375')],
+        ['Bihar', 'Saran', 'Delivered greater than acceptance threshold', '=SUM(E4:FH4)', hyperlink('"RE-1420.55"'), 12],
+        ['Bihar', 'Saran', 'Raw Redelivery', '=SUM(E5:FH5)', hyperlink('"RE-7"'), '=hyperlink("x","pending")'],
+    ]
+
+    rows, redelivered = materialize_audio_rows(audio_rows, 0, 6)
+
+    assert rows[:2] == list(transform_audio_rows(audio_rows[:2], 0, 6, 'Audio'))
+    assert [row[4:] for row in rows[2:]] == [[0, 1772.391934375], [1420.55, 12], [7, '=hyperlink("x","pending")']]
+    assert rows[2][:4] == audio_rows[2][:4]
+    assert redelivered == [[], [], [False, False], [True, False], [True, False]]
+
+def test_materialize_error_value_for_text_labels():
+    audio_rows = [['State', 'Districts', 'Status', 'Minutes', 'Batch 1'],
+                  ['Bihar', 'Saran', 'Raw Delivered', '', hyperlink('"n/a"')]]
+
+    rows, _ = materialize_audio_rows(audio_rows, 1, 5, error_value='#VALUE!')
+
+    assert rows[1][4] == '#VALUE!'
+
+def test_sharded_rows_match_the_serial_transform():
+    audio_rows = make_audio_sheet(60, 7)
+    serial = list(transform_audio_rows(audio_rows, 0, 7, 'Audio'))
+
+    assert transform_audio_rows_sharded(audio_rows, 0, 7, 'Audio', workers=2, block_rows=16) == serial
+    # From a thread pool the workers are spawned instead of forked
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sharded = executor.submit(transform_audio_rows_sharded, audio_rows, 0, 7, 'Audio', 2, 16).result()
+    assert sharded == serial
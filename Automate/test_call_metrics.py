@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from async_sheets import AsyncSheetsClient
+from call_metrics import CallMetrics
+from fake_sheets_service import FakeSheetsService
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+class TimingOutRequest:
+    def execute(self):
+        raise TimeoutError('timed out')
+
+def test_every_failure_is_recorded_with_its_status():
+    metrics = CallMetrics()
+    fake = FakeSheetsService()
+    service = wrap_service(fake, SheetsRateLimiter(), metrics)
+
+    with pytest.raises(TimeoutError):
+        metrics.observe('values.get', {'range': 'Audio!A1'}, 'read', lambda record: TimingOutRequest().execute())
+    with pytest.raises(HttpError):
+        service.spreadsheets().values().get(spreadsheetId='missing', range='Audio!A1').execute()
+
+    assert [(call['operation'], call['status']) for call in metrics.calls] == [
+        ('values.get', 'TimeoutError'), ('values.get', '404')]
+    assert 'status="ok"' not in metrics.prometheus_text()
+
+class Credentials:
+    valid = True
+
+    def apply(self, headers):
+        headers['authorization'] = 'Bearer token'
+
+def test_async_client_calls_are_recorded():
+    httpx = pytest.importorskip('httpx')
+
+    def respond(request):
+        if request.url.path.endswith('/values:batchGet'):
+            return httpx.Response(200, json={'valueRanges': [{'values': [['a', 'b'], ['c']]}]})
+        return httpx.Response(403, json={'error': {'message': 'forbidden'}})
+
+    async def run(metrics):
+        async with AsyncSheetsClient(Credentials(), transport=httpx.MockTransport(respond), metrics=metrics) as client:
+            await client.values_batch_get('test', ['Raw!A1:B2'])
+            with pytest.raises(HttpError):
+                await client.get('test', fields='sheets.properties')
+
+    metrics = CallMetrics()
+    asyncio.run(run(metrics))
+
+    first, second = metrics.calls
+    assert (first['operation'], first['ranges'], first['cells'], first['status']) == (
+        'values.batchGet', ['Raw!A1:B2'], 3, 'ok')
+    assert (second['operation'], second['quota'], second['status']) == ('spreadsheets.get', 'read', '403')
@@ -0,0 +1,53 @@
+import contextlib
+import io
+import re
+
+import pytest
+
+from a1_notation import col_letter_to_num
+from audio_to_raw import copy_columns, create_raw_sheet
+from benchmark import make_audio_sheet
+from fake_sheets_service import FakeSheetsService
+from pipeline import run_pipeline
+from raw_to_batchAudioSummary import create_or_update_sheet
+
+SPREADSHEET_ID = 'test'
+
+SUBSTITUTE = re.compile(r'^=SUBSTITUTE\(Audio!([A-Z]+)(\d+), "RE-", "", 1\)\*1$')
+LABEL = re.compile(r'^=HYPERLINK\("[^"]*", "?([^"]*)"?\)$')
+
+def displayed(value, audio):
+    """What a RawAuto cell written by audio_to_raw in formula mode shows in the sheet."""
+    match = SUBSTITUTE.match(value) if isinstance(value, str) else None
+    if not match:
+        return value
+    source = audio[int(match.group(2)) - 1][col_letter_to_num(match.group(1)) - 1]
+    label = LABEL.match(source).group(1) if LABEL.match(source) else source
+    number = float(label.replace('RE-', '', 1))
+    return int(number) if number.is_integer() else number
+
+def summary_rows(fake):
+    return fake.sheet_values(SPREADSHEET_ID, 'BatchAudioSummaryAuto')[:10]
+
+@pytest.mark.parametrize('raw_mode', ['formula', 'values'])
+def test_pipeline_matches_the_two_scripts_on_hyperlink_data(raw_mode):
+    audio = make_audio_sheet(80, 9)
+
+    scripts = FakeSheetsService()
+    scripts.add_spreadsheet(SPREADSHEET_ID, {'Audio': audio})
+    pipeline = FakeSheetsService()
+    pipeline.add_spreadsheet(SPREADSHEET_ID, {'Audio': audio})
+    with contextlib.redirect_stdout(io.StringIO()):
+        # audio_to_raw writes SUBSTITUTE formulas; the summary script reads back what they display
+        create_raw_sheet(scripts, SPREADSHEET_ID, 'RawAuto')
+        copy_columns(scripts, SPREADSHEET_ID, 'Audio', 'RawAuto')
+        shown = [[displayed(value, audio) for value in row] for row in scripts.sheet_values(SPREADSHEET_ID, 'RawAuto')]
+        scripts.spreadsheets().values().update(spreadsheetId=SPREADSHEET_ID, range='RawAuto!A1',
+                                               valueInputOption='RAW', body={'values': shown}).execute()
+        create_or_update_sheet(scripts, SPREADSHEET_ID, 'RawAuto', 'BatchAudioSummaryAuto', 'values')
+
+        run_pipeline(pipeline, SPREADSHEET_ID, 'Audio', 'RawAuto', 'BatchAudioSummaryAuto', 'values', raw_mode=raw_mode)
+
+    expected = summary_rows(scripts)
+    assert summary_rows(pipeline) == expected
+    assert all(row[1] != 0 for row in expected[1:])
@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import io
+import re
+
+import pytest
+
+from a1_notation import col_letter_to_num
+from audio_to_raw import copy_columns, create_raw_sheet
+from benchmark import make_audio_sheet
+from district_index import district_hours
+from fake_sheets_service import FakeSheetsService
+from pipeline import run_pipeline
+from raw_to_batchAudioSummary import (
+    additional_operations,
+    create_or_update_sheet,
+    read_summary_inputs,
+    read_summary_inputs_async,
+    read_summary_inputs_batched,
+)
+
+SPREADSHEET_ID = 'test'
+
+SUMPRODUCT = re.compile(r'^=SUMPRODUCT\(\(MOD\(ROW\((\w+)!([A-Z]+)(\d+):\2(\d+)\)-ROW\(\1!\2\3\),8\)=0\)\*\1!\2\3:\2\4\)/60$')
+DIFFERENCE = re.compile(r'^=([A-Z]+)(\d+)-([A-Z]+)(\d+)$')
+ROW_SUM = re.compile(r'^=SUM\(\w+!([A-Z]+)(\d+):([A-Z]+)\2\)$')
+DISTRICT_HOURS = re.compile(r'^=ROUND\(rawAuto!D(\d+)/60,2\)$')
+MINUTES = re.compile(r'^=SUM\(E(\d+):([A-Z]+)\1\)$')
+EXCEEDED = re.compile(r'^=IF\(([A-Z]+)(\d+) > 100, "Exceeded", \1\2\)$')
+COLUMN_SUM = re.compile(r'^=SUM\(([A-Z]+)14:\1\)$')
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+def evaluate(formula, raw_rows, summary_rows):
+    """What the sheet shows for the summary formulas of create_or_update_sheet, given the RawAuto values."""
+    if not isinstance(formula, str) or not formula.startswith('=') or formula.startswith('=HYPERLINK('):
+        return formula
+
+    def cell(rows, row, col):
+        return rows[row - 1][col - 1] if row <= len(rows) and col <= len(rows[row - 1]) else ''
+
+    match = SUMPRODUCT.match(formula)
+    if match:
+        _, column, first, last = match.groups()
+        col = col_letter_to_num(column)
+        return sum(_number(cell(raw_rows, row, col)) for row in range(int(first), int(last) + 1, 8)) / 60
+    match = DIFFERENCE.match(formula)
+    if match:
+        left = cell(summary_rows, int(match.group(2)), col_letter_to_num(match.group(1)))
+        right = cell(summary_rows, int(match.group(4)), col_letter_to_num(match.group(3)))
+        return evaluate(left, raw_rows, summary_rows) - evaluate(right, raw_rows, summary_rows)
+    match = ROW_SUM.match(formula)
+    if match:
+        row = int(match.group(2))
+        last = min(col_letter_to_num(match.group(3)), len(summary_rows[row - 1]))
+        return sum(_number(evaluate(cell(summary_rows, row, col), raw_rows, summary_rows))
+                   for col in range(col_letter_to_num(match.group(1)), last + 1))
+    raise ValueError(f'no evaluator for {formula}')
+
+def make_service(num_rows=80, num_columns=9):
+    fake = FakeSheetsService()
+    fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': make_audio_sheet(num_rows, num_columns)})
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_raw_sheet(fake, SPREADSHEET_ID, 'RawAuto')
+        copy_columns(fake, SPREADSHEET_ID, 'Audio', 'RawAuto', raw_mode='values')
+    return fake
+
+def summary_grid(fake, target):
+    raw_rows = fake.sheet_values(SPREADSHEET_ID, 'RawAuto')
+    rows = fake.sheet_values(SPREADSHEET_ID, target)
+    return [[evaluate(value, raw_rows, rows) for value in row] for row in rows[:10]]
+
+@pytest.mark.parametrize('read_plan', ['separate', 'batched'])
+def test_formula_and_values_totals_match(read_plan):
+    fake = make_service()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for target, summary_mode in [('Formulas', 'formula'), ('Values', 'values')]:
+            inputs = None
+            if read_plan == 'batched':
+                inputs, _ = read_summary_inputs_batched(fake, SPREADSHEET_ID, 'RawAuto', summary_mode)
+            create_or_update_sheet(fake, SPREADSHEET_ID, 'RawAuto', target, summary_mode, inputs=inputs)
+
+    formulas, values = summary_grid(fake, 'Formulas'), summary_grid(fake, 'Values')
+    assert [row[0] for row in formulas] == [row[0] for row in values]
+    assert formulas[0][:5] == values[0][:5]
+    # Every batch column, the last one included, has totals
+    assert len(values[0]) == 2 + 5 and values[0][-1]
+    assert all(values[1][col] > 0 for col in range(1, 7))
+    for formula_row, value_row in zip(formulas[1:], values[1:]):
+        assert formula_row[1:] == pytest.approx(value_row[1:])
+
+def test_reads_after_copy_columns_see_the_grown_raw_sheet():
+    # copy_columns grows the new RawAuto past its 1000x26 grid; the cached grid size must not cut the reads short
+    fake = make_service(num_rows=1500, num_columns=40)
+    raw_rows = fake.sheet_values(SPREADSHEET_ID, 'RawAuto')
+    assert (len(raw_rows), len(raw_rows[1])) == (1502, 40)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        separate = read_summary_inputs(fake, SPREADSHEET_ID, 'RawAuto', 'values')
+        batched, _ = read_summary_inputs_batched(fake, SPREADSHEET_ID, 'RawAuto', 'values')
+
+    for inputs in (separate, batched):
+        assert (inputs['raw_num_rows'], inputs['num_columns_raw']) == (1502, 40)
+
+def evaluate_districts(formula, raw_rows, summary_rows):
+    """What the sheet shows for the formulas additional_operations writes below row 12."""
+    if not isinstance(formula, str):
+        return formula
+    match = DISTRICT_HOURS.match(formula)
+    if match:
+        if int(match.group(1)) > len(raw_rows):
+            return 0
+        row = raw_rows[int(match.group(1)) - 1]
+        minutes = MINUTES.match(row[3])
+        return round(sum(_number(value) for value in row[4:col_letter_to_num(minutes.group(2))]) / 60, 2)
+    match = EXCEEDED.match(formula)
+    if match:
+        value = evaluate_districts(summary_rows[int(match.group(2)) - 1][col_letter_to_num(match.group(1)) - 1],
+                                   raw_rows, summary_rows)
+        return "Exceeded" if value > 100 else value
+    match = COLUMN_SUM.match(formula)
+    if match:
+        col = col_letter_to_num(match.group(1)) - 1
+        return sum(_number(evaluate_districts(row[col], raw_rows, summary_rows)) for row in summary_rows[13:])
+    return formula
+
+def test_district_hours_match_the_round_formulas():
+    audio = make_audio_sheet(80, 9)
+    sheets = {}
+    for formula_mode in ['cell', 'values']:
+        fake = FakeSheetsService()
+        fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': audio})
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_pipeline(fake, SPREADSHEET_ID, 'Audio', 'RawAuto', 'BatchAudioSummaryAuto', 'values',
+                         raw_mode='values', formula_mode=formula_mode)
+        raw_rows = fake.sheet_values(SPREADSHEET_ID, 'RawAuto')
+        rows = fake.sheet_values(SPREADSHEET_ID, 'BatchAudioSummaryAuto')
+        sheets[formula_mode] = [[evaluate_districts(value, raw_rows, rows) for value in row[:9]] for row in rows[11:]]
+
+    formulas, values = sheets['cell'], sheets['values']
+    assert len(values) == 2 + 10
+    # The formula mode writes a formula row per RawAuto row; the rows past the districts show 0
+    assert all(not any(row[:2]) and not any(row[2:]) for row in formulas[len(values):])
+    assert formulas[0][:5] == values[0][:5]
+    assert formulas[1][2:5] == pytest.approx(values[1][2:5])
+    for formula_row, value_row in zip(formulas[2:], values[2:]):
+        assert formula_row[:2] == value_row[:2]
+        assert formula_row[2:5] == pytest.approx(value_row[2:5])
+        assert formula_row[6:9] == value_row[6:9]
+    assert any(row[2] for row in values[2:])
+
+def test_district_hours_read_status_hyperlinks_like_audio_to_raw():
+    rows = [['Bihar', 'Saran', '=HYPERLINK("https://x/?q=""a""", "Raw ""QC"" Delivered")', 120],
+            ['Bihar', 'Saran', '=hyperlink( "https://x" , "Raw Delivered" )', 60]]
+
+    districts, _ = district_hours(rows, ['Raw "QC" Delivered', 'Raw Delivered'])
+
+    assert districts.values.tolist() == [['Bihar', 'Saran', 2.0, 1.0]]
+
+@pytest.mark.parametrize('formula_mode', ['cell', 'array', 'values'])
+def test_state_and_district_names_stay_text(formula_mode):
+    audio = make_audio_sheet(16, 6)
+    for row in audio[2:]:
+        row[0], row[1] = '1e3', '0012' if row[1] == 'District 0' else '2023-01-05'
+    fake = FakeSheetsService()
+    fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': audio})
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_pipeline(fake, SPREADSHEET_ID, 'Audio', 'RawAuto', 'BatchAudioSummaryAuto', 'values',
+                     raw_mode='values', formula_mode=formula_mode)
+
+    rows = fake.sheet_values(SPREADSHEET_ID, 'BatchAudioSummaryAuto')
+    assert [row[:2] for row in rows[13:15]] == [['1e3', '0012'], ['1e3', '2023-01-05']]
+
+    # The whole stage is one USER_ENTERED batchUpdate (reading the names back from RawAuto as text)
+    fake.spreadsheets().values().update(spreadsheetId=SPREADSHEET_ID, range='RawAuto!A3', valueInputOption='RAW',
+                                        body={'values': [row[:2] for row in audio[2:]]}).execute()
+    writes = fake.calls['values.batchUpdate']
+    with contextlib.redirect_stdout(io.StringIO()):
+        additional_operations(fake, SPREADSHEET_ID, formula_mode=formula_mode)
+    assert fake.calls['values.batchUpdate'] == writes + 1
+    rows = fake.sheet_values(SPREADSHEET_ID, 'BatchAudioSummaryAuto')
+    assert [row[:2] for row in rows[13:15]] == [['1e3', '0012'], ['1e3', '2023-01-05']]
+
+@pytest.mark.parametrize('formula_mode', ['cell', 'values'])
+def test_atomic_rebuild_writes_the_whole_sheet_in_one_batchupdate(formula_mode):
+    audio = make_audio_sheet(40, 8)
+    sheets = {}
+    for rebuild_mode in ['recreate', 'atomic']:
+        fake = FakeSheetsService()
+        fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': audio, 'BatchAudioSummaryAuto': [['old']]})
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_pipeline(fake, SPREADSHEET_ID, 'Audio', 'RawAuto', 'BatchAudioSummaryAuto', 'values', rebuild_mode,
+                         raw_mode='values', formula_mode=formula_mode)
+        sheets[rebuild_mode] = fake.sheet_values(SPREADSHEET_ID, 'BatchAudioSummaryAuto')
+        if rebuild_mode == 'atomic':
+            # One values update for RawAuto; the summary goes in with the deleteSheet/addSheet batchUpdate
+            assert fake.calls['values.batchUpdate'] == 0
+            assert fake.calls['spreadsheets.batchUpdate'] == 2
+
+    trim = lambda rows: [[value for value in row if value not in ('', None)] for row in rows]
+    assert trim(sheets['atomic']) == trim(sheets['recreate'])
+
+def test_unchanged_in_place_run_writes_nothing_with_date_headers():
+    fake = make_service(40, 8)
+    # The real RawAuto headers are dates as text; USER_ENTERED stores them as dates
+    raw_rows = fake.sheet_values(SPREADSHEET_ID, 'RawAuto')
+    headers = [f'03-{day:02d}-2023' for day in range(5, 5 + len(raw_rows[1]) - 4)]
+    fake.spreadsheets().values().update(spreadsheetId=SPREADSHEET_ID, range='RawAuto!E2', valueInputOption='RAW',
+                                        body={'values': [headers]}).execute()
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_or_update_sheet(fake, SPREADSHEET_ID, 'RawAuto', 'Summary', 'formula')
+        create_or_update_sheet(fake, SPREADSHEET_ID, 'RawAuto', 'Summary', 'formula', 'in-place')
+        writes = fake.calls['values.batchUpdate'] + fake.calls['values.update']
+        create_or_update_sheet(fake, SPREADSHEET_ID, 'RawAuto', 'Summary', 'formula', 'in-place')
+
+    assert fake.calls['values.batchUpdate'] + fake.calls['values.update'] == writes
+
+class FakeAsyncClient:
+    """The AsyncSheetsClient calls of read_summary_inputs_async, answered by a FakeSheetsService."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.ranges = []
+
+    async def get(self, spreadsheet_id, fields=None):
+        return self.fake.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=fields).execute()
+
+    async def values_get(self, spreadsheet_id, range_name, value_render_option='FORMATTED_VALUE'):
+        self.ranges.append(range_name)
+        return self.fake.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name,
+                                                     valueRenderOption=value_render_option).execute()
+
+    async def values_batch_get(self, spreadsheet_id, ranges, value_render_option='FORMATTED_VALUE'):
+        self.ranges.extend(ranges)
+        return self.fake.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges,
+                                                          valueRenderOption=value_render_option).execute()
+
+def test_async_reads_match_the_separate_reads():
+    fake = FakeSheetsService()
+    fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': make_audio_sheet(40, 8)})
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_raw_sheet(fake, SPREADSHEET_ID, 'Raw Data')
+        copy_columns(fake, SPREADSHEET_ID, 'Audio', 'Raw Data', raw_mode='values')
+    client = FakeAsyncClient(fake)
+
+    inputs, sheets, raw_auto = asyncio.run(read_summary_inputs_async(client, SPREADSHEET_ID, 'Raw Data', 'values'))
+
+    expected = read_summary_inputs(fake, SPREADSHEET_ID, 'Raw Data', 'values')
+    assert {k: v for k, v in inputs.items() if k != 'api_calls'} == {k: v for k, v in expected.items() if k != 'api_calls'}
+    assert [sheet['properties']['title'] for sheet in sheets] == ['Audio', 'Raw Data']
+    assert raw_auto == [row[:2] for row in fake.sheet_values(SPREADSHEET_ID, 'Raw Data')[2:]]
+    # Every read is bounded and on the configured sheet
+    assert all(re.match(r"^Raw Data!([A-Z]+\d+:[A-Z]+\d+|2:2)$", range_name) for range_name in client.ranges)
@@ -0,0 +1,57 @@
+import contextlib
+import io
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from audio_to_raw import copy_columns, create_raw_sheet
+from benchmark import make_audio_sheet
+from fake_sheets_service import FakeSheetsService
+from snapshot_cache import SnapshotCache, wrap_snapshot_cache
+
+SPREADSHEET_ID = 'test'
+WRITES = ('values.update', 'values.batchUpdate', 'values.clear', 'spreadsheets.batchUpdate')
+
+def version_state(fake):
+    """A stand-in for the Drive version: it goes up with every write to the fake, ours included."""
+    return lambda spreadsheet_id: str(sum(fake.calls[method] for method in WRITES))
+
+def make_service():
+    fake = FakeSheetsService()
+    fake.add_spreadsheet(SPREADSHEET_ID, {'Audio': make_audio_sheet(40, 8)})
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_raw_sheet(fake, SPREADSHEET_ID, 'RawAuto')
+    return fake
+
+def read_audio(fake, directory):
+    cache = SnapshotCache(str(directory), version_state(fake))
+    values = wrap_snapshot_cache(fake, cache).spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID, range='Audio!A1:L42').execute()['values']
+    return cache, values
+
+def test_reads_with_no_write_in_between_come_from_disk(tmp_path):
+    fake = make_service()
+
+    first, values = read_audio(fake, tmp_path)
+    second, cached = read_audio(fake, tmp_path)
+
+    assert (first.hits, first.misses) == (0, 1)
+    assert (second.hits, second.misses) == (1, 0)
+    assert cached == values
+
+def test_an_edit_during_a_writing_run_is_not_hidden(tmp_path):
+    fake = make_service()
+    edit = fake.spreadsheets().values().update
+    cache = SnapshotCache(str(tmp_path), version_state(fake))
+    with contextlib.redirect_stdout(io.StringIO()):
+        copy_columns(wrap_snapshot_cache(fake, cache), SPREADSHEET_ID, 'Audio', 'RawAuto', raw_mode='values')
+    # Someone edits Audio after the run read it, before it ended
+    edit(spreadsheetId=SPREADSHEET_ID, range='Audio!E3', valueInputOption='RAW', body={'values': [[999]]}).execute()
+
+    cache = SnapshotCache(str(tmp_path), version_state(fake))
+    with contextlib.redirect_stdout(io.StringIO()):
+        copy_columns(wrap_snapshot_cache(fake, cache), SPREADSHEET_ID, 'Audio', 'RawAuto', raw_mode='values')
+
+    assert cache.hits == 0
+    assert fake.sheet_values(SPREADSHEET_ID, 'RawAuto')[2][4] == 999
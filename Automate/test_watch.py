@@ -0,0 +1,89 @@
+import contextlib
+import io
+import json
+
+from batch_runner import run_batches
+from benchmark import make_audio_sheet
+from fake_sheets_service import FakeSheetsService
+from watch import Watcher, content_state, probe_state, watch
+
+SPREADSHEET_IDS = ['a', 'b', 'c', 'missing']
+
+def make_watch():
+    fake = FakeSheetsService()
+    for seed, spreadsheet_id in enumerate(SPREADSHEET_IDS[:-1]):
+        fake.add_spreadsheet(spreadsheet_id, {'Audio': make_audio_sheet(24, 6, seed)})
+    now = [0.0]
+    watcher = Watcher(SPREADSHEET_IDS, probe_state(fake, 'Audio'), quiet_seconds=120, clock=lambda: now[0],
+                      backoff_seconds=60)
+    runs = []
+
+    def run(due):
+        runs.append(list(due))
+        return run_batches(due, lambda: fake, 2, audio_sheet_name='Audio', raw_sheet_name='RawAuto',
+                           target_sheet_name='BatchAudioSummaryAuto', raw_mode='values', summary_mode='values')
+
+    def poll(times):
+        with contextlib.redirect_stdout(io.StringIO()):
+            watch(watcher, run, 60, lambda seconds: now.__setitem__(0, now[0] + seconds), max_polls=times)
+    return fake, watcher, runs, poll
+
+def test_only_changed_spreadsheets_run_and_a_missing_one_backs_off():
+    fake, watcher, runs, poll = make_watch()
+
+    # Polls at 0, 60, 120 and 180 seconds: everything is new and quiet from 120 on
+    poll(4)
+    assert runs == [['a', 'b', 'c']]
+    assert all(fake.sheet_values(spreadsheet_id, 'BatchAudioSummaryAuto') for spreadsheet_id in 'abc')
+    # The 404 is probed at 0, 60 and 180 seconds only, and never stops the others
+    assert watcher.failures['missing'] == (3, 180 + 240)
+
+    # Nothing changed, and the pipeline's own writes are not in the probe
+    poll(3)
+    assert runs == [['a', 'b', 'c']]
+
+    # A new batch column in b, and rows added to c's grid
+    fake.spreadsheets().values().update(spreadsheetId='b', range='Audio!Z2', valueInputOption='RAW',
+                                        body={'values': [['New batch']]}).execute()
+    fake.spreadsheets().batchUpdate(spreadsheetId='c', body={'requests': [
+        {'appendDimension': {'sheetId': 0, 'dimension': 'ROWS', 'length': 500}}]}).execute()
+    poll(4)
+    assert runs == [['a', 'b', 'c'], ['b', 'c']]
+
+def test_a_failed_run_is_retried_after_its_backoff():
+    fake, watcher, runs, poll = make_watch()
+    # Probed fine, but the pipeline fails on it
+    fake.add_spreadsheet('missing', {'Audio': [['x']]})
+
+    # Runs at 120 seconds, fails, and is tried again at 180 only
+    poll(5)
+    assert runs == [['a', 'b', 'c', 'missing'], ['missing']]
+    assert watcher.failures['missing'] == (2, 180 + 120)
+    assert set(watcher.processed) == {'a', 'b', 'c'}
+
+def test_drive_mode_settles_only_when_audio_did_not_change_during_the_run():
+    fake = FakeSheetsService()
+    for spreadsheet_id in 'ab':
+        fake.add_spreadsheet(spreadsheet_id, {'Audio': make_audio_sheet(24, 6)})
+    # A stand-in for the Drive version: it moves with every change, the pipeline's own writes included
+    version = lambda spreadsheet_id: json.dumps([sheet['rows'] for sheet in fake.spreadsheets_by_id[spreadsheet_id]['sheets']])
+    now = [0.0]
+    watcher = Watcher('ab', version, quiet_seconds=0, clock=lambda: now[0], settle=content_state(fake, 'Audio'))
+    runs = []
+
+    def run(due):
+        runs.append(list(due))
+        results = run_batches(due, lambda: fake, 2, audio_sheet_name='Audio', raw_sheet_name='RawAuto',
+                              target_sheet_name='BatchAudioSummaryAuto', raw_mode='values', summary_mode='values')
+        if len(runs) == 1:
+            # Someone edits b's Audio after the pipeline read it
+            fake.spreadsheets().values().update(spreadsheetId='b', range='Audio!E3', valueInputOption='RAW',
+                                                body={'values': [[999]]}).execute()
+        return results
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        watch(watcher, run, 60, lambda seconds: now.__setitem__(0, now[0] + seconds), max_polls=4)
+
+    # a settles on the version its own run left; b is run again for the edit, then settles too
+    assert runs == [['a', 'b'], ['b']]
+    assert fake.sheet_values('b', 'RawAuto')[2][4] == 999
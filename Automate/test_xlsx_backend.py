@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+openpyxl = pytest.importorskip('openpyxl')
+
+import xlsx_backend
+
+WORKBOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vaibhav_Shaip_SOP_V2.xlsx')
+
+def test_default_run_on_the_repo_workbook_has_totals(tmp_path, monkeypatch, capsys):
+    output = tmp_path / 'processed.xlsx'
+    monkeypatch.setattr(sys, 'argv', ['xlsx_backend.py', '--input', WORKBOOK, '--output', str(output)])
+    xlsx_backend.main()
+    assert 'Warning' not in capsys.readouterr().out
+
+    workbook = openpyxl.load_workbook(output, read_only=True)
+    audio = list(workbook['Audio'].iter_rows(max_row=1, values_only=True))[0]
+    summary = list(workbook['BatchAudioSummaryAuto'].iter_rows(max_row=10, values_only=True))
+    batch_hours = [row[2:] for row in summary[1:]]
+    assert all(row[1] for row in summary[1:])
+    # Row 1 of the Audio sheet holds the Raw Delivered hours of each batch
+    assert batch_hours[0] == pytest.approx([value or 0 for value in audio[4:4 + len(batch_hours[0])]])
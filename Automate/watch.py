@@ -0,0 +1,272 @@
+'''python watch.py
+--credentials-file client_secret.json
+--token-file token.json
+--manifest batches.txt
+--poll-seconds 60
+--quiet-seconds 120
+
+Keeps running and processes a spreadsheet only after its Audio sheet changed.
+Every poll fetches a cheap change state per spreadsheet: by default a hash of
+the Audio grid size (rows and columns, from a fields-limited
+spreadsheets.get) and of rows 1 and 2 (the batch totals, and the headers,
+which gain a column per batch), or with --change-detection drive the Drive
+file version (needs the drive.metadata.readonly scope). The probe reads the
+same few cells however long the sheet grows, so an edit inside the existing
+rows that leaves rows 1 and 2 alone goes unnoticed; use --change-detection
+drive when those edits must trigger a run. A changed spreadsheet is run once
+its state has stayed the same for --quiet-seconds, so a burst of edits costs
+one run. The pipeline's own writes move the Drive version, so in drive mode
+the version after a run counts as processed only if a hash of the Audio
+sheet's contents is the same before and after the run; otherwise an edit
+made while it ran could be absorbed, and the spreadsheet is run again.
+A spreadsheet whose state cannot be fetched, or whose run failed, is
+left alone for --backoff-seconds, doubling with each failure in a row up to
+an hour, while the others keep being watched. The states last processed can
+be kept in --state-file, so a restart does not process everything again.
+
+Watcher takes the state function and a clock, so it can be driven by
+FakeSheetsService and a fake clock in tests.
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from googleapiclient.errors import HttpError
+
+from batch_runner import print_results, read_manifest, run_batches
+from call_metrics import CallMetrics
+from cli_options import metrics_options, mode_options, quota_options
+from sheets_auth import DRIVE_METADATA_SCOPE, SCOPES, build_sheets_service, get_credentials
+from sheets_rate_limiter import SheetsRateLimiter, wrap_service
+
+DEFAULT_PROBE_RANGES = ('1:2',)
+PROBE_FIELDS = 'sheets.properties(title,gridProperties)'
+DEFAULT_POLL_SECONDS = 60
+DEFAULT_QUIET_SECONDS = 120
+DEFAULT_BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 3600
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Re-run the pipeline for spreadsheets whose Audio sheet changed.",
+                                     parents=[mode_options(district_index=False), metrics_options(), quota_options()])
+    parser.add_argument('--credentials-file', type=str, required=True, help='Path to the credentials JSON file.')
+    parser.add_argument('--token-file', type=str, required=True, help='Path to the token JSON file.')
+    parser.add_argument('--spreadsheet-ids', type=str, nargs='*', default=[], help='Spreadsheet IDs to watch.')
+    parser.add_argument('--manifest', type=str, default=None, help='File with one spreadsheet ID per line.')
+    parser.add_argument('--workers', type=int, default=4, help='Spreadsheets processed concurrently.')
+    parser.add_argument('--audio-sheet-name', type=str, default='Audio', help='Name of the Audio sheet.')
+    parser.add_argument('--raw-sheet-name', type=str, default='RawAuto', help='Name of the raw sheet.')
+    parser.add_argument('--target-sheet-name', type=str, default='BatchAudioSummaryAuto', help='Name of the summary sheet.')
+    parser.add_argument('--change-detection', choices=['probe', 'drive'], default='probe',
+                        help='Hash a small read of the Audio sheet (probe) or compare Drive file versions (drive).')
+    parser.add_argument('--probe-ranges', type=str, nargs='*', default=list(DEFAULT_PROBE_RANGES),
+                        help='Audio sheet ranges hashed by the probe, with its grid size. Keep them bounded '
+                             '(rows, not whole columns): they are read on every poll.')
+    parser.add_argument('--poll-seconds', type=float, default=DEFAULT_POLL_SECONDS, help='Seconds between polls.')
+    parser.add_argument('--quiet-seconds', type=float, default=DEFAULT_QUIET_SECONDS,
+                        help='How long a change must stay unchanged before the spreadsheet is processed.')
+    parser.add_argument('--backoff-seconds', type=float, default=DEFAULT_BACKOFF_SECONDS,
+                        help='How long a spreadsheet that failed is left alone; doubles with each failure in a row.')
+    parser.add_argument('--state-file', type=str, default=None, help='JSON file of the states last processed.')
+    return parser.parse_args()
+
+def probe_state(service, audio_sheet_name, probe_ranges=DEFAULT_PROBE_RANGES):
+    """Return a state function hashing the Audio grid size and one batchGet of its probe ranges.
+
+    The state is None, and the error printed, when either read fails.
+    """
+    def state(spreadsheet_id):
+        try:
+            sheets = service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=PROBE_FIELDS).execute().get('sheets', [])
+            response = service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[f"{audio_sheet_name}!{probe_range}" for probe_range in probe_ranges]
+            ).execute()
+        except HttpError as err:
+            print(f"Could not probe {spreadsheet_id}: {err}")
+            return None
+        grid = [sheet['properties'].get('gridProperties') for sheet in sheets
+                if sheet['properties']['title'].lower() == audio_sheet_name.lower()]
+        values = [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+        return hashlib.blake2b(json.dumps([grid, values]).encode(), digest_size=16).hexdigest()
+    return state
+
+def content_state(service, audio_sheet_name):
+    """Return a function hashing the whole Audio sheet (formulas), or giving None when it cannot be read."""
+    def state(spreadsheet_id):
+        try:
+            values = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=audio_sheet_name,
+                valueRenderOption='FORMULA'
+            ).execute().get('values', [])
+        except HttpError as err:
+            print(f"Could not read {audio_sheet_name} of {spreadsheet_id}: {err}")
+            return None
+        return hashlib.blake2b(json.dumps(values).encode(), digest_size=16).hexdigest()
+    return state
+
+class Watcher:
+    """Polls the change state of spreadsheets and says which are due for a run.
+
+    state(spreadsheet_id) returns a string that changes whenever the Audio sheet
+    does, or None when it cannot be fetched; the spreadsheet is then left
+    alone for backoff_seconds (doubling with each failure in a row, up to
+    max_backoff_seconds), and so is one whose run failed. Pass settle (a
+    function hashing the Audio contents, e.g. content_state) when the
+    pipeline's own writes change the state, as they do the Drive version: the
+    state fetched again after a run then counts as processed, but only if
+    settle gives the same hash before and after the run. Otherwise the
+    spreadsheet stays unprocessed and is run again.
+    """
+
+    def __init__(self, spreadsheet_ids, state, quiet_seconds=DEFAULT_QUIET_SECONDS, state_file=None,
+                 settle=None, clock=time.monotonic, backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                 max_backoff_seconds=MAX_BACKOFF_SECONDS):
+        self.spreadsheet_ids = list(spreadsheet_ids)
+        self.state = state
+        self.quiet_seconds = quiet_seconds
+        self.state_file = state_file
+        self.settle = settle
+        self.clock = clock
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.processed = self._read()
+        self.pending = {}  # spreadsheet id -> (state, when it was first seen)
+        self.failures = {}  # spreadsheet id -> (failures in a row, when to try again)
+        self.before_run = {}  # spreadsheet id -> settle hash taken when it became due
+
+    def _read(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _write(self):
+        if not self.state_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.processed, f)
+        os.replace(tmp_path, self.state_file)
+
+    def due(self):
+        """Fetch every state and return the spreadsheets whose change has been quiet for quiet_seconds."""
+        now = self.clock()
+        due = []
+        for spreadsheet_id in self.spreadsheet_ids:
+            failure = self.failures.get(spreadsheet_id)
+            if failure and now < failure[1]:
+                continue
+            current = self.state(spreadsheet_id)
+            if current is None:
+                self.mark_failed(spreadsheet_id)
+                continue
+            if current == self.processed.get(spreadsheet_id):
+                self.pending.pop(spreadsheet_id, None)
+                self.failures.pop(spreadsheet_id, None)
+                continue
+            pending = self.pending.get(spreadsheet_id)
+            if pending is None or pending[0] != current:
+                # A new edit starts the quiet period again
+                pending = self.pending[spreadsheet_id] = (current, now)
+            if now - pending[1] >= self.quiet_seconds:
+                due.append(spreadsheet_id)
+                if self.settle:
+                    self.before_run[spreadsheet_id] = self.settle(spreadsheet_id)
+        return due
+
+    def mark_processed(self, spreadsheet_id):
+        state, _ = self.pending.pop(spreadsheet_id)
+        self.failures.pop(spreadsheet_id, None)
+        if self.settle:
+            before = self.before_run.pop(spreadsheet_id, None)
+            # The state first, so an edit made after the hash below moves it past what is stored
+            state = self.state(spreadsheet_id)
+            if state is None or before is None or self.settle(spreadsheet_id) != before:
+                # Audio changed while the pipeline ran (or could not be checked): run it again
+                return
+        self.processed[spreadsheet_id] = state
+        self._write()
+
+    def mark_failed(self, spreadsheet_id):
+        failures = self.failures.get(spreadsheet_id, (0, None))[0] + 1
+        delay = min(self.backoff_seconds * 2 ** (failures - 1), self.max_backoff_seconds)
+        self.failures[spreadsheet_id] = (failures, self.clock() + delay)
+        print(f"{spreadsheet_id}: {failures} failure(s) in a row, next try in {delay:.0f}s")
+
+def watch(watcher, run, poll_seconds=DEFAULT_POLL_SECONDS, sleep=time.sleep, max_polls=None):
+    """Poll forever (or max_polls times), calling run(spreadsheet_ids) with the due ones.
+
+    run returns run_batches-style results; spreadsheets that failed stay due
+    and are tried again once their backoff has passed.
+    """
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        due = watcher.due()
+        if due:
+            for result in run(due):
+                if result['status'] == 'ok':
+                    watcher.mark_processed(result['spreadsheet_id'])
+                else:
+                    watcher.mark_failed(result['spreadsheet_id'])
+        polls += 1
+        if max_polls is None or polls < max_polls:
+            sleep(poll_seconds)
+
+def main():
+    args = parse_arguments()
+    spreadsheet_ids = list(args.spreadsheet_ids)
+    if args.manifest:
+        spreadsheet_ids += read_manifest(args.manifest)
+    if not spreadsheet_ids:
+        sys.exit('No spreadsheet IDs given; use --spreadsheet-ids or --manifest.')
+
+    scopes = SCOPES + [DRIVE_METADATA_SCOPE] if args.change_detection == 'drive' else SCOPES
+    creds = get_credentials(args.credentials_file, args.token_file, scopes)
+    limiter = SheetsRateLimiter(args.read_requests_per_minute, args.write_requests_per_minute, args.max_retries)
+    metrics = CallMetrics() if args.metrics_json or args.metrics_prom else None
+
+    def service_factory():
+        return wrap_service(build_sheets_service(creds), limiter, metrics)
+
+    settle = None
+    if args.change_detection == 'drive':
+        from snapshot_cache import drive_version_state
+        state = drive_version_state(creds)
+        settle = content_state(service_factory(), args.audio_sheet_name)
+    else:
+        state = probe_state(service_factory(), args.audio_sheet_name, args.probe_ranges)
+    watcher = Watcher(spreadsheet_ids, state, args.quiet_seconds, args.state_file,
+                      settle=settle, backoff_seconds=args.backoff_seconds)
+
+    def run(due):
+        print(f"{time.strftime('%H:%M:%S')} processing {len(due)} changed spreadsheet(s)")
+        start = time.perf_counter()
+        results = run_batches(due, service_factory, args.workers,
+                              audio_sheet_name=args.audio_sheet_name,
+                              raw_sheet_name=args.raw_sheet_name,
+                              target_sheet_name=args.target_sheet_name,
+                              raw_mode=args.raw_mode,
+                              formula_mode=args.formula_mode,
+                              summary_mode=args.summary_mode,
+                              rebuild_mode=args.rebuild_mode)
+        print_results(results, time.perf_counter() - start)
+        print(limiter.report())
+        if metrics:
+            metrics.export(args.metrics_json, args.metrics_prom)
+        return results
+
+    try:
+        watch(watcher, run, args.poll_seconds)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''python xlsx_backend.py
+--input batch.xlsx
+--output batch_processed.xlsx
+--raw-mode values
+--summary-mode values
+
+Runs the pipeline against a local workbook instead of a Google spreadsheet
+(needs openpyxl: pip install openpyxl). XlsxSheetsService answers the same
+spreadsheets()/values() calls as the Sheets service, so copy_columns,
+create_or_update_sheet and additional_operations run unchanged. The workbook
+is streamed in with a read-only openpyxl workbook, edited in memory and
+streamed out with a write-only one, so no API quota is used at all.
+
+openpyxl never calculates formulas, so what a formula evaluates to cannot be
+read back before the file is opened in a spreadsheet program. pipeline.py
+never reads RawAuto back, which is why this runs it rather than the two
+scripts. Cell formatting and column widths are not carried over, and the
+ARRAYFORMULA modes only work once the file is opened in Google Sheets.
+'''
+
+import argparse
+import datetime
+import os
+import time
+
+from cli_options import mode_options
+from fake_sheets_service import FakeSheetsService
+from pipeline import run_pipeline
+
+try:
+    import openpyxl
+    from openpyxl.utils.datetime import to_excel
+except ImportError:  # pragma: no cover - optional dependency
+    openpyxl = None
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run the Audio -> RawAuto -> summary pipeline on a local .xlsx workbook.",
+                                     parents=[mode_options(rebuild_mode=False, district_index=False)])
+    parser.add_argument('--input', type=str, required=True, help='Workbook with the Audio sheet.')
+    parser.add_argument('--output', type=str, default=None, help='Where to save the result (default: <input>_processed.xlsx).')
+    parser.add_argument('--audio-sheet-name', type=str, default='Audio', help='Name of the Audio sheet.')
+    parser.add_argument('--raw-sheet-name', type=str, default='RawAuto', help='Name of the raw sheet.')
+    parser.add_argument('--target-sheet-name', type=str, default='BatchAudioSummaryAuto', help='Name of the summary sheet.')
+    parser.set_defaults(raw_mode='values', summary_mode='values')
+    return parser.parse_args()
+
+def _cell_value(value):
+    # The API returns dates as serial numbers under FORMULA and UNFORMATTED_VALUE rendering
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return to_excel(value)
+    return value
+
+def _read_rows(worksheet):
+    rows = []
+    for row in worksheet.iter_rows(values_only=True):
+        row = [_cell_value(value) for value in row]
+        while row and row[-1] in (None, ''):
+            row.pop()
+        rows.append(row)
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+class XlsxSheetsService(FakeSheetsService):
+    """Sheets service stand-in whose spreadsheets are loaded from and saved to .xlsx files."""
+
+    def __init__(self):
+        if openpyxl is None:
+            raise ImportError("The XLSX backend needs openpyxl; install it with 'pip install openpyxl'.")
+        super().__init__()
+
+    def open_workbook(self, path, spreadsheet_id=None):
+        """Load every sheet of the workbook at path and return the spreadsheet ID to pass to the stages."""
+        spreadsheet_id = spreadsheet_id or path
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            sheets = {worksheet.title: _read_rows(worksheet) for worksheet in workbook.worksheets}
+        finally:
+            workbook.close()
+        self.add_spreadsheet(spreadsheet_id, sheets, title=os.path.basename(path))
+        return spreadsheet_id
+
+    def save_workbook(self, spreadsheet_id, path):
+        """Write every sheet of spreadsheet_id, in tab order, to a new workbook at path."""
+        workbook = openpyxl.Workbook(write_only=True)
+        with self.lock:
+            for sheet in self._spreadsheet(spreadsheet_id)['sheets']:
+                worksheet = workbook.create_sheet(sheet['properties']['title'])
+                for row in sheet['rows']:
+                    worksheet.append([None if value == '' else value for value in row])
+        workbook.save(path)
+
+    def _execute(self, request):
+        # No latency, quota or payload accounting: calls go straight to the in-memory workbook
+        with self.lock:
+            self.calls[request.method] += 1
+            return request.handler()
+
+def main():
+    args = parse_arguments()
+    output = args.output or f"{os.path.splitext(args.input)[0]}_processed.xlsx"
+
+    service = XlsxSheetsService()
+    start = time.perf_counter()
+    spreadsheet_id = service.open_workbook(args.input)
+    print(f"read {args.input}: {time.perf_counter() - start:.2f}s")
+
+    timings = run_pipeline(service, spreadsheet_id, args.audio_sheet_name, args.raw_sheet_name, args.target_sheet_name,
+                           args.summary_mode, raw_mode=args.raw_mode, formula_mode=args.formula_mode)
+    for stage, seconds in timings.items():
+        print(f"{stage}: {seconds:.2f}s")
+    totals = [row[1] for row in service.sheet_values(spreadsheet_id, args.target_sheet_name)[1:10] if len(row) > 1]
+    if args.summary_mode == 'values' and not any(totals):
+        print(f"Warning: every total in {args.target_sheet_name} is 0; check the layout of the {args.audio_sheet_name} sheet.")
+
+    start = time.perf_counter()
+    service.save_workbook(spreadsheet_id, output)
+    print(f"wrote {output}: {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()